@@ -0,0 +1,146 @@
+"""
+Motor de reglas SLA para detectar pacientes detenidos en el proceso.
+
+Todas las reglas se evalúan en una sola pasada vectorizada sobre el dataset
+completo. El resultado son colas de trabajo precalculadas: para cada regla,
+la lista de filas (índice del DataFrame) que la incumplen.
+"""
+import threading
+from datetime import date
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from indicadores import VALORES_SI
+
+# Cada regla marca a los pacientes cuya fase 'desde' lleva más de 'dias'
+# días sin que se complete la fase siguiente. La fase siguiente se da por
+# completada si 'hasta' tiene fecha o si la columna 'marca' vale SI.
+REGLAS_SLA = [
+    {
+        'id': 'registro_sin_toma',
+        'nombre': 'Registrado sin toma de muestra',
+        'desde': 'FECHA REGISTRO',
+        'hasta': 'FECHA TOMA MUESTRA',
+        'dias': 15,
+    },
+    {
+        'id': 'toma_sin_envio',
+        'nombre': 'Muestra tomada sin enviar',
+        'desde': 'FECHA TOMA MUESTRA',
+        'hasta': 'FECHA ENVIO MUESTRAS A ESPAÑA',
+        'marca': 'MUESTRA ENVIADA A ESPAÑA',
+        'dias': 10,
+    },
+    {
+        'id': 'envio_sin_recibido',
+        'nombre': 'Enviada a España sin recibir',
+        'desde': 'FECHA ENVIO MUESTRAS A ESPAÑA',
+        'hasta': 'FECHA DE RECIBIDO',
+        'dias': 45,
+    },
+    {
+        'id': 'recibido_sin_entregar',
+        'nombre': 'Resultados recibidos sin enviar',
+        'desde': 'FECHA DE RECIBIDO',
+        'marca': 'RESULTADOS ENVIADOS',
+        'dias': 7,
+    },
+]
+
+# Resultados guardados por (versión de datos, firma de reglas, día): las
+# colas dependen de la fecha de hoy, así que se recalculan cada día aunque
+# los datos no cambien
+MAX_RESULTADOS = 8
+
+_ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alertas-sla')
+_trabajos = OrderedDict()
+_lock = threading.Lock()
+
+
+def _fechas(df, columna):
+    """Convierte una columna a datetime64 una sola vez, tolerando texto"""
+    if columna not in df.columns:
+        return None
+    serie = df[columna]
+    if not pd.api.types.is_datetime64_any_dtype(serie):
+        serie = pd.to_datetime(serie, errors='coerce', dayfirst=True)
+    return serie.to_numpy(dtype='datetime64[ns]')
+
+
+def evaluar_reglas(df, reglas=REGLAS_SLA, hoy=None):
+    """
+    Evalúa todas las reglas sobre el DataFrame.
+
+    Retorna un diccionario {id_regla: [índices de filas]}.
+    """
+    hoy = pd.Timestamp(hoy if hoy is not None else pd.Timestamp.now()).normalize()
+    hoy = np.datetime64(hoy.to_datetime64(), 'ns')
+
+    # Cada columna se convierte una sola vez aunque la usen varias reglas
+    cache = {}
+
+    def fechas(columna):
+        if columna not in cache:
+            cache[columna] = _fechas(df, columna)
+        return cache[columna]
+
+    colas = {}
+    for regla in reglas:
+        desde = fechas(regla['desde'])
+        if desde is None:
+            colas[regla['id']] = []
+            continue
+
+        limite = np.timedelta64(int(regla['dias']), 'D')
+        vencida = ~np.isnat(desde) & ((hoy - desde) > limite)
+
+        hasta = fechas(regla['hasta']) if regla.get('hasta') else None
+        if hasta is not None:
+            vencida &= np.isnat(hasta)
+
+        marca = regla.get('marca')
+        if marca and marca in df.columns:
+            vencida &= ~df[marca].isin(VALORES_SI).to_numpy()
+
+        colas[regla['id']] = df.index[vencida].tolist()
+
+    return colas
+
+
+def firma_reglas(reglas):
+    """Identifica una configuración de reglas para usarla como clave"""
+    return tuple((r['id'], r['desde'], r.get('hasta'), r.get('marca'), r['dias']) for r in reglas)
+
+
+def programar_evaluacion(df, version, reglas=REGLAS_SLA):
+    """
+    Lanza la evaluación en segundo plano tras una carga de datos.
+
+    Si esa versión de datos ya fue evaluada hoy (o se está evaluando) con
+    las mismas reglas, no hace nada.
+    """
+    hoy = date.today()
+    clave = (version, firma_reglas(reglas), hoy)
+    with _lock:
+        if clave in _trabajos:
+            _trabajos.move_to_end(clave)
+            return _trabajos[clave]
+
+        trabajo = _ejecutor.submit(evaluar_reglas, df, reglas, hoy)
+        _trabajos[clave] = trabajo
+        while len(_trabajos) > MAX_RESULTADOS:
+            _trabajos.popitem(last=False)
+        return trabajo
+
+
+def colas_de_trabajo(version, reglas=REGLAS_SLA):
+    """Devuelve las colas precalculadas hoy, o None si aún no están listas"""
+    with _lock:
+        trabajo = _trabajos.get((version, firma_reglas(reglas), date.today()))
+
+    if trabajo is None or not trabajo.done():
+        return None
+    return trabajo.result()
@@ -0,0 +1,372 @@
+"""
+API JSON local con los KPIs, el embudo, las facetas y los pacientes del
+dashboard, para herramientas que hoy solo podrían leer la interfaz.
+
+Usa el mismo motor que los dashboards. Cada respuesta lleva un ETag que
+depende de la versión del dataset y de la URL pedida: un cliente que
+repite la consulta con If-None-Match recibe 304 sin que se calcule nada
+mientras los datos no cambien. Las listas de pacientes se paginan con un
+cursor opaco.
+
+    GET /api/estado                       versión, filas y facetas disponibles
+    GET /api/kpis?EPS=SANITAS&q=perez     KPIs y embudo de la selección
+    GET /api/embudo?CIUDAD=BOGOTA         fases del embudo
+    GET /api/facetas?EPS=SANITAS          conteo por opción de cada faceta
+    GET /api/sugerencias?columna=SEDES&q=nor  valores de una faceta que coinciden con q
+    GET /api/pacientes?limite=100&cursor= página de pacientes (todas las columnas)
+    GET /api/pacientes/<cedula>           registro completo de un paciente
+
+Los filtros son parámetros con el nombre de la columna de faceta (se
+pueden repetir para elegir varios valores) y q, el texto de búsqueda.
+
+Uso:
+    python api.py [datos/tmz.xlsx] [--puerto 8600] [--direccion 127.0.0.1]
+                  [--recargar 30]
+
+Sin archivo sirve el almacén maestro y revisa cada --recargar segundos si
+cambió en disco. Junto a Streamlit: TMZ_API_PUERTO=8600 streamlit run
+dashboard.py.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
+
+import auditoria
+import facetas
+import maestro
+import motor
+
+PUERTO = 8600
+
+FASES_EMBUDO = ['Registrados', 'Muestra Tomada', 'Enviadas España', 'Resultados', 'Completados']
+
+# Tamaño de página de /api/pacientes
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+# Parámetros que no son filtros de faceta
+PARAMETROS = {'q', 'limite', 'cursor'}
+
+# Posiciones de filas guardadas por (versión, filtros, búsqueda), para que
+# recorrer las páginas no repita el filtrado
+MAX_SELECCIONES = 32
+
+_selecciones = OrderedDict()
+_lock = threading.Lock()
+
+
+# ------------------------------------------
+# Selección y serialización
+# ------------------------------------------
+
+def _filtros(indice, argumentos):
+    """Filtros de faceta {columna: [valores]} a partir de los parámetros"""
+    filtros = {}
+    for columna, valores in argumentos.items():
+        if columna in PARAMETROS:
+            continue
+        datos = indice['columnas'].get(columna)
+        if datos is None:
+            raise tornado.web.HTTPError(400, reason=f"Faceta desconocida: {columna}")
+        # Los valores llegan como texto; la faceta puede guardar números
+        por_texto = {str(v): v for v in datos['valores']}
+        filtros[columna] = [por_texto.get(v.decode('utf-8'), v.decode('utf-8')) for v in valores]
+    return filtros
+
+
+def posiciones(dataset, filtros, busqueda=""):
+    """Posiciones (ordenadas) de las filas que cumplen filtros y búsqueda"""
+    clave = (dataset['version'], tuple(sorted((c, tuple(v)) for c, v in filtros.items())), busqueda)
+    with _lock:
+        if clave in _selecciones:
+            _selecciones.move_to_end(clave)
+            return _selecciones[clave]
+
+    resultado = np.flatnonzero(motor.aplicar_filtros(dataset, filtros, busqueda=busqueda))
+
+    with _lock:
+        _selecciones[clave] = resultado
+        while len(_selecciones) > MAX_SELECCIONES:
+            _selecciones.popitem(last=False)
+    return resultado
+
+
+def codificar_cursor(version, posicion):
+    """Cursor opaco: versión del dataset y última posición entregada"""
+    texto = json.dumps([version, int(posicion)])
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    """(versión, posición) de un cursor, o HTTPError 400 si no es válido"""
+    try:
+        version, posicion = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return version, int(posicion)
+    except (ValueError, TypeError):
+        raise tornado.web.HTTPError(400, reason="Cursor inválido")
+
+
+def registros(df):
+    """Filas como lista de diccionarios JSON (fechas ISO, vacíos como null)"""
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False))
+
+
+def _a_json(valor):
+    """Tipos de numpy/pandas que json no conoce"""
+    if isinstance(valor, np.integer):
+        return int(valor)
+    if isinstance(valor, np.floating):
+        return None if np.isnan(valor) else float(valor)
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    return str(valor)
+
+
+# ------------------------------------------
+# Handlers
+# ------------------------------------------
+
+class BaseHandler(tornado.web.RequestHandler):
+    """
+    Toma el dataset vigente una vez por petición y responde 304 antes de
+    calcular nada si el cliente ya tiene esta versión de la respuesta.
+    """
+
+    def initialize(self, obtener_dataset):
+        self.obtener_dataset = obtener_dataset
+
+    def prepare(self):
+        self.dataset = self.obtener_dataset()
+        if self.dataset is None:
+            raise tornado.web.HTTPError(503, reason="Aún no hay datos cargados")
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+
+    def compute_etag(self):
+        huella = hashlib.sha1(f"{self.dataset['version']}|{self.request.uri}".encode('utf-8'))
+        return f'"{huella.hexdigest()[:20]}"'
+
+    def responder(self, datos):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.finish(json.dumps(datos, ensure_ascii=False, default=_a_json))
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.finish(json.dumps({'error': self._reason}, ensure_ascii=False))
+
+    def usuario(self):
+        """Quién pide, para la auditoría: el usuario del proxy (si es confiable) o la IP"""
+        return auditoria.usuario_de(cabeceras=self.request.headers, ip=self.request.remote_ip)
+
+    def seleccion(self):
+        """Filtros y búsqueda de la petición"""
+        filtros = _filtros(self.dataset['indice_facetas'], self.request.query_arguments)
+        return filtros, self.get_query_argument('q', '').strip()
+
+
+class EstadoHandler(BaseHandler):
+    def get(self):
+        self.responder({
+            'version': self.dataset['version'],
+            'filas': len(self.dataset['df']),
+            'facetas': list(self.dataset['indice_facetas']['columnas']),
+        })
+
+
+class KpisHandler(BaseHandler):
+    def get(self):
+        filtros, busqueda = self.seleccion()
+        elegidos = motor.seleccion(self.dataset, posiciones(self.dataset, filtros, busqueda))
+        self.responder({
+            'version': self.dataset['version'],
+            'kpis': motor.calcular_kpis(elegidos),
+            'embudo': dict(zip(FASES_EMBUDO, motor.calcular_embudo(elegidos))),
+        })
+
+
+class EmbudoHandler(BaseHandler):
+    def get(self):
+        filtros, busqueda = self.seleccion()
+        elegidos = motor.seleccion(self.dataset, posiciones(self.dataset, filtros, busqueda))
+        self.responder({
+            'version': self.dataset['version'],
+            'fases': [
+                {'fase': fase, 'pacientes': valor}
+                for fase, valor in zip(FASES_EMBUDO, motor.calcular_embudo(elegidos))
+            ],
+        })
+
+
+class FacetasHandler(BaseHandler):
+    def get(self):
+        filtros, busqueda = self.seleccion()
+        # Los conteos se guardan por búsqueda (sin cola SLA)
+        conteos = motor.conteos_facetas(
+            self.dataset, filtros, busqueda, clave_base=(busqueda, None)
+        )
+        self.responder({
+            'version': self.dataset['version'],
+            'facetas': {columna: {str(v): n for v, n in opciones.items()} for columna, opciones in conteos.items()},
+        })
+
+
+class SugerenciasHandler(BaseHandler):
+    def get(self):
+        columna = self.get_query_argument('columna', '')
+        if columna not in self.dataset['indice_facetas'].get('sugerencias', {}):
+            raise tornado.web.HTTPError(400, reason=f"Columna sin sugerencias: {columna}")
+        try:
+            limite = int(self.get_query_argument('limite', facetas.MAX_SUGERENCIAS))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="limite debe ser un entero")
+        texto = self.get_query_argument('q', '')
+        self.responder({
+            'version': self.dataset['version'],
+            'columna': columna,
+            'sugerencias': motor.sugerencias(self.dataset, columna, texto, max(1, min(limite, LIMITE_MAXIMO))),
+        })
+
+
+class PacientesHandler(BaseHandler):
+    def get(self):
+        filtros, busqueda = self.seleccion()
+        try:
+            limite = int(self.get_query_argument('limite', LIMITE_POR_DEFECTO))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="limite debe ser un entero")
+        limite = max(1, min(limite, LIMITE_MAXIMO))
+
+        version = self.dataset['version']
+        filas = posiciones(self.dataset, filtros, busqueda)
+        inicio = 0
+        cursor = self.get_query_argument('cursor', '')
+        if cursor:
+            version_cursor, ultima = decodificar_cursor(cursor)
+            if version_cursor != version:
+                raise tornado.web.HTTPError(
+                    409, reason="Los datos cambiaron; vuelve a pedir la primera página"
+                )
+            inicio = int(np.searchsorted(filas, ultima, side='right'))
+
+        pagina = filas[inicio:inicio + limite]
+        auditoria.registrar(
+            'exportar', usuario=self.usuario(), sesion='api', contenido='pacientes',
+            formato='json', filas=len(pagina), filtros=filtros, busqueda=busqueda,
+            version=version,
+        )
+        siguiente = None
+        if inicio + limite < len(filas):
+            siguiente = codificar_cursor(version, pagina[-1])
+        self.responder({
+            'version': version,
+            'total': len(filas),
+            'pacientes': registros(motor.filas_completas(self.dataset, pagina)),
+            'siguiente': siguiente,
+        })
+
+
+class PacienteHandler(BaseHandler):
+    def get(self, cedula):
+        paciente = motor.obtener_paciente(self.dataset, cedula)
+        if paciente is None:
+            raise tornado.web.HTTPError(404, reason=f"No hay paciente con CEDULA {cedula}")
+        auditoria.registrar(
+            'ver_paciente', usuario=self.usuario(), sesion='api',
+            cedula=motor.clave_cedula(cedula), version=self.dataset['version'],
+        )
+        self.responder({
+            'version': self.dataset['version'],
+            'paciente': json.loads(pd.Series(paciente, dtype=object).to_json(
+                date_format='iso', force_ascii=False
+            )),
+        })
+
+
+# ------------------------------------------
+# Servidor
+# ------------------------------------------
+
+def crear_aplicacion(obtener_dataset):
+    """
+    Aplicación de tornado. obtener_dataset() devuelve el dataset vigente
+    (o None): se llama en cada petición, así que ve las nuevas cargas.
+    """
+    argumentos = {'obtener_dataset': obtener_dataset}
+    return tornado.web.Application([
+        (r'/api/estado', EstadoHandler, argumentos),
+        (r'/api/kpis', KpisHandler, argumentos),
+        (r'/api/embudo', EmbudoHandler, argumentos),
+        (r'/api/facetas', FacetasHandler, argumentos),
+        (r'/api/sugerencias', SugerenciasHandler, argumentos),
+        (r'/api/pacientes', PacientesHandler, argumentos),
+        (r'/api/pacientes/([^/]+)', PacienteHandler, argumentos),
+    ])
+
+
+def iniciar_en_hilo(obtener_dataset, puerto=PUERTO, direccion='127.0.0.1'):
+    """
+    Sirve la API en un hilo con su propio event loop (p. ej. junto a
+    Streamlit). El puerto se abre antes de retornar, así que un puerto
+    ocupado falla aquí. Retorna el hilo.
+    """
+    sockets = bind_sockets(puerto, address=direccion)
+
+    def servir():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        HTTPServer(crear_aplicacion(obtener_dataset)).add_sockets(sockets)
+        IOLoop.current().start()
+
+    hilo = threading.Thread(target=servir, name='api-tmz', daemon=True)
+    hilo.start()
+    return hilo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('origen', nargs='?', help='Excel de pacientes (por defecto, el almacén maestro)')
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--direccion', default='127.0.0.1')
+    parser.add_argument('--recargar', type=float, default=30,
+                        help='segundos entre revisiones del maestro en disco (0 para no revisar)')
+    args = parser.parse_args()
+
+    if args.origen:
+        estado = {'dataset': motor.cargar_dataset(args.origen)}
+    else:
+        if not maestro.existe():
+            sys.exit("❌ No hay almacén maestro: indica un Excel de pacientes")
+        estado = motor.abrir_maestro()
+
+    async def servir():
+        aplicacion = crear_aplicacion(lambda: estado['dataset'])
+        aplicacion.listen(args.puerto, address=args.direccion)
+        if not args.origen and args.recargar > 0:
+            def revisar():
+                # Otra instancia (el dashboard) pudo fusionar una carga
+                if maestro.version_en_disco() != estado['version']:
+                    estado.update(motor.abrir_maestro())
+            PeriodicCallback(revisar, args.recargar * 1000).start()
+        print(f"API en http://{args.direccion}:{args.puerto}/api/estado "
+              f"(versión {estado['dataset']['version']})")
+        await asyncio.Event().wait()
+
+    asyncio.run(servir())
+
+
+if __name__ == '__main__':
+    main()
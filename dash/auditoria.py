@@ -0,0 +1,287 @@
+"""
+Registro de auditoría de acceso a datos de pacientes.
+
+Quién vio qué paciente y quién exportó qué. registrar() solo pone el
+evento en una cola en memoria (no toca la base en el rerun); un hilo
+escritor lo vacía por lotes en una base SQLite de solo inserción. La cola
+es acotada: si sigue llena tras una espera breve, el evento se agrega a
+un archivo de respaldo (JSONL, solo agregar). Lo mismo pasa con un lote
+que SQLite rechaza tras varios reintentos. El escritor pasa el respaldo a
+la base en cuanto puede, así que ningún evento se pierde. Al terminar el
+proceso se escribe lo pendiente.
+
+    auditoria.registrar('ver_paciente', usuario='ana@ips.co', sesion=id, cedula='79153295')
+
+La base queda en TMZ_DATOS/auditoria.sqlite (tabla eventos), con
+triggers que impiden modificar o borrar filas.
+
+El usuario que informa un proxy (cabecera X-Forwarded-User) solo se
+acepta con TMZ_PROXY_CONFIABLE=1, es decir, cuando la app solo es
+accesible a través de un proxy que fija esa cabecera; si no, cualquier
+cliente podría falsearla (ver usuario_de).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+RUTA_AUDITORIA = Path(os.environ.get('TMZ_DATOS', BASE / 'datos')) / 'auditoria.sqlite'
+RUTA_RESPALDO = RUTA_AUDITORIA.with_suffix('.pendientes.jsonl')
+
+PROXY_CONFIABLE = os.environ.get('TMZ_PROXY_CONFIABLE', '').strip().lower() in ('1', 'si', 'sí', 'true')
+
+# Eventos en espera como máximo; con la cola llena registrar() espera
+# hasta ESPERA_COLA segundos y después usa el archivo de respaldo
+MAX_EN_COLA = 10_000
+ESPERA_COLA = 0.05
+
+# Intentos de escribir un lote en SQLite antes de pasarlo al respaldo
+REINTENTOS = 3
+
+# El escritor agrupa hasta TAMANO_LOTE eventos o los que lleguen en
+# INTERVALO segundos desde el primero, lo que ocurra antes
+TAMANO_LOTE = 500
+INTERVALO = 1.0
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS eventos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fecha TEXT NOT NULL,
+    usuario TEXT,
+    sesion TEXT,
+    accion TEXT NOT NULL,
+    cedula TEXT,
+    detalle TEXT
+);
+CREATE INDEX IF NOT EXISTS eventos_cedula ON eventos (cedula);
+CREATE INDEX IF NOT EXISTS eventos_usuario ON eventos (usuario, fecha);
+CREATE TRIGGER IF NOT EXISTS eventos_sin_cambios BEFORE UPDATE ON eventos
+BEGIN SELECT RAISE(ABORT, 'La auditoría es de solo inserción'); END;
+CREATE TRIGGER IF NOT EXISTS eventos_sin_borrado BEFORE DELETE ON eventos
+BEGIN SELECT RAISE(ABORT, 'La auditoría es de solo inserción'); END;
+"""
+
+INSERTAR = (
+    "INSERT INTO eventos (fecha, usuario, sesion, accion, cedula, detalle) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+_FIN = object()
+
+_log = logging.getLogger(__name__)
+
+_cola = queue.Queue(maxsize=MAX_EN_COLA)
+_escritor = None
+_respaldados = 0
+_lock = threading.Lock()
+_lock_respaldo = threading.Lock()
+
+
+def usuario_de(autenticado=None, cabeceras=None, ip=None):
+    """
+    Quién hace la petición: el usuario autenticado, el que informa el proxy
+    (solo con PROXY_CONFIABLE) o, si no hay ninguno, la IP
+    """
+    proxy = cabeceras.get('X-Forwarded-User') if PROXY_CONFIABLE and cabeceras else None
+    return autenticado or proxy or ip or 'anónimo'
+
+
+def conectar(ruta=None):
+    """Conexión a la base de auditoría (la crea si no existe)"""
+    ruta = Path(ruta) if ruta is not None else RUTA_AUDITORIA
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    conexion = sqlite3.connect(ruta, timeout=30)
+    conexion.execute('PRAGMA journal_mode=WAL')
+    conexion.executescript(ESQUEMA)
+    return conexion
+
+
+def _escribir(conexion, eventos):
+    with conexion:
+        conexion.executemany(INSERTAR, eventos)
+
+
+def _respaldar(eventos):
+    """Agrega eventos al archivo de respaldo, una línea JSON por evento"""
+    global _respaldados
+    lineas = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in eventos)
+    with _lock_respaldo:
+        RUTA_RESPALDO.parent.mkdir(parents=True, exist_ok=True)
+        with open(RUTA_RESPALDO, 'a', encoding='utf-8') as archivo:
+            archivo.write(lineas)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        _respaldados += len(eventos)
+
+
+def _recuperar(conexion):
+    """Pasa a la base los eventos del respaldo y lo borra (si existe)"""
+    with _lock_respaldo:
+        if not RUTA_RESPALDO.exists():
+            return
+        eventos = []
+        with open(RUTA_RESPALDO, encoding='utf-8') as archivo:
+            for linea in archivo:
+                try:
+                    eventos.append(tuple(json.loads(linea)))
+                except ValueError:
+                    # Línea cortada por una caída a mitad de escritura
+                    if linea.strip():
+                        _log.error("Línea ilegible en el respaldo de auditoría: %r", linea)
+        if eventos:
+            _escribir(conexion, eventos)
+        RUTA_RESPALDO.unlink()
+
+
+def _guardar_lote(conexion, eventos):
+    """Escribe un lote con reintentos; si SQLite sigue fallando, al respaldo"""
+    for intento in range(REINTENTOS):
+        try:
+            _escribir(conexion, eventos)
+            return True
+        except sqlite3.Error:
+            _log.warning("Falló la escritura de un lote de auditoría (intento %d)", intento + 1)
+            time.sleep(0.1 * 2 ** intento)
+    _log.error("Lote de auditoría de %d eventos guardado en %s", len(eventos), RUTA_RESPALDO)
+    _respaldar(eventos)
+    return False
+
+
+def _escribir_lotes():
+    """Hilo escritor: toma un evento, junta los que lleguen y los inserta juntos"""
+    conexion = conectar()
+    try:
+        # Lo que haya quedado en el respaldo de un proceso anterior
+        _recuperar(conexion)
+    except (OSError, sqlite3.Error):
+        _log.exception("No se pudo recuperar el respaldo de auditoría")
+    terminar = False
+    while not terminar:
+        lote = [_cola.get()]
+        limite = time.monotonic() + INTERVALO
+        try:
+            while lote[-1] is not _FIN and len(lote) < TAMANO_LOTE:
+                lote.append(_cola.get(timeout=max(0, limite - time.monotonic())))
+        except queue.Empty:
+            pass
+        eventos = [e for e in lote if e is not _FIN]
+        terminar = len(eventos) < len(lote)
+        try:
+            if eventos and _guardar_lote(conexion, eventos):
+                # La base responde: se recupera lo que haya quedado en el respaldo
+                _recuperar(conexion)
+        except (OSError, sqlite3.Error):
+            # El escritor sigue vivo; lo que no se pudo mover queda en el respaldo
+            _log.exception("No se pudo recuperar el respaldo de auditoría")
+        finally:
+            for _ in lote:
+                _cola.task_done()
+    conexion.close()
+
+
+def _iniciar():
+    global _escritor
+    with _lock:
+        if _escritor is None or not _escritor.is_alive():
+            _escritor = threading.Thread(target=_escribir_lotes, name='auditoria', daemon=True)
+            _escritor.start()
+
+
+def registrar(accion, usuario=None, sesion=None, cedula=None, **detalle):
+    """
+    Encola un evento (no toca la base). accion: 'ver_paciente', 'exportar'...;
+    detalle: datos adicionales (formato, filas, filtros), guardados en JSON.
+    """
+    evento = (
+        datetime.now().isoformat(timespec='milliseconds'),
+        usuario,
+        sesion,
+        accion,
+        None if cedula is None else str(cedula),
+        json.dumps(detalle, ensure_ascii=False, default=str) if detalle else None,
+    )
+    _iniciar()
+    try:
+        _cola.put(evento, timeout=ESPERA_COLA)
+    except queue.Full:
+        # Escritor atrasado: el evento va al respaldo y el escritor lo recupera
+        _respaldar([evento])
+
+
+def vaciar():
+    """Espera a que todo lo encolado esté escrito"""
+    if _escritor is not None and _escritor.is_alive():
+        _cola.join()
+
+
+def _respaldar_cola():
+    """Pasa al respaldo lo que quedó en la cola sin que el escritor lo tomara"""
+    eventos = []
+    while True:
+        try:
+            evento = _cola.get_nowait()
+        except queue.Empty:
+            break
+        _cola.task_done()
+        if evento is not _FIN:
+            eventos.append(evento)
+    if eventos:
+        _respaldar(eventos)
+
+
+def cerrar(espera=10):
+    """Escribe lo pendiente y detiene el escritor (se llama al salir)"""
+    global _escritor
+    if _escritor is None:
+        return
+    try:
+        # Con la cola llena y el escritor caído no hay quién haga espacio
+        _cola.put(_FIN, timeout=espera if _escritor.is_alive() else 0)
+    except queue.Full:
+        pass
+    else:
+        _escritor.join(espera)
+    # Lo que el escritor no alcanzó a escribir queda en el respaldo
+    _respaldar_cola()
+    _escritor = None
+
+
+atexit.register(cerrar)
+
+
+def estado():
+    """Eventos en cola y los que pasaron por el archivo de respaldo"""
+    return {
+        'en_cola': _cola.qsize(),
+        'respaldados': _respaldados,
+        'pendientes_respaldo': RUTA_RESPALDO.exists(),
+    }
+
+
+def eventos(cedula=None, usuario=None, limite=1000, ruta=None):
+    """Últimos eventos (más recientes primero), opcionalmente por paciente o usuario"""
+    condiciones, parametros = [], []
+    if cedula is not None:
+        condiciones.append('cedula = ?')
+        parametros.append(str(cedula))
+    if usuario is not None:
+        condiciones.append('usuario = ?')
+        parametros.append(usuario)
+    donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    conexion = conectar(ruta)
+    try:
+        filas = conexion.execute(
+            f"SELECT fecha, usuario, sesion, accion, cedula, detalle FROM eventos {donde} "
+            "ORDER BY id DESC LIMIT ?", [*parametros, limite]
+        ).fetchall()
+    finally:
+        conexion.close()
+    columnas = ['fecha', 'usuario', 'sesion', 'accion', 'cedula', 'detalle']
+    return [dict(zip(columnas, fila)) for fila in filas]
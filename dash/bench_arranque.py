@@ -0,0 +1,138 @@
+"""
+Benchmark de arranque en frío de los dashboards.
+
+Cada medición corre en un proceso nuevo, sin módulos en caché:
+  - tiempo de importación de cada dependencia pesada;
+  - tiempo hasta el primer render completo de cada entry point (con el
+    AppTest de Streamlit), tiempo de un rerun y qué módulos pesados quedaron
+    importados después del primer render.
+
+Uso:
+    python bench_arranque.py [--repeticiones 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+RUTA_DATOS = BASE / 'datos' / 'tmz.xlsx'
+
+MODULOS_PESADOS = [
+    'streamlit',
+    'pandas',
+    'numpy',
+    'plotly.express',
+    'plotly.graph_objects',
+    'openpyxl',
+    'pyarrow',
+]
+
+# (nombre, script, precargar datos en la sesión)
+ESCENARIOS = [
+    ('dashboard.py (bienvenida)', 'dashboard.py', False),
+    ('dashboard_minimal.py (con datos)', 'dashboard_minimal.py', True),
+]
+
+
+def _hijo(args):
+    """
+    Ejecuta este script en un proceso nuevo y retorna su salida JSON.
+
+    El hijo usa un directorio de datos vacío para que un maestro guardado
+    no cambie la pantalla que se mide.
+    """
+    with tempfile.TemporaryDirectory() as datos:
+        salida = subprocess.run(
+            [sys.executable, __file__, *args],
+            cwd=BASE, capture_output=True, text=True, check=True,
+            env={**os.environ, 'TMZ_DATOS': datos},
+        )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def _medir_importacion(modulo):
+    t0 = time.perf_counter()
+    __import__(modulo)
+    return {'segundos': time.perf_counter() - t0}
+
+
+def _medir_render(script, con_datos):
+    sys.path.insert(0, str(BASE))
+
+    t0 = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_streamlit = time.perf_counter() - t0
+
+    app = AppTest.from_file(str(BASE / script), default_timeout=120)
+    if con_datos:
+        # La lectura del Excel no cuenta en el render (equivale al backend)
+        import motor
+        app.session_state['dataset'] = motor.cargar_dataset(RUTA_DATOS)
+    cargados_antes = {m for m in MODULOS_PESADOS if m in sys.modules}
+
+    t0 = time.perf_counter()
+    app.run()
+    primer_render = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    app.run()
+    rerun = time.perf_counter() - t0
+
+    return {
+        'import_streamlit': import_streamlit,
+        'primer_render': primer_render,
+        'rerun': rerun,
+        'errores': [str(e.value) for e in app.exception],
+        'importados': sorted(
+            m for m in MODULOS_PESADOS if m in sys.modules and m not in cargados_antes
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--importar', help=argparse.SUPPRESS)
+    parser.add_argument('--render', help=argparse.SUPPRESS)
+    parser.add_argument('--con-datos', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Modo proceso hijo
+    if args.importar:
+        print(json.dumps(_medir_importacion(args.importar)))
+        return
+    if args.render:
+        print(json.dumps(_medir_render(args.render, args.con_datos)))
+        return
+
+    print(f"Arranque en frío — mediana de {args.repeticiones} procesos nuevos\n")
+
+    print(f"{'Importación':<28}{'ms':>10}")
+    for modulo in MODULOS_PESADOS:
+        tiempos = [_hijo(['--importar', modulo])['segundos'] for _ in range(args.repeticiones)]
+        print(f"{modulo:<28}{statistics.median(tiempos) * 1000:>10.0f}")
+
+    print(f"\n{'Entry point':<36}{'streamlit':>11}{'1er render':>12}{'rerun':>9}  importados en el 1er render")
+    for nombre, script, con_datos in ESCENARIOS:
+        extra = ['--con-datos'] if con_datos else []
+        medidas = [_hijo(['--render', script, *extra]) for _ in range(args.repeticiones)]
+        errores = [e for m in medidas for e in m['errores']]
+        print(
+            f"{nombre:<36}"
+            f"{statistics.median(m['import_streamlit'] for m in medidas) * 1000:>9.0f}ms"
+            f"{statistics.median(m['primer_render'] for m in medidas) * 1000:>10.0f}ms"
+            f"{statistics.median(m['rerun'] for m in medidas) * 1000:>7.0f}ms"
+            f"  {', '.join(medidas[-1]['importados']) or '-'}"
+        )
+        if errores:
+            print(f"    ⚠️ errores: {errores[0]}")
+
+
+if __name__ == '__main__':
+    main()
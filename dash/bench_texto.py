@@ -0,0 +1,91 @@
+"""
+Benchmark del almacenamiento de texto del dataset: 'object' frente a
+'arrow' (string[pyarrow], ver carga.MODO_TEXTO).
+
+Sobre datos sintéticos del tamaño pedido mide, para cada modo, la memoria
+de la proyección caliente y del almacén frío, y la latencia (mediana) de
+preparar el dataset, copiar el DataFrame, buscar, filtrar con KPIs, abrir
+pacientes y exportar.
+
+Uso:
+    python bench_texto.py [--filas 200000] [--repeticiones 5]
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+import motor
+from carga import MODOS_TEXTO
+from prueba_carga import datos_sinteticos
+
+
+def _mediana(funcion, repeticiones):
+    """Mediana en ms de varias ejecuciones"""
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000
+
+
+def medir(df, modo, repeticiones):
+    """Memoria (MB) y latencias (ms) de un modo de texto"""
+    dataset = motor.preparar_dataset(df, version='bench', texto=modo)
+    caliente, frio = dataset['df'], dataset['df_frio']
+    cedulas = df['CEDULA'].sample(1000, random_state=0).tolist()
+    mascara = motor.aplicar_filtros(dataset, {'EPS': 'SANITAS'})
+
+    def pacientes():
+        for cedula in cedulas:
+            motor.obtener_paciente(dataset, cedula)
+
+    return {
+        'Memoria caliente (MB)': caliente.memory_usage(deep=True).sum() / 1e6,
+        'Memoria fría (MB)': frio.memory_usage(deep=True).sum() / 1e6,
+        'Preparar dataset (ms)': _mediana(
+            lambda: motor.preparar_dataset(df, version='bench', texto=modo), repeticiones
+        ),
+        'Copia de la proyección (ms)': _mediana(lambda: caliente.copy(), repeticiones),
+        'Búsqueda por texto (ms)': _mediana(
+            lambda: motor.mascara_busqueda(caliente, 'PER'), repeticiones
+        ),
+        'Filtro + KPIs + gráficos (ms)': _mediana(
+            lambda: motor.calcular_resultado(dataset, motor.aplicar_filtros(dataset, {'EPS': 'SANITAS'})),
+            repeticiones,
+        ),
+        '1000 pacientes por CEDULA (ms)': _mediana(pacientes, repeticiones),
+        'Exportar CSV (ms)': _mediana(lambda: motor.exportar(dataset, mascara, 'csv'), repeticiones),
+        'Exportar Parquet (ms)': _mediana(lambda: motor.exportar(dataset, mascara, 'parquet'), repeticiones),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=200_000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    df = datos_sinteticos(args.filas)
+    resultados = {modo: medir(df, modo, args.repeticiones) for modo in MODOS_TEXTO}
+
+    # Mismo resultado en ambos modos
+    busquedas = [
+        motor.mascara_busqueda(motor.preparar_dataset(df, texto=modo)['df'], 'PER')
+        for modo in MODOS_TEXTO
+    ]
+    iguales = all(np.array_equal(busquedas[0], b) for b in busquedas[1:])
+
+    print(f"Almacenamiento de texto — {args.filas} filas, mediana de {args.repeticiones}\n")
+    print(f"{'Medida':<34}" + ''.join(f"{modo:>12}" for modo in MODOS_TEXTO) + f"{'arrow/object':>14}")
+    for medida in resultados['object']:
+        valores = [resultados[modo][medida] for modo in MODOS_TEXTO]
+        proporcion = valores[-1] / valores[0] if valores[0] else float('nan')
+        print(f"{medida:<34}" + ''.join(f"{v:>12.1f}" for v in valores) + f"{proporcion:>13.2f}x")
+    print(f"\nBúsquedas idénticas en ambos modos: {'sí' if iguales else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Diferencias entre dos cargas (instantáneas del almacén maestro).
+
+Cada instantánea guarda, por fila, su CEDULA normalizada y la huella de su
+contenido. La comparación cruza solo esas dos columnas en un único join
+vectorizado por CEDULA; las filas completas se leen (con filtro en el
+Parquet) y se comparan columna a columna únicamente para las CEDULAS
+agregadas, eliminadas o con huella distinta. Las filas sin cambios nunca
+llegan a pandas más allá de su clave y su huella.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import maestro
+from indicadores import VALORES_NO, VALORES_SI
+
+# Hitos del proceso: (columna, etiqueta). Una fila alcanza el hito cuando
+# la columna pasa de vacía (o NO) a tener fecha (o SI).
+HITOS = [
+    ('FECHA TOMA MUESTRA', 'Muestras tomadas'),
+    ('MUESTRA ENVIADA A ESPAÑA', 'Enviadas a España'),
+    ('FECHA ENVIO MUESTRAS A ESPAÑA', 'Con fecha de envío'),
+    ('FECHA DE RECIBIDO', 'Resultados recibidos'),
+    ('RESULTADOS ENVIADOS', 'Resultados entregados'),
+]
+
+# Diferencias guardadas por par de versiones
+MAX_DIFERENCIAS = 8
+
+_diferencias = OrderedDict()
+_lock = threading.Lock()
+
+
+def _leer(ruta, columnas=None, claves=None):
+    """Lee una instantánea, opcionalmente solo algunas columnas o CEDULAS"""
+    import pyarrow.parquet as pq
+
+    if claves is None:
+        return pq.read_table(ruta, columns=columnas).to_pandas()
+    if not claves:
+        return pq.read_schema(ruta).empty_table().to_pandas()
+    filtros = [(maestro.CLAVE, 'in', list(claves))]
+    return pq.read_table(ruta, columns=columnas, filters=filtros).to_pandas()
+
+
+def _alcanzado(serie):
+    """La fase está hecha: hay fecha o la marca vale SI"""
+    if not pd.api.types.is_object_dtype(serie) and not pd.api.types.is_string_dtype(serie):
+        return serie.notna()
+    texto = serie.astype('string').str.strip()
+    if texto.isin(VALORES_SI + VALORES_NO).any():
+        # Columna de marca: solo SI cuenta, no cualquier texto distinto de NO
+        return texto.isin(VALORES_SI).fillna(False).astype(bool)
+    # Fechas guardadas como texto
+    return pd.to_datetime(texto, errors='coerce', dayfirst=True).notna()
+
+
+def comparar(ruta_anterior, ruta_actual, eliminados=True):
+    """
+    Compara dos instantáneas por CEDULA. Con eliminados=False (la carga
+    actual es parcial) las CEDULAS que no trae no se informan como
+    eliminadas.
+
+    Retorna {'agregados': DataFrame, 'eliminados': DataFrame,
+    'cambios': DataFrame largo (CEDULA, NOMBRE, Columna, Antes, Después),
+    'filas_cambiadas': n, 'sin_cambios': n, 'hitos': {etiqueta: n}}.
+    Los nuevos registros cuentan en los hitos que ya traen alcanzados.
+    """
+    clave, huella = maestro.CLAVE, maestro.HUELLA
+    anterior = _leer(ruta_anterior, [clave, huella])
+    actual = _leer(ruta_actual, [clave, huella])
+
+    # Join por CEDULA: posición de cada fila actual en la instantánea anterior
+    indice_anterior = pd.Index(anterior[clave])
+    en_anterior = indice_anterior.get_indexer(actual[clave])
+    comunes = en_anterior >= 0
+    distintas = comunes.copy()
+    distintas[comunes] = (
+        anterior[huella].to_numpy()[en_anterior[comunes]] != actual[huella].to_numpy()[comunes]
+    )
+    presentes = np.zeros(len(anterior), dtype=bool)
+    presentes[en_anterior[comunes]] = True
+
+    claves_agregadas = actual[clave][~comunes].tolist()
+    claves_eliminadas = anterior[clave][~presentes].tolist() if eliminados else []
+    claves_cambiadas = actual[clave][distintas].tolist()
+
+    # Filas completas solo de lo que cambió
+    agregados = _leer(ruta_actual, claves=claves_agregadas)
+    eliminadas = _leer(ruta_anterior, claves=claves_eliminadas)
+    antes = _leer(ruta_anterior, claves=claves_cambiadas).set_index(clave)
+    despues = _leer(ruta_actual, claves=claves_cambiadas).set_index(clave)
+    antes = antes.loc[despues.index]
+
+    cambios = []
+    hitos = {etiqueta: 0 for _, etiqueta in HITOS}
+    columnas = [c for c in despues.columns if c != huella]
+    columnas += [c for c in antes.columns if c not in columnas and c != huella]
+    for columna in columnas:
+        valor_antes = antes[columna] if columna in antes.columns else pd.Series(None, index=antes.index)
+        valor_despues = despues[columna] if columna in despues.columns else pd.Series(None, index=despues.index)
+        difiere = (
+            maestro.texto_canonico(valor_antes).to_numpy()
+            != maestro.texto_canonico(valor_despues).to_numpy()
+        )
+        if not difiere.any():
+            continue
+        cambios.append(pd.DataFrame({
+            'CEDULA': despues.index[difiere],
+            'NOMBRE': despues['NOMBRE'][difiere].to_numpy() if 'NOMBRE' in despues.columns else None,
+            'Columna': columna,
+            'Antes': valor_antes[difiere].astype(object).to_numpy(),
+            'Después': valor_despues[difiere].astype(object).to_numpy(),
+        }))
+    for columna, etiqueta in HITOS:
+        if columna in despues.columns:
+            previo = antes[columna] if columna in antes.columns else pd.Series(None, index=antes.index)
+            hitos[etiqueta] = int((_alcanzado(despues[columna]) & ~_alcanzado(previo)).sum())
+        if columna in agregados.columns:
+            hitos[etiqueta] += int(_alcanzado(agregados[columna]).sum())
+
+    cambios = (
+        pd.concat(cambios, ignore_index=True) if cambios
+        else pd.DataFrame(columns=['CEDULA', 'NOMBRE', 'Columna', 'Antes', 'Después'])
+    )
+    # Con columnas distintas entre cargas las huellas difieren aunque no
+    # cambie ningún valor: cuentan solo las filas con algún cambio real
+    filas_cambiadas = int(cambios['CEDULA'].nunique())
+    ocultas = [clave, huella]
+    return {
+        'agregados': agregados.drop(columns=ocultas, errors='ignore'),
+        'eliminados': eliminadas.drop(columns=ocultas, errors='ignore'),
+        'cambios': cambios,
+        'filas_cambiadas': filas_cambiadas,
+        'sin_cambios': int(comunes.sum()) - filas_cambiadas,
+        'hitos': hitos,
+    }
+
+
+def ultimos_cambios(almacen):
+    """
+    Diferencias entre las dos últimas cargas del maestro, o None si aún no
+    hay dos. El resultado se guarda por par de versiones.
+    """
+    guardadas = maestro.instantaneas(almacen)
+    if len(guardadas) < 2:
+        return None
+    anterior, actual = guardadas[-2], guardadas[-1]
+
+    clave = (anterior['version'], actual['version'])
+    with _lock:
+        if clave in _diferencias:
+            _diferencias.move_to_end(clave)
+            return _diferencias[clave]
+
+    ruta = almacen['ruta']
+    resultado = comparar(
+        ruta / anterior['archivo'], ruta / actual['archivo'],
+        eliminados=not actual.get('parcial', False),
+    )
+    resultado.update(anterior=anterior, actual=actual)
+
+    with _lock:
+        _diferencias[clave] = resultado
+        while len(_diferencias) > MAX_DIFERENCIAS:
+            _diferencias.popitem(last=False)
+    return resultado
@@ -0,0 +1,187 @@
+"""
+Utilidades de carga del dataset de tamizaje.
+
+Funciones sin dependencia de Streamlit, compartidas por ambos dashboards.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+# Almacenamiento de las columnas de texto del dataset: 'object' (una cadena
+# de Python por celda) o 'arrow' (string[pyarrow]: un buffer contiguo por
+# columna). Se elige con la variable de entorno TMZ_TEXTO.
+MODOS_TEXTO = ('object', 'arrow')
+MODO_TEXTO = os.environ.get('TMZ_TEXTO', 'object')
+
+
+def version_datos(df):
+    """
+    Calcula una huella corta del contenido del DataFrame.
+
+    Dos cargas con los mismos datos producen la misma versión, por lo que
+    sirve como clave para los resultados precalculados.
+    """
+    huella = hashlib.sha1()
+    huella.update("|".join(map(str, df.columns)).encode('utf-8'))
+    try:
+        filas = pd.util.hash_pandas_object(df, index=True)
+    except TypeError:
+        # Columnas con tipos mezclados: se hashea su representación en texto
+        filas = pd.util.hash_pandas_object(df.astype(str), index=True)
+    huella.update(filas.values.tobytes())
+    return huella.hexdigest()[:16]
+
+
+# Columnas cortas que usan filtros, lista, KPIs y gráficos. El resto
+# (textos largos y datos de detalle) va al almacén frío.
+COLUMNAS_CALIENTES = [
+    'NOMBRE',
+    'CEDULA',
+    'CIUDAD',
+    'EPS',
+    'ESTADO',
+    'MES',
+    'ANTECEDENTES TABAQUISMO',
+    'DIFICULTAD RESPIRATORIA CON EL EJERCICI0',
+    'TOS MAS DE 3 MESES AL AÑO',
+    'SIBILANCIAS',
+    'FECHA REGISTRO',
+    'FECHA TOMA MUESTRA',
+    'MUESTRA ENVIADA A ESPAÑA',
+    'FECHA ENVIO MUESTRAS A ESPAÑA',
+    'FECHA DE RECIBIDO',
+    'RESULTADOS ENVIADOS',
+    # Facetas de muchos valores (filtros con sugerencias)
+    'IPS/INSTITUTO QUE REMITE',
+    'NOMBRE MÉDICO',
+    'SEDES',
+    'REPRESENTANTE',
+    'QUIEN TOMO LA MUESTRA',
+]
+
+
+def dividir_columnas(df, calientes=COLUMNAS_CALIENTES):
+    """
+    Separa el DataFrame en proyección caliente y almacén frío.
+
+    Ambos comparten el índice, que actúa como clave de fila del paciente.
+    El orden original de columnas queda en df_frio.attrs['columnas'].
+    """
+    seleccion = set(calientes)
+    cols_calientes = [c for c in df.columns if c in seleccion]
+    cols_frias = [c for c in df.columns if c not in seleccion]
+
+    df_caliente = df[cols_calientes].copy()
+    df_frio = df[cols_frias].copy()
+    df_frio.attrs['columnas'] = list(df.columns)
+    return df_caliente, df_frio
+
+
+def texto_arrow(df):
+    """
+    Copia del DataFrame con las columnas de solo texto como string[pyarrow].
+
+    Las columnas con tipos mezclados (números y texto), fechas y números
+    quedan igual. Los vacíos pasan a ser pd.NA.
+    """
+    tipo = pd.StringDtype('pyarrow')
+    resultado = df.copy(deep=False)
+    for i in range(len(df.columns)):
+        serie = df.iloc[:, i]
+        if serie.dtype == object and pd.api.types.infer_dtype(serie, skipna=True) == 'string':
+            # Por posición: el Excel puede traer columnas con el mismo nombre
+            resultado.isetitem(i, serie.astype(tipo))
+    return resultado
+
+
+def almacenar_texto(df, modo=None):
+    """Aplica el modo de almacenamiento de texto (por defecto, MODO_TEXTO)"""
+    modo = modo or MODO_TEXTO
+    if modo not in MODOS_TEXTO:
+        raise ValueError(f"Modo de texto no soportado: {modo}")
+    return texto_arrow(df) if modo == 'arrow' else df
+
+
+def _sin_na(registro):
+    """Vacíos de columnas pyarrow (pd.NA) como NaN, igual que en modo object"""
+    return {k: np.nan if v is pd.NA else v for k, v in registro.items()}
+
+
+def registro_frio(df_frio, clave):
+    """Obtiene las columnas frías de un paciente por su clave de fila"""
+    if df_frio is None or clave not in df_frio.index:
+        return {}
+    return _sin_na(df_frio.loc[clave].to_dict())
+
+
+def hidratar(df_caliente, df_frio):
+    """Reconstruye las filas completas (p. ej. para exportar) en el orden original"""
+    if df_frio is None or len(df_frio.columns) == 0:
+        return df_caliente
+    completo = df_caliente.join(df_frio, how='left')
+    orden = [c for c in df_frio.attrs.get('columnas', []) if c in completo.columns]
+    return completo[orden] if len(orden) == len(completo.columns) else completo
+
+
+def clave_cedula(valor):
+    """Normaliza una CEDULA a texto (sin espacios ni '.0' de Excel)"""
+    clave = str(valor).strip()
+    return clave[:-2] if clave.endswith('.0') else clave
+
+
+def claves_cedula(serie):
+    """Versión vectorizada de clave_cedula para una columna completa"""
+    return serie.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+
+def construir_indice_cedula(df):
+    """
+    Construye el índice hash CEDULA -> posición de fila.
+
+    Si una cédula se repite, el índice apunta a su primera aparición; las
+    demás filas se abren indicando su etiqueta (ver obtener_paciente).
+    """
+    if 'CEDULA' not in df.columns:
+        return {}
+    claves = claves_cedula(df['CEDULA'])
+    posiciones = range(len(claves) - 1, -1, -1)
+    # Recorrido inverso: la última asignación (primera aparición) prevalece
+    return dict(zip(claves.tolist()[::-1], posiciones))
+
+
+def _posicion_fila(df, fila, clave):
+    """Posición de la fila con esa etiqueta si su CEDULA es 'clave', o None"""
+    etiquetas = [fila]
+    if isinstance(fila, str) and fila.lstrip('-').isdigit():
+        # Desde la URL la etiqueta llega como texto
+        etiquetas.append(int(fila))
+    for etiqueta in etiquetas:
+        try:
+            posicion = df.index.get_loc(etiqueta)
+        except (KeyError, TypeError):
+            continue
+        if isinstance(posicion, int) and clave_cedula(df['CEDULA'].iloc[posicion]) == clave:
+            return posicion
+    return None
+
+
+def obtener_paciente(df, df_frio, indice, cedula, fila=None):
+    """
+    Obtiene el registro completo de un paciente por CEDULA en O(1), o None.
+
+    Con fila (etiqueta de la fila elegida en la lista) se abre esa fila
+    aunque la cédula esté repetida; si la etiqueta ya no corresponde a esa
+    cédula se usa la primera aparición.
+    """
+    if cedula is None:
+        return None
+    clave = clave_cedula(cedula)
+    posicion = _posicion_fila(df, fila, clave) if fila is not None else None
+    if posicion is None:
+        posicion = indice.get(clave)
+    if posicion is None or posicion >= len(df):
+        return None
+    fila = df.iloc[posicion]
+    return {**_sin_na(fila.to_dict()), **registro_frio(df_frio, df.index[posicion])}
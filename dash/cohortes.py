@@ -0,0 +1,132 @@
+"""
+Cohortes guardadas y caché persistente de sus resultados.
+
+Una cohorte es un conjunto de filtros con nombre. Sus resultados (posiciones
+de filas, KPIs y agregados de gráficos) se guardan en disco en JSON, con
+clave versión de datos + firma de filtros, así que sobreviven a reinicios
+del servidor y dejan de usarse solos cuando cambia la versión de los datos.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+RUTA_COHORTES = BASE / 'datos' / 'cohortes.json'
+RUTA_CACHE = BASE / 'cache' / 'cohortes'
+
+# Versiones de datos cuyos resultados se conservan en disco
+MAX_VERSIONES = 3
+
+_lock = threading.Lock()
+
+
+def _escribir_json(ruta, datos):
+    """Escritura atómica: archivo temporal y luego reemplazo"""
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix(ruta.suffix + f'.{os.getpid()}.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, default=str)
+    os.replace(temporal, ruta)
+
+
+def _leer_json(ruta, defecto):
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return defecto
+
+
+def especificacion(filtros, busqueda=""):
+    """Especificación serializable de un estado de filtros"""
+    return {
+        'filtros': {str(c): v for c, v in sorted(filtros.items())},
+        'busqueda': busqueda or "",
+    }
+
+
+def firma(spec):
+    """Firma estable de una especificación de filtros"""
+    texto = json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:16]
+
+
+# ------------------------------------------
+# Definiciones de cohortes
+# ------------------------------------------
+
+def listar():
+    """Cohortes guardadas: {nombre: especificación}"""
+    return _leer_json(RUTA_COHORTES, {})
+
+
+def guardar(nombre, spec):
+    """Guarda (o reemplaza) una cohorte con nombre"""
+    with _lock:
+        cohortes = listar()
+        cohortes[nombre] = spec
+        _escribir_json(RUTA_COHORTES, cohortes)
+
+
+def eliminar(nombre):
+    """Elimina una cohorte guardada"""
+    with _lock:
+        cohortes = listar()
+        if cohortes.pop(nombre, None) is not None:
+            _escribir_json(RUTA_COHORTES, cohortes)
+
+
+def buscar_por_firma(spec):
+    """Nombre de la cohorte guardada con los mismos filtros, o None"""
+    objetivo = firma(spec)
+    for nombre, guardada in listar().items():
+        if firma(guardada) == objetivo:
+            return nombre
+    return None
+
+
+# ------------------------------------------
+# Caché de resultados
+# ------------------------------------------
+
+def _ruta_resultado(version, spec):
+    return RUTA_CACHE / str(version) / f'{firma(spec)}.json'
+
+
+def cargar_resultado(version, spec):
+    """Resultado guardado para esta versión de datos y filtros, o None"""
+    return _leer_json(_ruta_resultado(version, spec), None)
+
+
+def guardar_resultado(version, spec, resultado):
+    """
+    Guarda el resultado de una cohorte y purga las versiones de datos más
+    antiguas (sus resultados ya no son válidos).
+    """
+    with _lock:
+        _escribir_json(_ruta_resultado(version, spec), resultado)
+        _purgar_versiones(conservar=str(version))
+
+
+def _purgar_versiones(conservar):
+    versiones = [d for d in RUTA_CACHE.iterdir() if d.is_dir()]
+    versiones.sort(key=lambda d: d.stat().st_mtime, reverse=True)
+    antiguas = [d for d in versiones if d.name != conservar][MAX_VERSIONES - 1:]
+    for directorio in antiguas:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def resultado_cohorte(version, spec, calcular):
+    """
+    Devuelve el resultado cacheado de la cohorte o lo calcula con
+    calcular() y lo guarda. Retorna (resultado, desde_cache).
+    """
+    resultado = cargar_resultado(version, spec)
+    if resultado is not None:
+        return resultado, True
+    resultado = calcular()
+    guardar_resultado(version, spec, resultado)
+    return resultado, False
@@ -1,9 +1,16 @@
-import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import os
+import time
 from datetime import datetime
 
+import streamlit as st
+
+import maestro
+
+# Instante de inicio del script, para el panel de instrumentación
+t_inicio = time.perf_counter()
+tiempos = {}
+memoria = None  # Uso de sesiones.py, si se cargaron datos
+
 # Configuración de la página
 st.set_page_config(
     page_title="Dashboard Tamizaje Genético",
@@ -38,17 +45,173 @@ uploaded_file = st.file_uploader(
     help="Sube tu archivo Excel con la información de los pacientes"
 )
 
-if uploaded_file is not None:
+# Con un maestro guardado el dashboard abre sus datos aunque no se suba archivo
+if uploaded_file is not None or maestro.existe():
     try:
-        # Leer el archivo
-        df = pd.read_excel(uploaded_file)
+        # Módulos de datos: la pantalla de bienvenida no los necesita, así que
+        # pandas y compañía solo se importan cuando hay un archivo
+        t_importar = time.perf_counter()
+        import pandas as pd
+        
+        import alertas
+        import auditoria
+        import cambios
+        import cohortes
+        import indicadores
+        import motor
+        import servidor
+        import sesiones
+        import tendencias
+        from streamlit import runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        
+        tiempos['Importar módulos de datos'] = time.perf_counter() - t_importar
+        
+        # Los datos derivados de la sesión (reporte de calidad, CSV,
+        # exportaciones) viven en sesiones.py con un presupuesto de memoria:
+        # si se liberaron mientras la pestaña estaba inactiva, se recalculan.
+        # Los de las sesiones ya cerradas se descartan
+        id_sesion = get_script_run_ctx().session_id
+        sesiones.tocar(
+            id_sesion, viva=runtime.get_instance().is_active_session if runtime.exists() else None
+        )
+        
+        # Quién usa la sesión, para la auditoría: el usuario autenticado, el
+        # que informa el proxy (solo si es confiable) o, si no hay ninguno, la IP
+        usuario = auditoria.usuario_de(st.user.get('email'), st.context.headers, st.context.ip_address)
+        
+        def auditar_descarga(contenido, formato, **detalle):
+            """Callback de los botones de descarga: solo encola el evento"""
+            auditoria.registrar(
+                'exportar', usuario=usuario, sesion=id_sesion,
+                contenido=contenido, formato=formato, **detalle
+            )
+        
+        # Almacén maestro compartido por todas las sesiones (servidor.py).
+        # Cada archivo se fusiona una vez por CEDULA: solo se escriben y
+        # reindexan las filas nuevas o cambiadas
+        almacen = servidor.maestro()
         
-        # Guardar en session_state
-        if 'df' not in st.session_state or st.session_state.get('file_name') != uploaded_file.name:
-            st.session_state['df'] = df
+        # API JSON local (api.py) sobre el mismo maestro, si se pide con
+        # TMZ_API_PUERTO. Un solo servidor por proceso
+        @st.cache_resource
+        def servidor_api(puerto):
+            import api
+            return api.iniciar_en_hilo(lambda: almacen['dataset'], puerto)
+        
+        if os.environ.get('TMZ_API_PUERTO'):
+            servidor_api(int(os.environ['TMZ_API_PUERTO']))
+        if uploaded_file is not None and st.session_state.get('file_name') != uploaded_file.name:
+            t_carga = time.perf_counter()
+            df_carga = pd.read_excel(uploaded_file)
+            tiempos['Lectura del Excel'] = time.perf_counter() - t_carga
+            
+            # Validación antes de fusionar: un archivo sin columnas obligatorias
+            # se rechaza con su reporte en vez de fallar más adelante
+            t_validacion = time.perf_counter()
+            reporte = motor.validar(df_carga)
+            sesiones.guardar(
+                id_sesion, 'validacion',
+                (reporte, motor.reporte_validacion(df_carga, reporte, formato='csv')),
+                firma=uploaded_file.name,
+            )
+            tiempos['Validación'] = time.perf_counter() - t_validacion
+            
+            st.session_state['resumen_fusion'] = None
+            if not reporte['bloqueante']:
+                t_fusion = time.perf_counter()
+                st.session_state['resumen_fusion'] = motor.fusionar_carga(
+                    almacen, df_carga, nombre=uploaded_file.name
+                )
+                tiempos['Fusión en el maestro'] = time.perf_counter() - t_fusion
             st.session_state['file_name'] = uploaded_file.name
         
-        df = st.session_state['df']
+        # === CALIDAD DE DATOS DEL ARCHIVO ===
+        def calcular_validacion():
+            # El archivo sigue en el uploader: se relee solo si el reporte se liberó
+            uploaded_file.seek(0)
+            df_archivo = pd.read_excel(uploaded_file)
+            reporte = motor.validar(df_archivo)
+            return reporte, motor.reporte_validacion(df_archivo, reporte, formato='csv')
+        
+        validado = None
+        if uploaded_file is not None:
+            validado = sesiones.derivado(
+                id_sesion, 'validacion', (uploaded_file.name, datetime.now().date()), calcular_validacion
+            )
+        if validado is not None:
+            reporte, reporte_csv = validado
+            if reporte['bloqueante']:
+                st.error(
+                    "❌ El archivo no se cargó: faltan columnas obligatorias ("
+                    + ", ".join(p['columna'] for p in reporte['esquema'] if p['severidad'] == 'error'
+                                and p['problema'] == 'Falta la columna')
+                    + "). Revisa el reporte de calidad."
+                )
+            with st.expander(
+                f"🧪 Calidad de datos: {reporte['errores']} errores, {reporte['advertencias']} advertencias",
+                expanded=reporte['bloqueante']
+            ):
+                if reporte['esquema']:
+                    st.markdown("**Columnas**")
+                    for problema in reporte['esquema']:
+                        icono = "❌" if problema['severidad'] == 'error' else "⚠️"
+                        st.markdown(f"{icono} `{problema['columna']}`: {problema['problema']}")
+                
+                incumplidas = [r for r in reporte['reglas'] if r['total']]
+                if incumplidas:
+                    st.markdown("**Reglas por fila**")
+                    for regla in incumplidas:
+                        icono = "❌" if regla['severidad'] == 'error' else "⚠️"
+                        columnas_regla = ", ".join(regla['incumplimientos'])
+                        st.markdown(f"{icono} {regla['nombre']}: **{regla['total']}** ({columnas_regla})")
+                elif not reporte['esquema']:
+                    st.markdown("✅ Sin problemas")
+                
+                st.download_button(
+                    label="📥 Descargar reporte de calidad (CSV)",
+                    data=reporte_csv,
+                    file_name=f'calidad_{uploaded_file.name.rsplit(".", 1)[0]}.csv',
+                    mime=motor.MIME['csv'],
+                    on_click=auditar_descarga,
+                    args=('reporte_calidad', 'csv'),
+                    kwargs={'archivo': uploaded_file.name},
+                )
+            if reporte['bloqueante']:
+                st.stop()
+        
+        resumen_fusion = st.session_state.get('resumen_fusion')
+        if uploaded_file is not None and resumen_fusion is not None:
+            descartados = resumen_fusion['sin_cedula'] + resumen_fusion['duplicados']
+            st.success(
+                f"✅ {uploaded_file.name} fusionado con el maestro: "
+                f"{resumen_fusion['nuevos']} nuevos, {resumen_fusion['cambiados']} actualizados, "
+                f"{resumen_fusion['sin_cambios']} sin cambios"
+                + (f" ({descartados} filas sin CEDULA o repetidas descartadas)" if descartados else "")
+            )
+        
+        dataset = almacen['dataset']
+        if dataset is None:
+            st.warning("⚠️ El maestro no tiene pacientes: ninguna fila del archivo tiene CEDULA.")
+            st.stop()
+        df = dataset['df']
+        version = dataset['version']
+        
+        # El paciente seleccionado viaja en la URL (?cedula=...&fila=...) para
+        # compartir enlaces; la fila distingue las cédulas repetidas
+        if 'cedula' in st.query_params:
+            st.session_state['paciente_seleccionado'] = st.query_params['cedula']
+            st.session_state['paciente_fila'] = st.query_params.get('fila')
+        
+        def cerrar_paciente():
+            for clave in ('paciente_seleccionado', 'paciente_fila'):
+                st.session_state.pop(clave, None)
+            for parametro in ('cedula', 'fila'):
+                if parametro in st.query_params:
+                    del st.query_params[parametro]
+        
+        # Reglas SLA en segundo plano (no hace nada si la versión ya fue evaluada)
+        alertas.programar_evaluacion(df, version)
         
         # === SIDEBAR - FILTROS ===
         st.sidebar.header("🔍 Filtros de Búsqueda")
@@ -56,66 +219,205 @@ if uploaded_file is not None:
         # Buscar por nombre o cédula
         busqueda = st.sidebar.text_input(
             "🔎 Buscar paciente",
-            placeholder="Nombre o cédula..."
+            placeholder="Nombre o cédula...",
+            key="busqueda"
         )
         
-        # Filtros principales
-        st.sidebar.markdown("### 📊 Filtros Generales")
+        # (columna, etiqueta, opción sin filtro, opciones fijas)
+        filtros_generales = [
+            ('CIUDAD', "🏙️ Ciudad", "Todas", None),
+            ('EPS', "🏥 EPS", "Todas", None),
+            ('ESTADO', "📊 Estado", "Todos", None),
+            ('MES', "📅 Mes", "Todos", None),
+        ]
+        filtros_clinicos = [
+            ('ANTECEDENTES TABAQUISMO', "🚬 Tabaquismo", "Todos", ["SI", "NO"]),
+        ]
+        # (columna, etiqueta) de las facetas de muchos valores: selección
+        # múltiple con sugerencias mientras se escribe
+        filtros_autocompletar = [
+            ('IPS/INSTITUTO QUE REMITE', "🏥 IPS / Instituto"),
+            ('NOMBRE MÉDICO', "👨‍⚕️ Médico"),
+            ('SEDES', "🏢 Sede"),
+            ('REPRESENTANTE', "👥 Representante"),
+            ('QUIEN TOMO LA MUESTRA', "💉 Tomó la muestra"),
+        ]
         
-        ciudades = ["Todas"] + sorted(df['CIUDAD'].dropna().unique().tolist())
-        ciudad_sel = st.sidebar.selectbox("🏙️ Ciudad", ciudades)
+        def limpiar_filtros():
+            for columna, _, sin_filtro, _ in filtros_generales + filtros_clinicos:
+                st.session_state[f"filtro_{columna}"] = sin_filtro
+            for columna, _ in filtros_autocompletar:
+                st.session_state[f"filtro_{columna}"] = []
+                st.session_state[f"sugerir_{columna}"] = ""
+            st.session_state["busqueda"] = ""
+            st.session_state["cola_sla"] = "Ninguna"
+            st.session_state["cohorte_sel"] = "—"
         
-        eps_list = ["Todas"] + sorted(df['EPS'].dropna().unique().tolist())
-        eps_sel = st.sidebar.selectbox("🏥 EPS", eps_list)
+        # Estado actual de los filtros, leído antes de dibujar los widgets para
+        # que cada opción muestre cuántos pacientes quedarían con los demás
+        filtros_activos = {}
+        for columna, _, sin_filtro, _ in filtros_generales + filtros_clinicos:
+            valor = st.session_state.get(f"filtro_{columna}", sin_filtro)
+            if valor != sin_filtro:
+                filtros_activos[columna] = valor
+        for columna, _ in filtros_autocompletar:
+            valor = st.session_state.get(f"filtro_{columna}")
+            if valor:
+                filtros_activos[columna] = list(valor)
         
-        if 'ESTADO' in df.columns:
-            estados = ["Todos"] + sorted(df['ESTADO'].dropna().unique().tolist())
-            estado_sel = st.sidebar.selectbox("📊 Estado", estados)
-        else:
-            estado_sel = "Todos"
+        # Búsqueda y cola SLA restringen también los conteos de las facetas
+        colas = alertas.colas_de_trabajo(version)
+        cola_sel = st.session_state.get("cola_sla", "Ninguna")
+        filas_cola = colas[cola_sel] if colas is not None and cola_sel in colas else None
         
-        if 'MES' in df.columns:
-            meses = ["Todos"] + sorted(df['MES'].dropna().unique().tolist())
-            mes_sel = st.sidebar.selectbox("📅 Mes", meses)
-        else:
-            mes_sel = "Todos"
+        conteos = motor.conteos_facetas(
+            dataset, filtros_activos, busqueda, filas=filas_cola,
+            # La clave son las filas de la cola, no su nombre: cambian al
+            # terminar la evaluación y con la evaluación de cada día
+            clave_base=(busqueda, motor.huella_filas(filas_cola) if filas_cola is not None else None),
+        )
+        
+        def selector_faceta(columna, etiqueta, sin_filtro, fijas):
+            if columna not in conteos:
+                return
+            cuentas = conteos[columna]
+            actual = st.session_state.get(f"filtro_{columna}", sin_filtro)
+            # Las opciones sin pacientes se ocultan (salvo la seleccionada)
+            opciones = [v for v in (fijas or cuentas.keys()) if cuentas.get(v, 0) > 0]
+            if actual != sin_filtro and actual not in opciones:
+                opciones.append(actual)
+            st.sidebar.selectbox(
+                etiqueta,
+                [sin_filtro] + opciones,
+                format_func=lambda v: v if v == sin_filtro else f"{v} ({cuentas.get(v, 0)})",
+                key=f"filtro_{columna}"
+            )
+        
+        def selector_autocompletar(columna, etiqueta):
+            if columna not in conteos:
+                return
+            cuentas = conteos[columna]
+            elegidos = list(st.session_state.get(f"filtro_{columna}", []))
+            # st.text_input avisa al pulsar Enter (o al salir del campo): las
+            # sugerencias se actualizan entonces, no con cada tecla
+            texto = st.sidebar.text_input(
+                etiqueta, placeholder="Escribe y pulsa Enter...", key=f"sugerir_{columna}",
+                help="Las sugerencias aparecen al pulsar Enter"
+            )
+            # Las sugerencias salen del índice de texto; se ocultan las que
+            # no tendrían pacientes con los demás filtros
+            sugeridas = [
+                v for v in motor.sugerencias(dataset, columna, texto)
+                if cuentas.get(v, 0) > 0
+            ] if texto else []
+            # Las opciones cambian con cada texto (y con ellas el widget): la
+            # selección se guarda en filtro_<columna> y se repone en el widget
+            st.session_state[f"multiple_{columna}"] = elegidos
+            st.sidebar.multiselect(
+                etiqueta,
+                list(dict.fromkeys(elegidos + sugeridas)),
+                format_func=lambda v: f"{v} ({cuentas.get(v, 0)})",
+                placeholder="Elige entre las sugerencias",
+                label_visibility="collapsed",
+                key=f"multiple_{columna}",
+                on_change=lambda: st.session_state.update(
+                    {f"filtro_{columna}": st.session_state[f"multiple_{columna}"]}
+                )
+            )
+        
+        # Filtros principales
+        st.sidebar.markdown("### 📊 Filtros Generales")
+        
+        for filtro in filtros_generales:
+            selector_faceta(*filtro)
         
         # Filtros clínicos
         st.sidebar.markdown("### 🩺 Filtros Clínicos")
         
-        if 'ANTECEDENTES TABAQUISMO' in df.columns:
-            tabaquismo_options = ["Todos", "SI", "NO"]
-            tabaquismo_sel = st.sidebar.selectbox("🚬 Tabaquismo", tabaquismo_options)
+        for filtro in filtros_clinicos:
+            selector_faceta(*filtro)
+        
+        # Instituciones y personal
+        st.sidebar.markdown("### 🏥 Instituciones y Personal")
+        
+        for filtro in filtros_autocompletar:
+            selector_autocompletar(*filtro)
+        
+        # Colas de trabajo SLA
+        st.sidebar.markdown("### 🚨 Alertas SLA")
+        
+        if colas is None:
+            st.sidebar.caption("⏳ Calculando alertas...")
         else:
-            tabaquismo_sel = "Todos"
+            nombres_reglas = {r['id']: r['nombre'] for r in alertas.REGLAS_SLA}
+            st.sidebar.selectbox(
+                "📌 Cola de trabajo",
+                ["Ninguna"] + list(colas.keys()),
+                format_func=lambda c: c if c == "Ninguna" else f"{nombres_reglas[c]} ({len(colas[c])})",
+                key="cola_sla"
+            )
         
-        # Aplicar filtros
-        df_filtrado = df.copy()
+        # Botón para limpiar filtros
+        st.sidebar.button("🔄 Limpiar Filtros", on_click=limpiar_filtros)
         
-        if busqueda:
-            df_filtrado = df_filtrado[
-                df_filtrado['NOMBRE'].str.contains(busqueda, case=False, na=False) |
-                df_filtrado['CEDULA'].astype(str).str.contains(busqueda, case=False, na=False)
-            ]
+        # Cohortes guardadas: filtros con nombre cuyos resultados se cachean en disco
+        st.sidebar.markdown("### 💾 Cohortes")
         
-        if ciudad_sel != "Todas":
-            df_filtrado = df_filtrado[df_filtrado['CIUDAD'] == ciudad_sel]
+        spec_actual = cohortes.especificacion(filtros_activos, busqueda)
+        cohortes_guardadas = cohortes.listar()
         
-        if eps_sel != "Todas":
-            df_filtrado = df_filtrado[df_filtrado['EPS'] == eps_sel]
+        def abrir_cohorte():
+            nombre = st.session_state.get("cohorte_sel")
+            if nombre not in cohortes_guardadas:
+                return
+            limpiar_filtros()
+            st.session_state["cohorte_sel"] = nombre
+            spec = cohortes_guardadas[nombre]
+            for columna, valor in spec['filtros'].items():
+                st.session_state[f"filtro_{columna}"] = valor
+            st.session_state["busqueda"] = spec['busqueda']
         
-        if estado_sel != "Todos" and 'ESTADO' in df.columns:
-            df_filtrado = df_filtrado[df_filtrado['ESTADO'] == estado_sel]
+        def guardar_cohorte(spec):
+            nombre = st.session_state.get("nombre_cohorte", "").strip()
+            if nombre:
+                cohortes.guardar(nombre, spec)
+                st.session_state["cohorte_sel"] = nombre
         
-        if mes_sel != "Todos" and 'MES' in df.columns:
-            df_filtrado = df_filtrado[df_filtrado['MES'] == mes_sel]
+        if cohortes_guardadas:
+            st.sidebar.selectbox(
+                "📂 Abrir cohorte",
+                ["—"] + sorted(cohortes_guardadas),
+                key="cohorte_sel",
+                on_change=abrir_cohorte
+            )
         
-        if tabaquismo_sel != "Todos" and 'ANTECEDENTES TABAQUISMO' in df.columns:
-            df_filtrado = df_filtrado[df_filtrado['ANTECEDENTES TABAQUISMO'] == tabaquismo_sel]
+        st.sidebar.text_input("Nombre de la cohorte", placeholder="Ej: Sanitas Bogotá fumadores", key="nombre_cohorte")
+        st.sidebar.button("💾 Guardar filtros actuales", on_click=guardar_cohorte, args=(spec_actual,))
         
-        # Botón para limpiar filtros
-        if st.sidebar.button("🔄 Limpiar Filtros"):
-            st.rerun()
+        # Aplicar filtros. Si coinciden con una cohorte guardada (y no hay cola
+        # SLA activa) se usa su resultado en disco para esta versión de datos
+        def calcular_resultado():
+            mascara = motor.aplicar_filtros(dataset, filtros_activos, busqueda, filas=filas_cola)
+            return motor.calcular_resultado(dataset, mascara)
+        
+        t_filtros = time.perf_counter()
+        cohorte_activa = None
+        if filas_cola is None:
+            cohorte_activa = cohortes.buscar_por_firma(spec_actual)
+        
+        if cohorte_activa:
+            resultado, desde_cache = cohortes.resultado_cohorte(version, spec_actual, calcular_resultado)
+            st.sidebar.caption(f"📂 Cohorte: **{cohorte_activa}**" + (" (caché)" if desde_cache else ""))
+        elif not filtros_activos and not busqueda and filas_cola is None:
+            # Vista sin filtros: compartida por todas las sesiones (servidor.py)
+            resultado = servidor.resultado_sin_filtros(version, dataset)
+        else:
+            resultado = calcular_resultado()
+        
+        df_filtrado = motor.seleccion(dataset, resultado['filas'])
+        kpis = resultado['kpis']
+        graficos = resultado['graficos']
+        tiempos['Filtros y KPIs'] = time.perf_counter() - t_filtros
         
         st.sidebar.markdown("---")
         st.sidebar.info(f"**📊 Mostrando:** {len(df_filtrado)} de {len(df)} pacientes")
@@ -128,50 +430,75 @@ if uploaded_file is not None:
         with col1:
             st.metric(
                 label="👥 Total Pacientes",
-                value=len(df_filtrado),
-                delta=f"{len(df_filtrado)}/{len(df)}"
+                value=kpis['total'],
+                delta=f"{kpis['total']}/{len(df)}"
             )
         
         with col2:
-            tomadas = len(df_filtrado[df_filtrado['FECHA TOMA MUESTRA'].notna()]) if 'FECHA TOMA MUESTRA' in df_filtrado.columns else 0
-            porcentaje_tomadas = (tomadas / len(df_filtrado) * 100) if len(df_filtrado) > 0 else 0
             st.metric(
                 label="💉 Muestras Tomadas",
-                value=tomadas,
-                delta=f"{porcentaje_tomadas:.0f}%"
+                value=kpis['tomadas'],
+                delta=f"{kpis['porcentaje_tomadas']:.0f}%"
             )
         
         with col3:
-            enviadas = 0
-            if 'MUESTRA ENVIADA A ESPAÑA' in df_filtrado.columns:
-                enviadas = len(df_filtrado[
-                    df_filtrado['MUESTRA ENVIADA A ESPAÑA'].isin(['SI', 'SÍ', 'Si', 'si', 'YES', 'Yes'])
-                ])
             st.metric(
                 label="✈️ Enviadas a España",
-                value=enviadas
+                value=kpis['enviadas']
             )
         
         with col4:
-            completados = 0
-            if 'RESULTADOS ENVIADOS' in df_filtrado.columns:
-                completados = len(df_filtrado[
-                    df_filtrado['RESULTADOS ENVIADOS'].isin(['SI', 'SÍ', 'Si', 'si', 'YES', 'Yes'])
-                ])
             st.metric(
                 label="✅ Completados",
-                value=completados
+                value=kpis['completados']
             )
         
         with col5:
-            if 'ANTECEDENTES TABAQUISMO' in df_filtrado.columns:
-                fumadores = len(df_filtrado[df_filtrado['ANTECEDENTES TABAQUISMO'] == 'SI'])
+            if kpis['fumadores'] is not None:
                 st.metric(
                     label="🚬 Tabaquismo",
-                    value=fumadores
+                    value=kpis['fumadores']
                 )
             else:
-                st.metric(label="📋 Registros", value=len(df_filtrado))
+                st.metric(label="📋 Registros", value=kpis['total'])
+        
+        # === CAMBIOS DESDE LA ÚLTIMA CARGA ===
+        t_cambios = time.perf_counter()
+        diferencias = cambios.ultimos_cambios(almacen)
+        if diferencias is not None:
+            anterior, actual = diferencias['anterior'], diferencias['actual']
+            with st.expander(
+                f"🔄 Cambios desde la última carga ({anterior['origen']} → {actual['origen']})",
+                expanded=uploaded_file is not None
+            ):
+                col_c1, col_c2, col_c3, col_c4 = st.columns(4)
+                col_c1.metric("🆕 Nuevos registros", len(diferencias['agregados']))
+                col_c2.metric("✏️ Con cambios", diferencias['filas_cambiadas'])
+                if actual.get('parcial'):
+                    col_c3.metric(
+                        "🗑️ Ya no aparecen", "—",
+                        help="Carga parcial (sin todas las columnas del maestro): los pacientes que no trae siguen en el maestro"
+                    )
+                else:
+                    col_c3.metric("🗑️ Ya no aparecen", len(diferencias['eliminados']))
+                col_c4.metric("➖ Sin cambios", diferencias['sin_cambios'])
+                
+                hitos = {etiqueta: n for etiqueta, n in diferencias['hitos'].items() if n}
+                if hitos:
+                    st.markdown("**Avances en el proceso:** " + " · ".join(
+                        f"{etiqueta}: **{n}**" for etiqueta, n in hitos.items()
+                    ))
+                
+                if len(diferencias['cambios']):
+                    st.markdown("**Cambios por columna**")
+                    st.dataframe(diferencias['cambios'].astype(str), use_container_width=True, hide_index=True)
+                for titulo, tabla in (("Nuevos registros", diferencias['agregados']),
+                                      ("Ya no aparecen en la carga", diferencias['eliminados'])):
+                    if len(tabla):
+                        st.markdown(f"**{titulo}**")
+                        columnas_vista = [c for c in ('NOMBRE', 'CEDULA', 'EPS', 'CIUDAD') if c in tabla.columns]
+                        st.dataframe(tabla[columnas_vista], use_container_width=True, hide_index=True)
+        tiempos['Cambios desde la última carga'] = time.perf_counter() - t_cambios
         
         st.markdown("---")
         
@@ -189,13 +516,9 @@ if uploaded_file is not None:
             with st.container():
                 for idx, row in df_sorted.iterrows():
                     # Determinar color según estado
-                    estado = row.get('ESTADO', 'Sin estado')
-                    if estado == 'Completado':
-                        estado_emoji = "🟢"
-                    elif 'Proceso' in str(estado):
-                        estado_emoji = "🟡"
-                    else:
-                        estado_emoji = "⚪"
+                    estado_emoji = {
+                        'completado': "🟢", 'proceso': "🟡", 'pendiente': "⚪"
+                    }[motor.categoria_estado(row.get('ESTADO', 'Sin estado'))]
                     
                     # Botón de paciente
                     if st.button(
@@ -203,12 +526,38 @@ if uploaded_file is not None:
                         key=f"patient_{idx}",
                         use_container_width=True
                     ):
-                        st.session_state['paciente_seleccionado'] = row.to_dict()
+                        # Solo se guarda la clave; el registro se busca al renderizar
+                        clave = motor.clave_cedula(row['CEDULA'])
+                        st.session_state['paciente_seleccionado'] = clave
+                        st.session_state['paciente_fila'] = str(idx)
+                        st.query_params['cedula'] = clave
+                        st.query_params['fila'] = str(idx)
         
         # === DETALLE DEL PACIENTE ===
         with col_detalle:
-            if 'paciente_seleccionado' in st.session_state:
-                paciente = st.session_state['paciente_seleccionado']
+            # Registro completo (incluye columnas frías) buscado por CEDULA
+            paciente = motor.obtener_paciente(
+                dataset, st.session_state.get('paciente_seleccionado'), st.session_state.get('paciente_fila')
+            )
+            
+            if paciente is None and 'paciente_seleccionado' in st.session_state:
+                st.warning(f"⚠️ No se encontró el paciente con cédula {st.session_state['paciente_seleccionado']}")
+            
+            # Auditoría: una vez por apertura del paciente, no en cada rerun
+            # que lo sigue mostrando
+            if paciente is None:
+                st.session_state.pop('paciente_auditado', None)
+            else:
+                clave_paciente = motor.clave_cedula(st.session_state['paciente_seleccionado'])
+                abierto = (clave_paciente, st.session_state.get('paciente_fila'))
+                if st.session_state.get('paciente_auditado') != abierto:
+                    auditoria.registrar(
+                        'ver_paciente', usuario=usuario, sesion=id_sesion,
+                        cedula=clave_paciente, version=version
+                    )
+                    st.session_state['paciente_auditado'] = abierto
+            
+            if paciente is not None:
                 
                 # Header del paciente
                 col_header1, col_header2 = st.columns([3, 1])
@@ -220,12 +569,14 @@ if uploaded_file is not None:
                 with col_header2:
                     # Estado con color
                     estado = paciente.get('ESTADO', 'Sin estado')
-                    if estado == 'Completado':
+                    categoria = motor.categoria_estado(estado)
+                    if categoria == 'completado':
                         st.success(f"✅ {estado}")
-                    elif 'Proceso' in str(estado):
+                    elif categoria == 'proceso':
                         st.info(f"🔄 {estado}")
                     else:
                         st.warning(f"⏳ {estado}")
+                    st.button("✖ Cerrar paciente", on_click=cerrar_paciente, use_container_width=True)
                 
                 st.markdown("---")
                 
@@ -291,26 +642,17 @@ if uploaded_file is not None:
                 with tab2:
                     st.markdown("### 🫁 Evaluación de Síntomas Respiratorios")
                     
-                    sintomas = [
-                        ("🚬", "Antecedentes de Tabaquismo", "ANTECEDENTES TABAQUISMO"),
-                        ("🏃", "Dificultad Respiratoria con Ejercicio", "DIFICULTAD RESPIRATORIA CON EL EJERCICI0"),
-                        ("😮‍💨", "Episodios de Dificultad en Reposo", "EPISODIOS DIFICULTAD RESPIRATORIA EN REPOSO"),
-                        ("🤧", "Tos (>3 meses/año)", "TOS MAS DE 3 MESES AL AÑO"),
-                        ("💧", "Expectoración", "EXPECTORACIÓN"),
-                        ("🌬️", "Sibilancias", "SIBILANCIAS")
-                    ]
-                    
                     col_sint1, col_sint2 = st.columns(2)
                     
-                    for idx, (emoji, nombre, campo) in enumerate(sintomas):
+                    for idx, (emoji, nombre, campo) in enumerate(indicadores.SINTOMAS):
                         valor = paciente.get(campo, 'N/A')
                         
                         target_col = col_sint1 if idx % 2 == 0 else col_sint2
                         
                         with target_col:
-                            if valor in ['SI', 'SÍ', 'Si', 'si', 'YES', 'Yes']:
+                            if motor.es_si(valor):
                                 st.error(f"{emoji} **{nombre}:** ✅ SI")
-                            elif valor in ['NO', 'No', 'no']:
+                            elif motor.es_no(valor):
                                 st.success(f"{emoji} **{nombre}:** ❌ NO")
                             else:
                                 st.info(f"{emoji} **{nombre}:** ⚪ {valor}")
@@ -325,7 +667,7 @@ if uploaded_file is not None:
                         ("✈️", "Enviada a España", paciente.get('FECHA ENVIO MUESTRAS A ESPAÑA'), None),
                         ("📥", "Resultados Recibidos", paciente.get('FECHA DE RECIBIDO'), None),
                         ("📧", "Resultados Enviados", 
-                         "✅ Completado" if paciente.get('RESULTADOS ENVIADOS') in ['SI', 'SÍ', 'Si'] else "⏳ Pendiente", 
+                         "✅ Completado" if motor.es_si(paciente.get('RESULTADOS ENVIADOS')) else "⏳ Pendiente", 
                          None)
                     ]
                     
@@ -400,22 +742,29 @@ if uploaded_file is not None:
                 st.dataframe(df_filtrado.head(10), use_container_width=True)
         
         # === ESTADÍSTICAS Y GRÁFICOS ===
+        # Plotly se importa aquí: KPIs, lista y detalle ya se enviaron al
+        # navegador antes de pagar su importación
+        t_graficos = time.perf_counter()
+        import plotly.express as px
+        import plotly.graph_objects as go
+        tiempos['Importar plotly'] = time.perf_counter() - t_graficos
+        
         st.markdown("---")
         st.markdown("## 📊 Análisis Estadístico")
         
-        tab_stats1, tab_stats2, tab_stats3 = st.tabs([
+        tab_stats1, tab_stats2, tab_stats3, tab_stats4 = st.tabs([
             "🏙️ Distribución Geográfica",
             "🩺 Análisis Clínico",
-            "📈 Progreso del Proceso"
+            "📈 Progreso del Proceso",
+            "📉 Tendencias"
         ])
         
         with tab_stats1:
             col_geo1, col_geo2 = st.columns(2)
             
             with col_geo1:
-                if 'CIUDAD' in df_filtrado.columns:
-                    ciudad_counts = df_filtrado['CIUDAD'].value_counts().reset_index()
-                    ciudad_counts.columns = ['Ciudad', 'Cantidad']
+                if graficos['ciudad'] is not None:
+                    ciudad_counts = pd.DataFrame(list(graficos['ciudad'].items()), columns=['Ciudad', 'Cantidad'])
                     fig_ciudad = px.bar(
                         ciudad_counts,
                         x='Ciudad',
@@ -429,9 +778,8 @@ if uploaded_file is not None:
                     st.plotly_chart(fig_ciudad, use_container_width=True)
             
             with col_geo2:
-                if 'EPS' in df_filtrado.columns:
-                    eps_counts = df_filtrado['EPS'].value_counts().reset_index()
-                    eps_counts.columns = ['EPS', 'Cantidad']
+                if graficos['eps'] is not None:
+                    eps_counts = pd.DataFrame(list(graficos['eps'].items()), columns=['EPS', 'Cantidad'])
                     fig_eps = px.pie(
                         eps_counts,
                         values='Cantidad',
@@ -445,10 +793,10 @@ if uploaded_file is not None:
             col_clin1, col_clin2 = st.columns(2)
             
             with col_clin1:
-                if 'ANTECEDENTES TABAQUISMO' in df_filtrado.columns:
-                    tabaq_data = df_filtrado['ANTECEDENTES TABAQUISMO'].value_counts()
+                if graficos['tabaquismo'] is not None:
+                    tabaq_data = graficos['tabaquismo']
                     fig_tabaq = go.Figure(data=[
-                        go.Bar(x=tabaq_data.index, y=tabaq_data.values, 
+                        go.Bar(x=list(tabaq_data.keys()), y=list(tabaq_data.values()), 
                                marker_color=['#FF6B6B', '#4ECDC4'])
                     ])
                     fig_tabaq.update_layout(title='🚬 Antecedentes de Tabaquismo')
@@ -456,25 +804,8 @@ if uploaded_file is not None:
             
             with col_clin2:
                 # Gráfico de síntomas
-                sintomas_cols = [
-                    'DIFICULTAD RESPIRATORIA CON EL EJERCICI0',
-                    'TOS MAS DE 3 MESES AL AÑO',
-                    'SIBILANCIAS'
-                ]
-                
-                sintomas_data = []
-                for col in sintomas_cols:
-                    if col in df_filtrado.columns:
-                        count_si = len(df_filtrado[df_filtrado[col] == 'SI'])
-                        sintomas_data.append({
-                            'Síntoma': col.replace('DIFICULTAD RESPIRATORIA CON EL EJERCICI0', 'Dif. Respiratoria')
-                                           .replace('TOS MAS DE 3 MESES AL AÑO', 'Tos Crónica')
-                                           .replace('SIBILANCIAS', 'Sibilancias'),
-                            'Cantidad': count_si
-                        })
-                
-                if sintomas_data:
-                    df_sintomas = pd.DataFrame(sintomas_data)
+                if graficos['sintomas']:
+                    df_sintomas = pd.DataFrame(list(graficos['sintomas'].items()), columns=['Síntoma', 'Cantidad'])
                     fig_sintomas = px.bar(
                         df_sintomas,
                         x='Síntoma',
@@ -488,13 +819,7 @@ if uploaded_file is not None:
         with tab_stats3:
             # Embudo del proceso
             fases_nombres = ['Registrados', 'Muestra Tomada', 'Enviadas España', 'Resultados', 'Completados']
-            fases_valores = [
-                len(df_filtrado),
-                len(df_filtrado[df_filtrado['FECHA TOMA MUESTRA'].notna()]) if 'FECHA TOMA MUESTRA' in df_filtrado.columns else 0,
-                len(df_filtrado[df_filtrado['MUESTRA ENVIADA A ESPAÑA'] == 'SI']) if 'MUESTRA ENVIADA A ESPAÑA' in df_filtrado.columns else 0,
-                len(df_filtrado[df_filtrado['FECHA DE RECIBIDO'].notna()]) if 'FECHA DE RECIBIDO' in df_filtrado.columns else 0,
-                len(df_filtrado[df_filtrado['RESULTADOS ENVIADOS'] == 'SI']) if 'RESULTADOS ENVIADOS' in df_filtrado.columns else 0
-            ]
+            fases_valores = graficos['embudo']
             
             fig_funnel = go.Figure(go.Funnel(
                 y=fases_nombres,
@@ -505,44 +830,143 @@ if uploaded_file is not None:
             fig_funnel.update_layout(title='📊 Embudo del Proceso de Tamizaje')
             st.plotly_chart(fig_funnel, use_container_width=True)
         
+        with tab_stats4:
+            col_tend1, col_tend2, col_tend3 = st.columns(3)
+            
+            with col_tend1:
+                frecuencia = st.radio(
+                    "Agrupar por", ['semana', 'mes'], horizontal=True,
+                    format_func=lambda f: {'semana': 'Semana', 'mes': 'Mes'}[f],
+                    key='tendencias_frecuencia'
+                )
+            
+            desgloses = {
+                'CIUDAD': 'Ciudad', 'EPS': 'EPS', 'ESTADO': 'Estado',
+                'MES': 'Mes', 'ANTECEDENTES TABAQUISMO': 'Tabaquismo',
+            }
+            opciones_desglose = [None] + [c for c in desgloses if c in dataset['indice_facetas']['columnas']]
+            with col_tend2:
+                por = st.selectbox(
+                    "Desglosar por", opciones_desglose,
+                    format_func=lambda c: "Sin desglose" if c is None else desgloses[c],
+                    key='tendencias_desglose'
+                )
+            
+            # Sin filtros: series compartidas por todas las sesiones, a partir
+            # de los totales ya agregados del índice
+            if len(resultado['filas']) == len(df):
+                serie = servidor.tendencias_sin_filtros(version, dataset, frecuencia, por)
+            else:
+                serie = motor.calcular_tendencias(dataset, frecuencia, resultado['filas'], por=por)
+            
+            if serie.empty:
+                st.info("No hay fechas registradas en la selección")
+            else:
+                if por is None:
+                    color, titulo = 'fase', f"📉 Flujo del proceso por {frecuencia}"
+                else:
+                    with col_tend3:
+                        fase_tendencia = st.selectbox(
+                            "Fase", list(serie['fase'].unique()), key='tendencias_fase'
+                        )
+                    serie = serie[serie['fase'] == fase_tendencia]
+                    color, titulo = 'grupo', f"📉 {fase_tendencia} por {frecuencia} y {desgloses[por]}"
+                
+                ventana = tendencias.VENTANAS[frecuencia]
+                fig_tendencias = px.line(
+                    serie, x='periodo', y='cantidad', color=color, markers=True,
+                    title=titulo, labels={'periodo': '', 'cantidad': 'Pacientes', 'fase': 'Fase', 'grupo': desgloses.get(por, '')}
+                )
+                # Media móvil punteada, del mismo color que su serie
+                colores = {traza.name: traza.line.color for traza in fig_tendencias.data}
+                for nombre, grupo in serie.groupby(color, sort=False):
+                    fig_tendencias.add_scatter(
+                        x=grupo['periodo'], y=grupo['media_movil'], mode='lines',
+                        name=f"{nombre} (media {ventana})", line={'dash': 'dot', 'color': colores.get(nombre)},
+                    )
+                st.plotly_chart(fig_tendencias, use_container_width=True)
+                st.caption(
+                    f"Línea punteada: media móvil de {ventana} "
+                    f"{'semanas' if frecuencia == 'semana' else 'meses'}"
+                )
+        
+        tiempos['Gráficos'] = time.perf_counter() - t_graficos
+        
         # === BOTONES DE DESCARGA ===
         st.markdown("---")
         st.markdown("## 📥 Exportar Datos")
         
         col_down1, col_down2, col_down3 = st.columns(3)
         
+        # Firma de la selección: los archivos se rehacen solo si cambia
+        firma_filas = (version, motor.huella_filas(resultado['filas']))
+        seleccion_auditada = {
+            'filas': len(resultado['filas']), 'filtros': filtros_activos,
+            'busqueda': busqueda, 'cola': cola_sel, 'version': version,
+        }
+        
         with col_down1:
-            csv = df_filtrado.to_csv(index=False).encode('utf-8')
+            csv = sesiones.derivado(
+                id_sesion, 'csv_filtrados', firma_filas,
+                lambda: motor.exportar(dataset, resultado['filas'], formato='csv'),
+            )
             st.download_button(
                 label="📊 Descargar Datos Filtrados (CSV)",
                 data=csv,
                 file_name=f'pacientes_filtrados_{datetime.now().strftime("%Y%m%d_%H%M")}.csv',
-                mime='text/csv',
+                mime=motor.MIME['csv'],
+                on_click=auditar_descarga,
+                args=('filtrados', 'csv'),
+                kwargs=seleccion_auditada,
             )
         
         with col_down2:
-            csv_all = df.to_csv(index=False).encode('utf-8')
+            csv_all = sesiones.derivado(
+                id_sesion, 'csv_todos', version, lambda: motor.exportar(dataset, formato='csv')
+            )
             st.download_button(
                 label="📋 Descargar Todos los Datos (CSV)",
                 data=csv_all,
                 file_name=f'pacientes_completo_{datetime.now().strftime("%Y%m%d_%H%M")}.csv',
-                mime='text/csv',
+                mime=motor.MIME['csv'],
+                on_click=auditar_descarga,
+                args=('todos', 'csv'),
+                kwargs={'filas': len(df), 'version': version},
             )
         
         with col_down3:
-            # Excel filtrado
-            from io import BytesIO
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_filtrado.to_excel(writer, index=False, sheet_name='Pacientes')
-            buffer.seek(0)
-            
-            st.download_button(
-                label="📊 Descargar Filtrados (Excel)",
-                data=buffer,
-                file_name=f'pacientes_filtrados_{datetime.now().strftime("%Y%m%d_%H%M")}.xlsx',
-                mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            # Excel, Parquet y CSV comprimidos: se generan (e importan openpyxl o
+            # pyarrow) solo a pedido, en un archivo temporal que pasa a disco
+            # si es grande
+            formato_archivo = st.selectbox(
+                "Formato",
+                ['xlsx', 'parquet', 'csv.gz', 'csv.zst'],
+                format_func=lambda f: motor.ETIQUETAS[f],
+                key="formato_exportacion",
             )
+            # El archivo se arma (o se toma de la sesión si la selección no
+            # cambió) solo al pulsar Preparar, y el botón de descarga se dibuja
+            # únicamente en ese rerun: los demás reruns no vuelven a leerlo
+            firma_archivo = (*firma_filas, formato_archivo)
+            if st.button(f"📦 Preparar {motor.ETIQUETAS[formato_archivo]} (Filtrados)"):
+                with sesiones.en_uso(
+                    id_sesion, 'exportacion_filtrada', firma_archivo,
+                    lambda: motor.exportar_temporal(dataset, resultado['filas'], formato=formato_archivo),
+                ) as archivo:
+                    archivo.seek(0)
+                    contenido = archivo.read()
+                st.download_button(
+                    label=f"📊 Descargar Filtrados ({motor.ETIQUETAS[formato_archivo]})",
+                    data=contenido,
+                    file_name=f'pacientes_filtrados_{datetime.now().strftime("%Y%m%d_%H%M")}.{formato_archivo}',
+                    mime=motor.MIME[formato_archivo],
+                    on_click=auditar_descarga,
+                    args=('filtrados', formato_archivo),
+                    kwargs=seleccion_auditada,
+                )
+                st.caption("El botón se quita al cambiar la vista; vuelve a preparar el archivo si lo necesitas.")
+        
+        memoria = sesiones.uso(id_sesion)
         
     except Exception as e:
         st.error(f"❌ Error al procesar el archivo: {str(e)}")
@@ -560,12 +984,14 @@ else:
         Este sistema te permite:
         
         ✅ **Cargar y visualizar** datos de pacientes desde Excel  
+        ✅ **Acumular cargas** en un maestro: cada Excel actualiza por CEDULA  
         ✅ **Filtrar** por ciudad, EPS, estado y síntomas clínicos  
         ✅ **Ver detalles completos** de cada paciente  
         ✅ **Analizar síntomas respiratorios** (tabaquismo, tos, sibilancias, etc.)  
         ✅ **Hacer seguimiento** del proceso completo (toma → España → resultados)  
         ✅ **Generar gráficos** estadísticos automáticamente  
-        ✅ **Exportar reportes** en CSV y Excel  
+        ✅ **Ver tendencias** semanales y mensuales de cada fase, con media móvil  
+        ✅ **Exportar reportes** en CSV, Excel, Parquet y CSV comprimido  
         
         ### 📋 Columnas Esperadas:
         
@@ -603,6 +1029,27 @@ else:
         Asegúrate de que los nombres de las columnas en tu Excel coincidan exactamente con los esperados.
         """)
 
+# === INSTRUMENTACIÓN ===
+tiempos['Total del script'] = time.perf_counter() - t_inicio
+
+with st.sidebar.expander("⏱️ Instrumentación"):
+    for etapa, segundos in tiempos.items():
+        st.caption(f"**{etapa}:** {segundos * 1000:.0f} ms")
+    if memoria is not None:
+        st.caption(
+            f"**Memoria de la sesión:** {memoria['sesion'] / 2**20:.1f} de "
+            f"{memoria['max_sesion'] / 2**20:.0f} MB ({memoria['datos_sesion']} datos)"
+        )
+        st.caption(
+            f"**Memoria de todas las sesiones:** {memoria['total'] / 2**20:.1f} de "
+            f"{memoria['max_total'] / 2**20:.0f} MB ({memoria['sesiones']} sesiones)"
+        )
+        if memoria['liberados']:
+            st.caption(
+                f"**Liberados por presupuesto:** {memoria['liberados']} datos "
+                f"({memoria['bytes_liberados'] / 2**20:.1f} MB)"
+            )
+
 # === FOOTER ===
 st.markdown("---")
 st.markdown("""
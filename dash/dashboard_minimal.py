@@ -1,35 +1,18 @@
+import time
+t_inicio = time.perf_counter()  # Para el panel de instrumentación
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
-import time
 
-# ==========================================
-# CONFIGURACIÓN BACKEND
-# ==========================================
+import alertas
+import auditoria
+import cohortes
+import motor
+import servidor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-def cargar_datos_backend():
-    """
-    Conecta con el backend para obtener datos.
-    Reemplaza esta función con tu conexión real a base de datos.
-    """
-    # OPCIÓN 1: Conexión a base de datos
-    # import psycopg2  # o pymysql, sqlite3, etc.
-    # conn = psycopg2.connect(...)
-    # df = pd.read_sql("SELECT * FROM pacientes", conn)
-    
-    # OPCIÓN 2: API REST
-    # import requests
-    # response = requests.get("https://tu-api.com/pacientes")
-    # df = pd.DataFrame(response.json())
-    
-    # OPCIÓN 3: Archivo local en servidor (temporal)
-    
-    df = pd.read_excel("datos/tmz.xlsx")
-    
-    # SIMULACIÓN (reemplazar con código real)
-    return None
+tiempos = {'Importar módulos': time.perf_counter() - t_inicio}
 
 # ==========================================
 # CONFIGURACIÓN DE PÁGINA
@@ -211,23 +194,18 @@ st.markdown("<hr style='margin: 1rem 0;'>", unsafe_allow_html=True)
 # CARGA DE DATOS
 # ==========================================
 
-# Intentar cargar desde backend
-@st.cache_data(ttl=300)  # Cache por 5 minutos
-def get_data():
-    """Obtiene datos del backend con cache"""
-    df = cargar_datos_backend()
-    
-    # Si no hay conexión backend, usar datos de sesión como fallback
-    if df is None and 'df' in st.session_state:
-        return st.session_state['df']
-    
-    return df
+# Cargar datos del backend (compartidos entre sesiones, ver servidor.py;
+# precalentar.py los deja listos al arrancar)
+t_carga = time.perf_counter()
+dataset = servidor.datos_backend()
 
-# Cargar datos
-df = get_data()
+# Si no hay conexión backend, usar datos de sesión como fallback
+if dataset is None:
+    dataset = st.session_state.get('dataset')
+tiempos['Carga de datos'] = time.perf_counter() - t_carga
 
 # Si no hay datos, mostrar opción de carga manual (temporal)
-if df is None:
+if dataset is None:
     col_upload1, col_upload2 = st.columns([2, 1])
     
     with col_upload1:
@@ -240,10 +218,16 @@ if df is None:
         
         if uploaded_file:
             try:
-                df = pd.read_excel(uploaded_file)
-                st.session_state['df'] = df
-                st.success("✅ Datos cargados correctamente")
-                st.rerun()
+                df_carga = pd.read_excel(uploaded_file)
+                reporte = motor.validar(df_carga)
+                if reporte['bloqueante']:
+                    faltantes = [p['columna'] for p in reporte['esquema']
+                                 if p['severidad'] == 'error' and p['problema'] == 'Falta la columna']
+                    st.error(f"❌ Faltan columnas obligatorias: {', '.join(faltantes)}")
+                else:
+                    st.session_state['dataset'] = motor.preparar_dataset(df_carga, version=reporte['version'])
+                    st.success("✅ Datos cargados correctamente")
+                    st.rerun()
             except Exception as e:
                 st.error(f"❌ Error: {str(e)}")
     
@@ -251,7 +235,7 @@ if df is None:
         st.markdown("""
         ### 🔧 Configuración Backend
         
-        Para conectar al backend, edita la función `cargar_datos_backend()`:
+        Para conectar al backend, edita la función `cargar_datos_backend()` en `servidor.py`:
         
         **PostgreSQL:**
         ```python
@@ -268,72 +252,230 @@ if df is None:
     
     st.stop()
 
+df = dataset['df']
+version = dataset['version']
+
+# Auditoría de acceso: usuario autenticado, el que informa el proxy
+# (solo si es confiable) o la IP
+id_sesion = get_script_run_ctx().session_id
+usuario = auditoria.usuario_de(st.user.get('email'), st.context.headers, st.context.ip_address)
+
 # ==========================================
 # SIDEBAR - FILTROS
 # ==========================================
 
 st.sidebar.markdown("### 🔍 Filtros")
 
+# (columna, etiqueta, opción sin filtro)
+FILTROS_FACETA = [
+    ('CIUDAD', "Ciudad", "Todas"),
+    ('EPS', "EPS", "Todas"),
+    ('ESTADO', "Estado", "Todos"),
+    ('ANTECEDENTES TABAQUISMO', "Tabaquismo", "Todos"),
+]
+
+# (columna, etiqueta): columnas con demasiados valores para un selectbox;
+# se eligen entre las sugerencias del índice de texto
+FILTROS_AUTOCOMPLETAR = [
+    ('IPS/INSTITUTO QUE REMITE', "IPS / Instituto"),
+    ('NOMBRE MÉDICO', "Médico"),
+    ('SEDES', "Sede"),
+    ('REPRESENTANTE', "Representante"),
+    ('QUIEN TOMO LA MUESTRA', "Tomó la muestra"),
+]
+
+def limpiar_filtros():
+    """Restablece todos los filtros del sidebar"""
+    for columna, _, sin_filtro in FILTROS_FACETA:
+        st.session_state[f"filtro_{columna}"] = sin_filtro
+    for columna, _ in FILTROS_AUTOCOMPLETAR:
+        st.session_state[f"filtro_{columna}"] = []
+        st.session_state[f"sugerir_{columna}"] = ""
+    st.session_state["busqueda"] = ""
+    st.session_state["cola_sla"] = "Ninguna"
+    st.session_state["cohorte_sel"] = "—"
+
 # Búsqueda rápida
 busqueda = st.sidebar.text_input(
     "Buscar paciente",
     placeholder="Nombre o cédula...",
-    label_visibility="collapsed"
+    label_visibility="collapsed",
+    key="busqueda"
 )
 
 st.sidebar.markdown("<br>", unsafe_allow_html=True)
 
-# Filtros principales
-ciudad_options = ["Todas"] + sorted(df['CIUDAD'].dropna().unique().tolist())
-ciudad_sel = st.sidebar.selectbox("Ciudad", ciudad_options, label_visibility="visible")
+# Estado actual de los filtros, leído antes de dibujar los widgets para que
+# cada opción muestre cuántos pacientes quedarían con los demás filtros
+filtros_activos = {}
+for columna, _, sin_filtro in FILTROS_FACETA:
+    valor = st.session_state.get(f"filtro_{columna}", sin_filtro)
+    if valor != sin_filtro:
+        filtros_activos[columna] = valor
+for columna, _ in FILTROS_AUTOCOMPLETAR:
+    valor = st.session_state.get(f"filtro_{columna}")
+    if valor:
+        filtros_activos[columna] = list(valor)
+
+# Colas de trabajo SLA (se calculan en segundo plano tras cada carga)
+alertas.programar_evaluacion(df, version)
+colas = alertas.colas_de_trabajo(version)
+cola_sel = st.session_state.get("cola_sla", "Ninguna")
+filas_cola = colas[cola_sel] if colas is not None and cola_sel in colas else None
+
+# Búsqueda y cola SLA restringen también los conteos de las facetas
+conteos = motor.conteos_facetas(
+    dataset, filtros_activos, busqueda, filas=filas_cola,
+    # La clave son las filas de la cola, no su nombre: cambian al
+    # terminar la evaluación y con la evaluación de cada día
+    clave_base=(busqueda, motor.huella_filas(filas_cola) if filas_cola is not None else None),
+)
 
-eps_options = ["Todas"] + sorted(df['EPS'].dropna().unique().tolist())
-eps_sel = st.sidebar.selectbox("EPS", eps_options)
+def opciones_faceta(columna, sin_filtro):
+    """Opciones con pacientes (más la seleccionada) y su etiqueta con conteo"""
+    cuentas = conteos[columna]
+    actual = st.session_state.get(f"filtro_{columna}", sin_filtro)
+    opciones = [v for v, n in cuentas.items() if n > 0]
+    if actual != sin_filtro and actual not in opciones:
+        opciones.append(actual)
+    etiqueta = lambda v: v if v == sin_filtro else f"{v} ({cuentas.get(v, 0)})"
+    return [sin_filtro] + opciones, etiqueta
 
-if 'ESTADO' in df.columns:
-    estado_options = ["Todos"] + sorted(df['ESTADO'].dropna().unique().tolist())
-    estado_sel = st.sidebar.selectbox("Estado", estado_options)
-else:
-    estado_sel = "Todos"
+# Filtros principales
+for columna, etiqueta, sin_filtro in FILTROS_FACETA[:3]:
+    if columna in conteos:
+        opciones, formato = opciones_faceta(columna, sin_filtro)
+        st.sidebar.selectbox(etiqueta, opciones, format_func=formato, key=f"filtro_{columna}")
 
 # Filtros clínicos
 st.sidebar.markdown("<br>", unsafe_allow_html=True)
 st.sidebar.markdown("**Filtros Clínicos**")
 
-if 'ANTECEDENTES TABAQUISMO' in df.columns:
-    tabaquismo_sel = st.sidebar.radio(
+if 'ANTECEDENTES TABAQUISMO' in conteos:
+    cuentas_tabaquismo = conteos['ANTECEDENTES TABAQUISMO']
+    st.sidebar.radio(
         "Tabaquismo",
         ["Todos", "SI", "NO"],
+        format_func=lambda v: v if v == "Todos" else f"{v} ({cuentas_tabaquismo.get(v, 0)})",
         horizontal=True,
-        label_visibility="visible"
+        label_visibility="visible",
+        key="filtro_ANTECEDENTES TABAQUISMO"
     )
-else:
-    tabaquismo_sel = "Todos"
 
-# Aplicar filtros
-df_filtrado = df.copy()
+# Instituciones y personal: texto -> sugerencias (al pulsar Enter) -> selección
+st.sidebar.markdown("<br>", unsafe_allow_html=True)
+st.sidebar.markdown("**Instituciones y personal**")
+
+for columna, etiqueta in FILTROS_AUTOCOMPLETAR:
+    if columna not in conteos:
+        continue
+    cuentas = conteos[columna]
+    elegidos = list(st.session_state.get(f"filtro_{columna}", []))
+    texto = st.sidebar.text_input(
+        etiqueta, placeholder="Escribe y pulsa Enter...", key=f"sugerir_{columna}",
+        help="Las sugerencias aparecen al pulsar Enter"
+    )
+    sugeridas = [
+        v for v in motor.sugerencias(dataset, columna, texto) if cuentas.get(v, 0) > 0
+    ] if texto else []
+    # La selección vive en filtro_<columna>: el widget cambia con las opciones
+    st.session_state[f"multiple_{columna}"] = elegidos
+    st.sidebar.multiselect(
+        etiqueta,
+        list(dict.fromkeys(elegidos + sugeridas)),
+        format_func=lambda v, cuentas=cuentas: f"{v} ({cuentas.get(v, 0)})",
+        placeholder="Elige entre las sugerencias",
+        label_visibility="collapsed",
+        key=f"multiple_{columna}",
+        on_change=lambda columna=columna: st.session_state.update(
+            {f"filtro_{columna}": st.session_state[f"multiple_{columna}"]}
+        )
+    )
 
-if busqueda:
-    df_filtrado = df_filtrado[
-        df_filtrado['NOMBRE'].str.contains(busqueda, case=False, na=False) |
-        df_filtrado['CEDULA'].astype(str).str.contains(busqueda, case=False, na=False)
-    ]
+st.sidebar.markdown("<br>", unsafe_allow_html=True)
+st.sidebar.markdown("**Alertas**")
 
-if ciudad_sel != "Todas":
-    df_filtrado = df_filtrado[df_filtrado['CIUDAD'] == ciudad_sel]
+if colas is None:
+    st.sidebar.caption("⏳ Calculando alertas...")
+else:
+    nombres_reglas = {r['id']: r['nombre'] for r in alertas.REGLAS_SLA}
+    st.sidebar.selectbox(
+        "Cola de trabajo",
+        ["Ninguna"] + list(colas.keys()),
+        format_func=lambda c: c if c == "Ninguna" else f"{nombres_reglas[c]} ({len(colas[c])})",
+        key="cola_sla"
+    )
 
-if eps_sel != "Todas":
-    df_filtrado = df_filtrado[df_filtrado['EPS'] == eps_sel]
+# Botón limpiar
+st.sidebar.button("🔄 Limpiar filtros", use_container_width=True, on_click=limpiar_filtros)
 
-if estado_sel != "Todos" and 'ESTADO' in df.columns:
-    df_filtrado = df_filtrado[df_filtrado['ESTADO'] == estado_sel]
+# Cohortes guardadas: filtros con nombre cuyos resultados se cachean en disco
+st.sidebar.markdown("<br>", unsafe_allow_html=True)
+st.sidebar.markdown("**Cohortes**")
+
+spec_actual = cohortes.especificacion(filtros_activos, busqueda)
+cohortes_guardadas = cohortes.listar()
+
+def abrir_cohorte():
+    """Aplica los filtros de la cohorte elegida"""
+    nombre = st.session_state.get("cohorte_sel")
+    if nombre not in cohortes_guardadas:
+        return
+    limpiar_filtros()
+    st.session_state["cohorte_sel"] = nombre
+    spec = cohortes_guardadas[nombre]
+    for columna, valor in spec['filtros'].items():
+        st.session_state[f"filtro_{columna}"] = valor
+    st.session_state["busqueda"] = spec['busqueda']
+
+def guardar_cohorte(spec):
+    """Guarda los filtros actuales con el nombre escrito"""
+    nombre = st.session_state.get("nombre_cohorte", "").strip()
+    if nombre:
+        cohortes.guardar(nombre, spec)
+        st.session_state["cohorte_sel"] = nombre
+
+if cohortes_guardadas:
+    st.sidebar.selectbox(
+        "Abrir cohorte",
+        ["—"] + sorted(cohortes_guardadas),
+        key="cohorte_sel",
+        on_change=abrir_cohorte
+    )
 
-if tabaquismo_sel != "Todos" and 'ANTECEDENTES TABAQUISMO' in df.columns:
-    df_filtrado = df_filtrado[df_filtrado['ANTECEDENTES TABAQUISMO'] == tabaquismo_sel]
+st.sidebar.text_input(
+    "Nombre de la cohorte",
+    placeholder="Guardar filtros como...",
+    label_visibility="collapsed",
+    key="nombre_cohorte"
+)
+st.sidebar.button("💾 Guardar cohorte", use_container_width=True, on_click=guardar_cohorte, args=(spec_actual,))
+
+# Aplicar filtros. Si coinciden con una cohorte guardada (y no hay cola SLA
+# activa) se usa su resultado en disco para esta versión de datos
+def calcular_resultado():
+    """Filas, KPIs y agregados de gráficos del estado de filtros actual"""
+    mascara = motor.aplicar_filtros(dataset, filtros_activos, busqueda, filas=filas_cola)
+    return motor.calcular_resultado(dataset, mascara)
+
+t_filtros = time.perf_counter()
+cohorte_activa = None
+if filas_cola is None:
+    cohorte_activa = cohortes.buscar_por_firma(spec_actual)
+
+if cohorte_activa:
+    resultado, _ = cohortes.resultado_cohorte(version, spec_actual, calcular_resultado)
+    st.sidebar.caption(f"📂 {cohorte_activa}")
+elif not filtros_activos and not busqueda and filas_cola is None:
+    # Vista sin filtros: compartida por todas las sesiones (servidor.py)
+    resultado = servidor.resultado_sin_filtros(version, dataset)
+else:
+    resultado = calcular_resultado()
 
-# Botón limpiar
-if st.sidebar.button("🔄 Limpiar filtros", use_container_width=True):
-    st.rerun()
+df_filtrado = motor.seleccion(dataset, resultado['filas'])
+kpis = resultado['kpis']
+graficos = resultado['graficos']
+tiempos['Filtros y KPIs'] = time.perf_counter() - t_filtros
 
 st.sidebar.markdown("<br>", unsafe_allow_html=True)
 st.sidebar.caption(f"📊 {len(df_filtrado)} de {len(df)} pacientes")
@@ -345,31 +487,22 @@ st.sidebar.caption(f"📊 {len(df_filtrado)} de {len(df)} pacientes")
 col1, col2, col3, col4, col5 = st.columns(5)
 
 with col1:
-    st.metric("Total Pacientes", len(df_filtrado))
+    st.metric("Total Pacientes", kpis['total'])
 
 with col2:
-    tomadas = len(df_filtrado[df_filtrado['FECHA TOMA MUESTRA'].notna()]) if 'FECHA TOMA MUESTRA' in df_filtrado.columns else 0
-    porc = (tomadas / len(df_filtrado) * 100) if len(df_filtrado) > 0 else 0
-    st.metric("Muestras Tomadas", tomadas, f"{porc:.0f}%")
+    st.metric("Muestras Tomadas", kpis['tomadas'], f"{kpis['porcentaje_tomadas']:.0f}%")
 
 with col3:
-    enviadas = 0
-    if 'MUESTRA ENVIADA A ESPAÑA' in df_filtrado.columns:
-        enviadas = len(df_filtrado[df_filtrado['MUESTRA ENVIADA A ESPAÑA'].isin(['SI', 'SÍ', 'Si', 'si'])])
-    st.metric("Enviadas", enviadas)
+    st.metric("Enviadas", kpis['enviadas'])
 
 with col4:
-    completados = 0
-    if 'RESULTADOS ENVIADOS' in df_filtrado.columns:
-        completados = len(df_filtrado[df_filtrado['RESULTADOS ENVIADOS'].isin(['SI', 'SÍ', 'Si', 'si'])])
-    st.metric("Completados", completados)
+    st.metric("Completados", kpis['completados'])
 
 with col5:
-    if 'ANTECEDENTES TABAQUISMO' in df_filtrado.columns:
-        fumadores = len(df_filtrado[df_filtrado['ANTECEDENTES TABAQUISMO'] == 'SI'])
-        st.metric("Tabaquismo", fumadores)
+    if kpis['fumadores'] is not None:
+        st.metric("Tabaquismo", kpis['fumadores'])
     else:
-        st.metric("Registros", len(df_filtrado))
+        st.metric("Registros", kpis['total'])
 
 st.markdown("<br>", unsafe_allow_html=True)
 
@@ -379,6 +512,20 @@ st.markdown("<br>", unsafe_allow_html=True)
 
 col_lista, col_detalle = st.columns([1, 2.5])
 
+# El paciente seleccionado viaja en la URL (?cedula=...&fila=...) para
+# compartir enlaces; la fila distingue las cédulas repetidas
+if 'cedula' in st.query_params:
+    st.session_state['paciente_sel'] = st.query_params['cedula']
+    st.session_state['paciente_fila'] = st.query_params.get('fila')
+
+def cerrar_paciente():
+    """Quita el paciente seleccionado de la sesión y de la URL"""
+    for clave in ('paciente_sel', 'paciente_fila'):
+        st.session_state.pop(clave, None)
+    for parametro in ('cedula', 'fila'):
+        if parametro in st.query_params:
+            del st.query_params[parametro]
+
 # Lista de pacientes
 with col_lista:
     st.markdown("### Pacientes")
@@ -386,26 +533,42 @@ with col_lista:
     df_sorted = df_filtrado.sort_values('FECHA REGISTRO', ascending=False) if 'FECHA REGISTRO' in df_filtrado.columns else df_filtrado
     
     for idx, row in df_sorted.head(50).iterrows():
-        estado = row.get('ESTADO', 'Sin estado')
-        
-        if estado == 'Completado':
-            estado_emoji = "✅"
-        elif 'Proceso' in str(estado):
-            estado_emoji = "🔄"
-        else:
-            estado_emoji = "⏳"
+        estado_emoji = {
+            'completado': "✅", 'proceso': "🔄", 'pendiente': "⏳"
+        }[motor.categoria_estado(row.get('ESTADO', 'Sin estado'))]
         
         if st.button(
             f"{estado_emoji} {row['NOMBRE'][:30]}...\n📋 {row['CEDULA']}",
             key=f"btn_{idx}",
             use_container_width=True
         ):
-            st.session_state['paciente_sel'] = row.to_dict()
+            clave = motor.clave_cedula(row['CEDULA'])
+            st.session_state['paciente_sel'] = clave
+            st.session_state['paciente_fila'] = str(idx)
+            st.query_params['cedula'] = clave
+            st.query_params['fila'] = str(idx)
 
 # Detalle del paciente
 with col_detalle:
-    if 'paciente_sel' in st.session_state:
-        p = st.session_state['paciente_sel']
+    # Registro completo buscado por CEDULA (incluye columnas frías)
+    p = motor.obtener_paciente(
+        dataset, st.session_state.get('paciente_sel'), st.session_state.get('paciente_fila')
+    )
+    
+    # Una vez por apertura del paciente, no en cada rerun que lo muestra
+    if p is None:
+        st.session_state.pop('paciente_auditado', None)
+    else:
+        clave_paciente = motor.clave_cedula(st.session_state['paciente_sel'])
+        abierto = (clave_paciente, st.session_state.get('paciente_fila'))
+        if st.session_state.get('paciente_auditado') != abierto:
+            auditoria.registrar(
+                'ver_paciente', usuario=usuario, sesion=id_sesion,
+                cedula=clave_paciente, version=version
+            )
+            st.session_state['paciente_auditado'] = abierto
+    
+    if p is not None:
         
         # Header
         col_h1, col_h2 = st.columns([3, 1])
@@ -415,13 +578,14 @@ with col_detalle:
             st.caption(f"CC: {p['CEDULA']} • {p.get('CIUDAD', 'N/A')}")
         
         with col_h2:
-            estado = p.get('ESTADO', 'Sin estado')
-            if estado == 'Completado':
+            categoria = motor.categoria_estado(p.get('ESTADO', 'Sin estado'))
+            if categoria == 'completado':
                 st.success("✅ Completado")
-            elif 'Proceso' in str(estado):
+            elif categoria == 'proceso':
                 st.info("🔄 En proceso")
             else:
                 st.warning("⏳ Pendiente")
+            st.button("✖ Cerrar", on_click=cerrar_paciente, use_container_width=True)
         
         st.markdown("<hr style='margin: 1rem 0;'>", unsafe_allow_html=True)
         
@@ -461,9 +625,9 @@ with col_detalle:
             for idx, (nombre, campo) in enumerate(sintomas):
                 valor = p.get(campo, 'N/A')
                 with cols[idx % 2]:
-                    if valor in ['SI', 'SÍ', 'Si', 'si']:
+                    if motor.es_si(valor):
                         st.error(f"❌ {nombre}")
-                    elif valor in ['NO', 'No', 'no']:
+                    elif motor.es_no(valor):
                         st.success(f"✅ {nombre}")
                     else:
                         st.caption(f"⚪ {nombre}: {valor}")
@@ -500,6 +664,12 @@ with col_detalle:
 # GRÁFICOS
 # ==========================================
 
+# Plotly se importa aquí, cuando KPIs, lista y detalle ya están en pantalla
+t_graficos = time.perf_counter()
+import plotly.express as px
+import plotly.graph_objects as go
+tiempos['Importar plotly'] = time.perf_counter() - t_graficos
+
 st.markdown("<hr>", unsafe_allow_html=True)
 st.markdown("## Análisis")
 
@@ -509,8 +679,8 @@ with tab_geo:
     col_g1, col_g2 = st.columns(2)
     
     with col_g1:
-        if 'CIUDAD' in df_filtrado.columns:
-            ciudad_counts = df_filtrado['CIUDAD'].value_counts().head(10)
+        if graficos['ciudad'] is not None:
+            ciudad_counts = pd.Series(graficos['ciudad']).head(10)
             fig = px.bar(
                 x=ciudad_counts.values,
                 y=ciudad_counts.index,
@@ -530,8 +700,8 @@ with tab_geo:
             st.plotly_chart(fig, use_container_width=True)
     
     with col_g2:
-        if 'EPS' in df_filtrado.columns:
-            eps_counts = df_filtrado['EPS'].value_counts().head(8)
+        if graficos['eps'] is not None:
+            eps_counts = pd.Series(graficos['eps']).head(8)
             fig = px.pie(
                 values=eps_counts.values,
                 names=eps_counts.index,
@@ -548,13 +718,7 @@ with tab_geo:
 
 with tab_proceso:
     fases = ['Registrados', 'Muestra Tomada', 'Enviadas', 'Resultados', 'Completados']
-    valores = [
-        len(df_filtrado),
-        len(df_filtrado[df_filtrado['FECHA TOMA MUESTRA'].notna()]) if 'FECHA TOMA MUESTRA' in df_filtrado.columns else 0,
-        len(df_filtrado[df_filtrado['MUESTRA ENVIADA A ESPAÑA'] == 'SI']) if 'MUESTRA ENVIADA A ESPAÑA' in df_filtrado.columns else 0,
-        len(df_filtrado[df_filtrado['FECHA DE RECIBIDO'].notna()]) if 'FECHA DE RECIBIDO' in df_filtrado.columns else 0,
-        len(df_filtrado[df_filtrado['RESULTADOS ENVIADOS'] == 'SI']) if 'RESULTADOS ENVIADOS' in df_filtrado.columns else 0
-    ]
+    valores = graficos['embudo']
     
     fig = go.Figure(go.Funnel(
         y=fases,
@@ -570,6 +734,44 @@ with tab_proceso:
     )
     st.plotly_chart(fig, use_container_width=True)
 
+tiempos['Gráficos'] = time.perf_counter() - t_graficos
+
+# ==========================================
+# CALIDAD DE DATOS
+# ==========================================
+
+t_calidad = time.perf_counter()
+reporte, reporte_csv = servidor.calidad_datos(version, dataset)
+tiempos['Validación'] = time.perf_counter() - t_calidad
+
+with st.sidebar.expander(f"🧪 Calidad: {reporte['errores']} errores, {reporte['advertencias']} advertencias"):
+    for problema in reporte['esquema']:
+        st.caption(f"{'❌' if problema['severidad'] == 'error' else '⚠️'} {problema['columna']}: {problema['problema']}")
+    for regla in reporte['reglas']:
+        if regla['total']:
+            st.caption(f"{'❌' if regla['severidad'] == 'error' else '⚠️'} {regla['nombre']}: {regla['total']}")
+    st.download_button(
+        "📥 Reporte (CSV)",
+        data=reporte_csv,
+        file_name=f"calidad_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+        mime=motor.MIME['csv'],
+        use_container_width=True,
+        on_click=auditoria.registrar,
+        args=('exportar',),
+        kwargs={'usuario': usuario, 'sesion': id_sesion, 'contenido': 'reporte_calidad',
+                'formato': 'csv', 'version': version},
+    )
+
+# ==========================================
+# INSTRUMENTACIÓN
+# ==========================================
+
+tiempos['Total del script'] = time.perf_counter() - t_inicio
+
+with st.sidebar.expander("⏱️ Instrumentación"):
+    for etapa, segundos in tiempos.items():
+        st.caption(f"{etapa}: {segundos * 1000:.0f} ms")
+
 # ==========================================
 # FOOTER
 # ==========================================
@@ -0,0 +1,211 @@
+"""
+Exportación de selecciones de pacientes a CSV, Excel, Parquet y CSV
+comprimido.
+
+Cada formato tiene un escritor que vuelca el DataFrame sobre un destino
+(ruta o archivo binario) sin construir copias intermedias. El Excel se
+escribe en modo streaming (openpyxl write_only): las filas se agregan por
+bloques y nunca existe el modelo completo del libro en memoria. Parquet y
+los CSV comprimidos se escriben con pyarrow.
+"""
+import tempfile
+from io import BytesIO
+
+import pandas as pd
+
+MIME = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'csv.gz': 'application/gzip',
+    'csv.zst': 'application/zstd',
+}
+
+# Nombre legible de cada formato para los botones de descarga
+ETIQUETAS = {
+    'csv': 'CSV',
+    'xlsx': 'Excel',
+    'parquet': 'Parquet',
+    'csv.gz': 'CSV gzip',
+    'csv.zst': 'CSV zstd',
+}
+
+# Por encima de este tamaño el archivo temporal pasa de memoria a disco
+TAMANO_SPOOL = 8 * 1024 * 1024
+
+# Filas que se convierten a la vez al escribir el Excel
+FILAS_POR_BLOQUE = 5000
+
+# Columnas de texto con hasta este número de valores distintos (y no más
+# que la mitad de las filas) se exportan como categóricas en Arrow
+MAX_CATEGORIAS = 1000
+
+FORMATO_FECHA = 'DD/MM/YYYY'
+COLOR_ENCABEZADO = '1F4E79'
+
+
+def es_columna_fecha(columna):
+    """Las columnas de fecha del Excel de pacientes empiezan por FECHA"""
+    return str(columna).strip().upper().startswith('FECHA')
+
+
+def escribir_csv(df, destino):
+    """CSV en UTF-8 sin índice"""
+    df.to_csv(destino, index=False, encoding='utf-8', mode='wb')
+
+
+def _valores_columna(serie, fecha):
+    """Valores de una columna listos para openpyxl (None para vacíos)"""
+    texto = serie.dtype == object or isinstance(serie.dtype, pd.StringDtype)
+    if fecha and (texto or pd.api.types.is_datetime64_any_dtype(serie)):
+        convertida = pd.to_datetime(serie, errors='coerce', dayfirst=True)
+        # El texto que no es fecha ('N/A', 'pendiente') se conserva tal cual
+        serie = convertida.astype(object).where(convertida.notna(), serie)
+    return serie.astype(object).where(serie.notna(), None).tolist()
+
+
+def escribir_excel(df, destino, hoja='Pacientes'):
+    """
+    Libro de Excel de una hoja, escrito en streaming.
+
+    Encabezado en negrita con fondo, fila superior fija y las columnas
+    FECHA como fechas reales de Excel. openpyxl se importa solo al llamar.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    libro = Workbook(write_only=True)
+    ws = libro.create_sheet(hoja)
+    ws.freeze_panes = 'A2'
+
+    columnas = [str(c) for c in df.columns]
+    fechas = [es_columna_fecha(c) for c in columnas]
+    for i, columna in enumerate(columnas, start=1):
+        ancho = 12 if fechas[i - 1] else min(max(len(columna) + 2, 10), 40)
+        ws.column_dimensions[get_column_letter(i)].width = ancho
+
+    fuente = Font(bold=True, color='FFFFFF')
+    relleno = PatternFill('solid', fgColor=COLOR_ENCABEZADO)
+    alineacion = Alignment(vertical='center', wrap_text=True)
+    encabezado = []
+    for columna in columnas:
+        celda = WriteOnlyCell(ws, value=columna)
+        celda.font, celda.fill, celda.alignment = fuente, relleno, alineacion
+        encabezado.append(celda)
+    ws.append(encabezado)
+
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        bloque = df.iloc[inicio:inicio + FILAS_POR_BLOQUE]
+        # Acceso por posición: el Excel original tiene columnas duplicadas
+        valores = [
+            _valores_columna(bloque.iloc[:, i], fechas[i]) for i in range(len(columnas))
+        ]
+        for fila in zip(*valores):
+            celdas = list(fila)
+            for i, valor in enumerate(celdas):
+                if fechas[i] and isinstance(valor, pd.Timestamp):
+                    celda = WriteOnlyCell(ws, value=valor.to_pydatetime())
+                    celda.number_format = FORMATO_FECHA
+                    celdas[i] = celda
+            ws.append(celdas)
+
+    libro.save(destino)
+
+
+def tabla_arrow(df):
+    """
+    Tabla de Arrow con los tipos del DataFrame.
+
+    Fechas, booleanos y categóricas se conservan. Las columnas de texto con
+    pocos valores distintos (SI/NO, EPS, CIUDAD...) se guardan como
+    categóricas (diccionario) y las de tipos mezclados, como texto.
+    """
+    import pyarrow as pa
+
+    columnas = {}
+    for i, nombre in enumerate(df.columns):
+        serie = df.iloc[:, i]
+        if serie.dtype == object or isinstance(serie.dtype, pd.StringDtype):
+            if serie.dtype == object and pd.api.types.infer_dtype(serie, skipna=True) not in ('string', 'empty'):
+                serie = serie.where(serie.isna(), serie.astype(str))
+            distintos = serie.nunique()
+            if distintos <= MAX_CATEGORIAS and distintos <= len(serie) // 2:
+                serie = serie.astype('category')
+        columnas[str(nombre)] = serie
+    return pa.Table.from_pandas(pd.DataFrame(columnas), preserve_index=False)
+
+
+def escribir_parquet(df, destino):
+    """Parquet comprimido con zstd, conservando tipos"""
+    import pyarrow.parquet as pq
+
+    pq.write_table(tabla_arrow(df), destino, compression='zstd')
+
+
+class _SinCerrar:
+    """Envoltorio que impide que pyarrow cierre el archivo del llamador"""
+
+    def __init__(self, archivo):
+        self._archivo = archivo
+        self.closed = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._archivo, nombre)
+
+    def close(self):
+        self._archivo.flush()
+        self.closed = True
+
+
+def _escritor_csv_comprimido(compresion):
+    def escribir_csv_comprimido(df, destino):
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+
+        if hasattr(destino, 'write'):
+            destino = pa.PythonFile(_SinCerrar(destino), mode='w')
+        else:
+            destino = str(destino)
+        with pa.CompressedOutputStream(destino, compresion) as salida:
+            pa_csv.write_csv(tabla_arrow(df), salida)
+
+    escribir_csv_comprimido.__doc__ = f"CSV comprimido con {compresion} (pyarrow)"
+    return escribir_csv_comprimido
+
+
+FORMATOS = {
+    'csv': escribir_csv,
+    'xlsx': escribir_excel,
+    'parquet': escribir_parquet,
+    'csv.gz': _escritor_csv_comprimido('gzip'),
+    'csv.zst': _escritor_csv_comprimido('zstd'),
+}
+
+
+def escribir(df, destino, formato):
+    """Vuelca el DataFrame en una ruta o archivo binario"""
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación no soportado: {formato}")
+    FORMATOS[formato](df, destino)
+
+
+def temporal(df, formato):
+    """
+    Archivo temporal con la exportación, posicionado al inicio.
+
+    Se mantiene en memoria mientras es pequeño y pasa a disco al superar
+    TAMANO_SPOOL; se borra solo al cerrarlo o al liberarse.
+    """
+    archivo = tempfile.SpooledTemporaryFile(max_size=TAMANO_SPOOL, suffix=f'.{formato}')
+    escribir(df, archivo, formato)
+    archivo.seek(0)
+    return archivo
+
+
+def contenido(df, formato):
+    """Exportación completa como bytes"""
+    buffer = BytesIO()
+    escribir(df, buffer, formato)
+    return buffer.getvalue()
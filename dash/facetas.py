@@ -0,0 +1,289 @@
+"""
+Motor de facetas para los filtros del sidebar.
+
+Cada columna de faceta se codifica una sola vez al cargar (un código entero
+por valor, es decir, el conjunto de filas de cada valor). Con eso se obtiene
+la máscara de cualquier combinación de filtros y, para cada opción, cuántos
+pacientes quedarían dados los demás filtros activos.
+
+Las columnas de muchos valores (IPS, médico, sede...) se filtran con
+selección múltiple: sus valores distintos tienen además un índice de texto
+(prefijo del valor completo y de cada palabra) para sugerir opciones
+mientras se escribe sin recorrer la columna.
+"""
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS_FACETA = ['CIUDAD', 'EPS', 'ESTADO', 'MES', 'ANTECEDENTES TABAQUISMO']
+
+# Facetas de muchos valores, con índice de sugerencias
+COLUMNAS_AUTOCOMPLETAR = [
+    'IPS/INSTITUTO QUE REMITE',
+    'NOMBRE MÉDICO',
+    'SEDES',
+    'REPRESENTANTE',
+    'QUIEN TOMO LA MUESTRA',
+]
+
+# Sugerencias por consulta como máximo
+MAX_SUGERENCIAS = 20
+
+# Conteos guardados por estado de filtros
+MAX_CONTEOS = 256
+
+_conteos = OrderedDict()
+_lock = threading.Lock()
+
+
+def construir_indice(df, columnas=COLUMNAS_FACETA + COLUMNAS_AUTOCOMPLETAR, version=None):
+    """
+    Codifica las columnas de faceta del DataFrame.
+
+    Retorna un diccionario con el número de filas y, por columna, los
+    códigos por fila (-1 para vacíos), los valores ordenados y el mapa
+    valor -> código; y el índice de sugerencias de las columnas de
+    COLUMNAS_AUTOCOMPLETAR.
+    """
+    indice_columnas = {}
+    for columna in columnas:
+        if columna not in df.columns:
+            continue
+        try:
+            codigos, valores = pd.factorize(df[columna], sort=True)
+        except TypeError:
+            # Tipos mezclados (p. ej. números y texto) no se pueden ordenar
+            codigos, valores = pd.factorize(df[columna].astype(str), sort=True)
+        valores = valores.tolist()
+        indice_columnas[columna] = {
+            'codigos': codigos,
+            'valores': valores,
+            'posicion': {valor: i for i, valor in enumerate(valores)},
+        }
+    return {
+        'version': version,
+        'n': len(df),
+        'columnas': indice_columnas,
+        'sugerencias': _indices_sugerencias(indice_columnas),
+    }
+
+
+def mascara_filtro(indice, columna, valor):
+    """
+    Máscara booleana de un filtro (valor único o lista de valores).
+
+    Retorna None si la columna no existe en el índice: el filtro se ignora.
+    """
+    datos = indice['columnas'].get(columna)
+    if datos is None:
+        return None
+    valores = valor if isinstance(valor, (list, tuple, set)) else [valor]
+    codigos = [datos['posicion'][v] for v in valores if v in datos['posicion']]
+    if not codigos:
+        return np.zeros(indice['n'], dtype=bool)
+    if len(codigos) == 1:
+        return datos['codigos'] == codigos[0]
+    return np.isin(datos['codigos'], codigos)
+
+
+def mascara(indice, filtros, base=None):
+    """Combina los filtros activos ({columna: valor}) en una sola máscara"""
+    if base is None:
+        resultado = np.ones(indice['n'], dtype=bool)
+    else:
+        resultado = np.array(base, dtype=bool)
+    for columna, valor in filtros.items():
+        parcial = mascara_filtro(indice, columna, valor)
+        if parcial is not None:
+            resultado &= parcial
+    return resultado
+
+
+def _congelar(filtros):
+    """Convierte los filtros en una tupla ordenada usable como clave"""
+    return tuple(sorted(
+        (columna, tuple(valor) if isinstance(valor, (list, tuple, set)) else valor)
+        for columna, valor in filtros.items()
+    ))
+
+
+def conteos(indice, filtros, base=None, clave_base=None):
+    """
+    Cuenta, para cada opción de cada faceta, cuántas filas quedarían
+    aplicando todos los demás filtros activos (y la máscara base).
+
+    Los resultados se guardan por (versión, filtros, clave_base); si se pasa
+    una máscara base sin clave_base no se guardan.
+    """
+    clave = None
+    if base is None or clave_base is not None:
+        clave = (indice['version'], _congelar(filtros), clave_base)
+        with _lock:
+            if clave in _conteos:
+                _conteos.move_to_end(clave)
+                return _conteos[clave]
+
+    mascaras = {}
+    for columna, valor in filtros.items():
+        parcial = mascara_filtro(indice, columna, valor)
+        if parcial is not None:
+            mascaras[columna] = parcial
+
+    resultado = {}
+    for columna, datos in indice['columnas'].items():
+        # Todos los filtros excepto el de la propia columna
+        otras = [m for c, m in mascaras.items() if c != columna]
+        if base is not None:
+            otras.append(np.asarray(base, dtype=bool))
+
+        codigos = datos['codigos']
+        if otras:
+            codigos = codigos[np.logical_and.reduce(otras)]
+
+        # Desplazamiento +1 para que los vacíos (-1) caigan en la posición 0
+        cuentas = np.bincount(codigos + 1, minlength=len(datos['valores']) + 1)[1:]
+        resultado[columna] = dict(zip(datos['valores'], cuentas.tolist()))
+
+    if clave is not None:
+        with _lock:
+            _conteos[clave] = resultado
+            while len(_conteos) > MAX_CONTEOS:
+                _conteos.popitem(last=False)
+    return resultado
+
+
+def actualizar_indice(indice, df, posiciones, version=None):
+    """
+    Actualiza el índice tras modificar o agregar filas sin recodificar el
+    resto: solo se codifican las filas en 'posiciones' (las agregadas van
+    al final de df). Si aparecen valores nuevos se insertan en la lista
+    ordenada y los códigos existentes se reasignan con una tabla.
+    """
+    posiciones = np.asarray(posiciones, dtype=np.intp)
+    indice_columnas = {}
+    for columna, datos in indice['columnas'].items():
+        if columna not in df.columns:
+            continue
+        valores_filas = df[columna].iloc[posiciones].tolist()
+        nuevos = list(dict.fromkeys(
+            v for v in valores_filas if not pd.isna(v) and v not in datos['posicion']
+        ))
+
+        codigos = np.full(len(df), -1, dtype=datos['codigos'].dtype)
+        codigos[:len(datos['codigos'])] = datos['codigos']
+        valores, posicion = datos['valores'], datos['posicion']
+        if nuevos:
+            try:
+                valores = sorted(valores + nuevos)
+            except TypeError:
+                # Tipos mezclados: la columna se recodifica completa
+                indice_columnas.update(construir_indice(df, [columna])['columnas'])
+                continue
+            posicion = {valor: i for i, valor in enumerate(valores)}
+            # El último elemento de la tabla mantiene los vacíos (-1) en -1
+            tabla = np.array([posicion[v] for v in datos['valores']] + [-1], dtype=codigos.dtype)
+            codigos = tabla[codigos]
+
+        codigos[posiciones] = [posicion.get(v, -1) for v in valores_filas]
+        indice_columnas[columna] = {'codigos': codigos, 'valores': valores, 'posicion': posicion}
+
+    # Columnas de faceta que llegan por primera vez
+    faltantes = [
+        c for c in COLUMNAS_FACETA + COLUMNAS_AUTOCOMPLETAR
+        if c in df.columns and c not in indice_columnas
+    ]
+    if faltantes:
+        indice_columnas.update(construir_indice(df, faltantes)['columnas'])
+    return {
+        'version': version,
+        'n': len(df),
+        'columnas': indice_columnas,
+        'sugerencias': _indices_sugerencias(indice_columnas, indice),
+    }
+
+
+# ------------------------------------------
+# Sugerencias
+# ------------------------------------------
+
+def normalizar(texto):
+    """Texto para comparar: mayúsculas, sin tildes y con espacios simples"""
+    texto = unicodedata.normalize('NFKD', str(texto).upper())
+    texto = ''.join(c if c.isalnum() else ' ' for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+def _rango(ordenados, prefijo):
+    """Posiciones [inicio, fin) de los textos ordenados que empiezan por prefijo"""
+    return bisect_left(ordenados, prefijo), bisect_left(ordenados, prefijo + '\U0010ffff')
+
+
+def construir_sugerencias(valores):
+    """
+    Índice de texto de los valores distintos de una columna: los valores
+    normalizados ordenados (búsqueda por prefijo del valor completo) y
+    cada palabra con los códigos de los valores que la contienen.
+    """
+    normalizados = [normalizar(v) for v in valores]
+    orden = sorted(range(len(valores)), key=normalizados.__getitem__)
+    palabras = {}
+    for codigo, texto in enumerate(normalizados):
+        for palabra in set(texto.split()):
+            palabras.setdefault(palabra, []).append(codigo)
+    claves = sorted(palabras)
+    return {
+        'textos': [normalizados[c] for c in orden],
+        'codigos': orden,
+        'palabras': claves,
+        'codigos_palabra': [palabras[p] for p in claves],
+    }
+
+
+def _indices_sugerencias(indice_columnas, anterior=None):
+    """Índices de sugerencias; se reutilizan los de columnas sin valores nuevos"""
+    resultado = {}
+    for columna in COLUMNAS_AUTOCOMPLETAR:
+        datos = indice_columnas.get(columna)
+        if datos is None:
+            continue
+        previo = anterior['columnas'].get(columna) if anterior is not None else None
+        if previo is not None and previo['valores'] is datos['valores'] and columna in anterior['sugerencias']:
+            resultado[columna] = anterior['sugerencias'][columna]
+        else:
+            resultado[columna] = construir_sugerencias(datos['valores'])
+    return resultado
+
+
+def sugerencias(indice, columna, texto, limite=MAX_SUGERENCIAS):
+    """
+    Valores de la columna que coinciden con lo escrito: primero los que
+    empiezan por el texto y luego, en orden alfabético, los que tienen
+    palabras que empiezan por cada palabra escrita ('lei pra' encuentra
+    'DRA. LEIDY PRADA'). Solo consulta el índice, no la columna.
+    """
+    datos = indice['columnas'].get(columna)
+    indice_texto = indice.get('sugerencias', {}).get(columna)
+    consulta = normalizar(texto)
+    if datos is None or indice_texto is None or not consulta:
+        return []
+
+    inicio, fin = _rango(indice_texto['textos'], consulta)
+    codigos = indice_texto['codigos'][inicio:fin][:limite]
+
+    if len(codigos) < limite:
+        candidatos = None
+        for palabra in consulta.split():
+            inicio, fin = _rango(indice_texto['palabras'], palabra)
+            coinciden = set()
+            for grupo in indice_texto['codigos_palabra'][inicio:fin]:
+                coinciden.update(grupo)
+            candidatos = coinciden if candidatos is None else candidatos & coinciden
+            if not candidatos:
+                break
+        codigos = list(dict.fromkeys(codigos + sorted(candidatos or ())))[:limite]
+
+    return [datos['valores'][c] for c in codigos]
@@ -0,0 +1,113 @@
+"""
+Cálculo de KPIs y agregados para gráficos a partir de un DataFrame filtrado.
+
+Los resultados son diccionarios con tipos nativos de Python, de modo que se
+pueden guardar en JSON (caché de cohortes) y dibujar sin recalcular.
+"""
+# Convenciones SI/NO del Excel (mayúsculas, tildes y variantes en inglés)
+VALORES_SI = ['SI', 'SÍ', 'Si', 'si', 'YES', 'Yes']
+VALORES_NO = ['NO', 'No', 'no']
+
+# (columna, etiqueta) del gráfico de prevalencia de síntomas
+SINTOMAS_GRAFICO = [
+    ('DIFICULTAD RESPIRATORIA CON EL EJERCICI0', 'Dif. Respiratoria'),
+    ('TOS MAS DE 3 MESES AL AÑO', 'Tos Crónica'),
+    ('SIBILANCIAS', 'Sibilancias'),
+]
+
+# (emoji, nombre, columna) de la pestaña de síntomas y del reporte por paciente
+SINTOMAS = [
+    ("🚬", "Antecedentes de Tabaquismo", "ANTECEDENTES TABAQUISMO"),
+    ("🏃", "Dificultad Respiratoria con Ejercicio", "DIFICULTAD RESPIRATORIA CON EL EJERCICI0"),
+    ("😮‍💨", "Episodios de Dificultad en Reposo", "EPISODIOS DIFICULTAD RESPIRATORIA EN REPOSO"),
+    ("🤧", "Tos (>3 meses/año)", "TOS MAS DE 3 MESES AL AÑO"),
+    ("💧", "Expectoración", "EXPECTORACIÓN"),
+    ("🌬️", "Sibilancias", "SIBILANCIAS")
+]
+
+
+def es_si(valor):
+    """Indica si un valor de una columna SI/NO es afirmativo"""
+    return isinstance(valor, str) and valor in VALORES_SI
+
+
+def es_no(valor):
+    """Indica si un valor de una columna SI/NO es negativo"""
+    return isinstance(valor, str) and valor in VALORES_NO
+
+
+def categoria_estado(estado):
+    """Clasifica el ESTADO en 'completado', 'proceso' o 'pendiente'"""
+    estado = str(estado)
+    if estado == 'Completado':
+        return 'completado'
+    if 'Proceso' in estado:
+        return 'proceso'
+    return 'pendiente'
+
+
+def contar_si(df, columna):
+    """Cuenta las filas con valor afirmativo en una columna SI/NO"""
+    if columna not in df.columns:
+        return 0
+    return int(df[columna].isin(VALORES_SI).sum())
+
+
+def contar_fechas(df, columna):
+    """Cuenta las filas con fecha registrada en una columna"""
+    if columna not in df.columns:
+        return 0
+    return int(df[columna].notna().sum())
+
+
+def calcular_kpis(df):
+    """KPIs de la cabecera del dashboard"""
+    total = len(df)
+    tomadas = contar_fechas(df, 'FECHA TOMA MUESTRA')
+    fumadores = None
+    if 'ANTECEDENTES TABAQUISMO' in df.columns:
+        fumadores = contar_si(df, 'ANTECEDENTES TABAQUISMO')
+
+    return {
+        'total': total,
+        'tomadas': tomadas,
+        'porcentaje_tomadas': (tomadas / total * 100) if total > 0 else 0,
+        'enviadas': contar_si(df, 'MUESTRA ENVIADA A ESPAÑA'),
+        'completados': contar_si(df, 'RESULTADOS ENVIADOS'),
+        'fumadores': fumadores,
+    }
+
+
+def conteo_valores(df, columna):
+    """value_counts como diccionario {valor: cantidad} ordenado de mayor a menor"""
+    if columna not in df.columns:
+        return None
+    conteo = df[columna].value_counts()
+    return {str(valor): int(cantidad) for valor, cantidad in conteo.items()}
+
+
+def calcular_embudo(df):
+    """Valores del embudo: registrados, tomadas, enviadas, resultados, completados"""
+    return [
+        len(df),
+        contar_fechas(df, 'FECHA TOMA MUESTRA'),
+        contar_si(df, 'MUESTRA ENVIADA A ESPAÑA'),
+        contar_fechas(df, 'FECHA DE RECIBIDO'),
+        contar_si(df, 'RESULTADOS ENVIADOS'),
+    ]
+
+
+def datos_graficos(df):
+    """Agregados que necesitan los gráficos de la sección de análisis"""
+    sintomas = {
+        etiqueta: contar_si(df, columna)
+        for columna, etiqueta in SINTOMAS_GRAFICO
+        if columna in df.columns
+    }
+    return {
+        'ciudad': conteo_valores(df, 'CIUDAD'),
+        'eps': conteo_valores(df, 'EPS'),
+        'tabaquismo': conteo_valores(df, 'ANTECEDENTES TABAQUISMO'),
+        'sintomas': sintomas,
+        'embudo': calcular_embudo(df),
+    }
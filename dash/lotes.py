@@ -0,0 +1,187 @@
+"""
+Generación por lotes de extractos y resúmenes por partición.
+
+Parte el dataset por una o varias columnas de faceta (EPS, CIUDAD, ...) y,
+para cada valor, escribe su extracto (CSV y/o Excel, con todas las
+columnas) y sus KPIs. Las particiones se reparten entre procesos, así que
+el tiempo total baja con el número de núcleos. Todo queda en un directorio
+con la fecha del día:
+
+    salidas/2024-05-06/EPS/SANITAS.csv
+    salidas/2024-05-06/EPS/SANITAS.xlsx
+    salidas/2024-05-06/resumen.csv
+
+Uso:
+    python lotes.py datos/tmz.xlsx --por EPS CIUDAD [--formatos csv xlsx parquet csv.gz]
+                    [--salida salidas] [--procesos N]
+"""
+import argparse
+import getpass
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+import auditoria
+import motor
+
+BASE = Path(__file__).resolve().parent
+
+# Dataset de cada proceso trabajador (se recibe una vez, al iniciar)
+_dataset = None
+
+
+def nombre_archivo(valor):
+    """Nombre de archivo seguro para el valor de una partición"""
+    texto = unicodedata.normalize('NFKD', str(valor).strip())
+    texto = texto.encode('ascii', 'ignore').decode('ascii')
+    texto = re.sub(r'[^A-Za-z0-9]+', '_', texto).strip('_')
+    return texto or 'SIN_VALOR'
+
+
+def particiones(dataset, columnas):
+    """
+    Lista de (columna, valor, nombre de archivo) con al menos un paciente.
+
+    Valores que solo difieren en espacios o tildes ('BOGOTA' y 'BOGOTA ')
+    reciben nombres distintos para no sobrescribirse.
+    """
+    indice = dataset['indice_facetas']
+    resultado = []
+    for columna in columnas:
+        datos = indice['columnas'].get(columna)
+        if datos is None:
+            raise ValueError(f"Columna de partición no disponible: {columna}")
+        usados = set()
+        for valor in datos['valores']:
+            base = nombre = nombre_archivo(valor)
+            sufijo = 2
+            while nombre in usados:
+                nombre = f"{base}_{sufijo}"
+                sufijo += 1
+            usados.add(nombre)
+            resultado.append((columna, valor, nombre))
+    return resultado
+
+
+def _iniciar_trabajador(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def generar_particion(columna, valor, nombre, formatos, directorio):
+    """
+    Escribe los extractos de una partición y retorna su fila de resumen.
+
+    Corre dentro de un proceso trabajador, sobre el dataset recibido al
+    iniciarlo.
+    """
+    mascara = motor.aplicar_filtros(_dataset, {columna: valor})
+    resultado = motor.calcular_resultado(_dataset, mascara)
+
+    destino = Path(directorio) / nombre_archivo(columna)
+    destino.mkdir(parents=True, exist_ok=True)
+    archivos = []
+    for formato in formatos:
+        ruta = destino / f"{nombre}.{formato}"
+        motor.exportar_a(_dataset, ruta, resultado['filas'], formato)
+        archivos.append(str(ruta.relative_to(directorio)))
+
+    kpis = resultado['kpis']
+    return {
+        'columna': columna,
+        'valor': str(valor),
+        'pacientes': kpis['total'],
+        'muestras_tomadas': kpis['tomadas'],
+        'porcentaje_tomadas': round(kpis['porcentaje_tomadas'], 1),
+        'enviadas_espana': kpis['enviadas'],
+        'completados': kpis['completados'],
+        'fumadores': kpis['fumadores'],
+        'archivos': ' '.join(archivos),
+    }
+
+
+def generar_lote(dataset, columnas, formatos=('csv',), salida='salidas', procesos=None, fecha=None):
+    """
+    Genera todas las particiones en un directorio fechado.
+
+    Retorna (directorio, filas de resumen ordenadas por columna y valor).
+    """
+    for formato in formatos:
+        if formato not in motor.FORMATOS:
+            raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+    directorio = Path(salida) / (fecha or date.today()).isoformat()
+    directorio.mkdir(parents=True, exist_ok=True)
+    tareas = particiones(dataset, columnas)
+
+    resumen = []
+    with ProcessPoolExecutor(
+        max_workers=procesos or os.cpu_count(),
+        initializer=_iniciar_trabajador,
+        initargs=(dataset,),
+    ) as ejecutor:
+        futuros = [
+            ejecutor.submit(generar_particion, columna, valor, nombre, tuple(formatos), str(directorio))
+            for columna, valor, nombre in tareas
+        ]
+        for futuro in as_completed(futuros):
+            resumen.append(futuro.result())
+
+    orden = {columna: i for i, columna in enumerate(columnas)}
+    resumen.sort(key=lambda fila: (orden[fila['columna']], fila['valor']))
+
+    pd.DataFrame(resumen).to_csv(directorio / 'resumen.csv', index=False, encoding='utf-8-sig')
+    return directorio, resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('origen', nargs='?', default=str(BASE / 'datos' / 'tmz.xlsx'),
+                        help='Excel de pacientes')
+    parser.add_argument('--por', nargs='+', default=['EPS', 'CIUDAD'],
+                        help='columnas de faceta por las que partir')
+    parser.add_argument('--formatos', nargs='+', default=['csv', 'xlsx'],
+                        choices=sorted(motor.FORMATOS))
+    parser.add_argument('--salida', default=str(BASE / 'salidas'), help='directorio base de salida')
+    parser.add_argument('--procesos', type=int, default=None,
+                        help='procesos en paralelo (por defecto, uno por núcleo)')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    dataset = motor.cargar_dataset(args.origen)
+    t_carga = time.perf_counter() - t0
+
+    try:
+        directorio, resumen = generar_lote(
+            dataset, args.por, args.formatos, args.salida, args.procesos
+        )
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    auditoria.registrar(
+        'exportar', usuario=getpass.getuser(), sesion='lotes', contenido='lote',
+        formato=','.join(args.formatos), por=args.por, particiones=len(resumen),
+        directorio=str(directorio), version=dataset['version'],
+    )
+
+    total = time.perf_counter() - t0
+    print(f"{'Partición':<40}{'Pacientes':>10}{'Tomadas':>9}{'Completados':>13}")
+    for fila in resumen:
+        print(
+            f"{fila['columna'] + ' = ' + fila['valor']:<40}"
+            f"{fila['pacientes']:>10}{fila['muestras_tomadas']:>9}{fila['completados']:>13}"
+        )
+    print(
+        f"\n✅ {len(resumen)} particiones en {directorio} "
+        f"(carga {t_carga:.1f}s, total {total:.1f}s, {args.procesos or os.cpu_count()} procesos)"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+Almacén maestro de pacientes, persistente y con upserts por CEDULA.
+
+Cada carga de Excel se fusiona con el maestro: las filas se identifican
+por su CEDULA normalizada (índice hash clave -> posición) y por una huella
+de su contenido. Solo las filas nuevas o modificadas se escriben, como un
+segmento Parquet adicional (delta). Las filas modificadas conservan su
+posición y las nuevas se agregan al final, de modo que los índices que
+dependen de la posición se pueden actualizar en vez de reconstruirse.
+
+Estructura en disco (directorio configurable con TMZ_DATOS):
+
+    maestro/manifiesto.json     columnas, segmentos, versión y cargas
+    maestro/00000.parquet       segmento base
+    maestro/00001.parquet ...   deltas (solo filas nuevas o cambiadas)
+    maestro/instantaneas/       cada carga tal como llegó (ver cambios.py)
+
+pandas y pyarrow se importan al usarse: el dashboard consulta existe()
+desde la pantalla de bienvenida.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+RUTA_MAESTRO = Path(os.environ.get('TMZ_DATOS', BASE / 'datos')) / 'maestro'
+
+# Con más segmentos que estos, el maestro se reescribe en uno solo
+MAX_SEGMENTOS = 20
+
+# Historial de cargas que se conserva en el manifiesto
+MAX_CARGAS = 50
+
+# Instantáneas de cargas que se conservan en disco
+MAX_INSTANTANEAS = 10
+
+# Columnas internas guardadas en cada segmento
+CLAVE = '_clave'
+HUELLA = '_huella'
+
+_lock = threading.Lock()
+
+
+def _ruta(ruta):
+    return Path(ruta) if ruta is not None else RUTA_MAESTRO
+
+
+def existe(ruta=None):
+    """Indica si hay un maestro guardado"""
+    return (_ruta(ruta) / 'manifiesto.json').exists()
+
+
+def version_en_disco(ruta=None):
+    """Versión guardada en el manifiesto (sin cargar los datos), o None"""
+    ruta = _ruta(ruta)
+    if not existe(ruta):
+        return None
+    with open(ruta / 'manifiesto.json', encoding='utf-8') as f:
+        return json.load(f).get('version')
+
+
+def _escribir_manifiesto(ruta, manifiesto):
+    """Escritura atómica del manifiesto: el maestro nunca queda a medias"""
+    temporal = ruta / f'manifiesto.json.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(temporal, ruta / 'manifiesto.json')
+
+
+# ------------------------------------------
+# Huellas de filas
+# ------------------------------------------
+
+def normalizar(df):
+    """
+    Deja el DataFrame en tipos que Parquet puede guardar y que no cambian
+    entre cargas: las columnas de texto con tipos mezclados pasan a texto.
+    """
+    import pandas as pd
+
+    df = df.copy()
+    for i, columna in enumerate(df.columns):
+        serie = df.iloc[:, i]
+        if serie.dtype == object and pd.api.types.infer_dtype(serie, skipna=True) not in ('string', 'empty'):
+            df[columna] = serie.where(serie.isna(), serie.astype(str))
+    return df
+
+
+def texto_canonico(serie):
+    """Texto canónico de una columna, igual aunque cambie su dtype"""
+    import pandas as pd
+
+    vacios = serie.isna()
+    if pd.api.types.is_bool_dtype(serie):
+        texto = serie.astype(str)
+    elif pd.api.types.is_numeric_dtype(serie):
+        # 123 y 123.0 son el mismo valor (Excel pasa a float las columnas con vacíos)
+        texto = serie.astype('float64').astype(str)
+    elif pd.api.types.is_datetime64_any_dtype(serie):
+        texto = serie.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        texto = serie.astype(str)
+    return texto.where(~vacios, '')
+
+
+def huellas(df, columnas):
+    """Huella uint64 del contenido de cada fila en las columnas dadas"""
+    import pandas as pd
+
+    canonico = pd.DataFrame({
+        i: texto_canonico(df[c]) if c in df.columns else '' for i, c in enumerate(columnas)
+    }, index=df.index)
+    return pd.util.hash_pandas_object(canonico, index=False).to_numpy()
+
+
+# ------------------------------------------
+# Apertura
+# ------------------------------------------
+
+def abrir(ruta=None):
+    """
+    Carga el maestro en memoria.
+
+    Retorna el almacén: {'ruta', 'manifiesto', 'df', 'huellas', 'indice',
+    'version'}, con df vacío (None) si aún no hay maestro. Las filas quedan
+    en el orden de primera aparición de cada CEDULA, con los valores de su
+    última versión, igual que en memoria tras cada fusión.
+    """
+    import numpy as np
+    import pandas as pd
+
+    ruta = _ruta(ruta)
+    almacen = {
+        'ruta': ruta, 'manifiesto': None, 'df': None,
+        'huellas': np.empty(0, dtype=np.uint64), 'indice': {}, 'version': None,
+    }
+    if not existe(ruta):
+        return almacen
+
+    with open(ruta / 'manifiesto.json', encoding='utf-8') as f:
+        manifiesto = json.load(f)
+    segmentos = [pd.read_parquet(ruta / nombre) for nombre in manifiesto['segmentos']]
+    todo = pd.concat(segmentos, ignore_index=True) if segmentos else pd.DataFrame()
+
+    if len(todo):
+        orden = todo[CLAVE].drop_duplicates(keep='first')
+        ultimas = todo.drop_duplicates(CLAVE, keep='last').set_index(CLAVE)
+        todo = ultimas.loc[orden.to_numpy()].reset_index()
+        almacen['huellas'] = todo[HUELLA].to_numpy(dtype=np.uint64)
+        almacen['indice'] = dict(zip(todo[CLAVE].tolist(), range(len(todo))))
+        almacen['df'] = todo[[c for c in manifiesto['columnas'] if c in todo.columns]]
+
+    almacen['manifiesto'] = manifiesto
+    almacen['version'] = manifiesto.get('version')
+    return almacen
+
+
+# ------------------------------------------
+# Fusión (upsert)
+# ------------------------------------------
+
+def _siguiente_version(version, segmento, huellas_escritas):
+    huella = hashlib.sha1(f"{version or ''}|{segmento}|".encode('utf-8'))
+    huella.update(huellas_escritas.tobytes())
+    return huella.hexdigest()[:16]
+
+
+def _escribir_segmento(ruta, nombre, df, claves, huellas_filas):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    segmento = df.copy()
+    segmento[CLAVE] = claves
+    segmento[HUELLA] = huellas_filas
+    tabla = pa.Table.from_pandas(segmento, preserve_index=False)
+    pq.write_table(tabla, ruta / nombre, compression='zstd')
+
+
+def _guardar_instantanea(ruta, manifiesto, df, claves, huellas_filas, origen, parcial=False):
+    """
+    Guarda la carga completa (normalizada, con clave y huella por fila)
+    como instantánea versionada. Si la carga es idéntica a la última
+    instantánea no escribe nada. Retorna True si se agregó una.
+
+    parcial marca una carga que no trae todas las columnas del maestro:
+    suele ser un subconjunto de pacientes, así que cambios.py no informa
+    como eliminados a los que no trae.
+    """
+    huella = hashlib.sha1("|".join(map(str, df.columns)).encode('utf-8'))
+    huella.update("|".join(claves).encode('utf-8'))
+    huella.update(huellas_filas.tobytes())
+    version = huella.hexdigest()[:16]
+
+    instantaneas = manifiesto.setdefault('instantaneas', [])
+    if instantaneas and instantaneas[-1]['version'] == version:
+        return False
+
+    directorio = ruta / 'instantaneas'
+    directorio.mkdir(parents=True, exist_ok=True)
+    _escribir_segmento(directorio, f'{version}.parquet', df, claves, huellas_filas)
+    instantaneas.append({
+        'version': version,
+        'archivo': f'instantaneas/{version}.parquet',
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'origen': str(origen),
+        'filas': len(df),
+        'columnas': [str(c) for c in df.columns],
+        'parcial': parcial,
+    })
+    for antigua in instantaneas[:-MAX_INSTANTANEAS]:
+        (ruta / antigua['archivo']).unlink(missing_ok=True)
+    manifiesto['instantaneas'] = instantaneas[-MAX_INSTANTANEAS:]
+    return True
+
+
+def instantaneas(almacen):
+    """Instantáneas guardadas, de la más antigua a la más reciente"""
+    return list((almacen['manifiesto'] or {}).get('instantaneas', []))
+
+
+def fusionar(almacen, df_nuevo, origen=''):
+    """
+    Fusiona una carga en el maestro (upsert por CEDULA).
+
+    Las filas sin CEDULA se descartan y, si una CEDULA se repite en la
+    carga, prevalece la última fila. Una fila que cambia se reemplaza en
+    las columnas que trae la carga; las columnas del maestro que la carga
+    no tiene conservan sus valores. Actualiza el almacén en memoria y en disco, y retorna el
+    resumen con las posiciones tocadas:
+
+        {'nuevos', 'cambiados', 'sin_cambios', 'sin_cedula', 'duplicados',
+         'posiciones_cambiadas', 'posiciones_nuevas', 'segmento', 'version'}
+
+    La carga se guarda además como instantánea (ver cambios.py).
+    """
+    import numpy as np
+    import pandas as pd
+
+    from carga import claves_cedula
+
+    with _lock:
+        ruta = almacen['ruta']
+        df_actual = almacen['df']
+        n_actual = 0 if df_actual is None else len(df_actual)
+
+        # Claves de la carga
+        if 'CEDULA' not in df_nuevo.columns:
+            raise ValueError("La carga no tiene columna CEDULA")
+        claves = claves_cedula(df_nuevo['CEDULA'])
+        con_cedula = df_nuevo['CEDULA'].notna().to_numpy() & (claves != '').to_numpy()
+        sin_cedula = int((~con_cedula).sum())
+        df_nuevo, claves = df_nuevo[con_cedula], claves[con_cedula]
+        repetidas = claves.duplicated(keep='last').to_numpy()
+        duplicados = int(repetidas.sum())
+        df_nuevo, claves = df_nuevo[~repetidas], claves[~repetidas]
+
+        # Columnas del maestro y, al final, las que trae la carga por primera vez
+        columnas = list(df_actual.columns) if df_actual is not None else []
+        faltantes = [c for c in columnas if c not in df_nuevo.columns]
+        columnas += [c for c in df_nuevo.columns if c not in columnas]
+        df_nuevo = df_nuevo.reindex(columns=columnas).reset_index(drop=True)
+        claves = claves.reset_index(drop=True)
+
+        # Índice hash: posición en el maestro (-1 si la CEDULA es nueva)
+        posiciones = np.fromiter(
+            (almacen['indice'].get(c, -1) for c in claves), dtype=np.intp, count=len(claves)
+        )
+        existentes = posiciones >= 0
+
+        # Carga parcial: las filas que ya están en el maestro conservan los
+        # valores de las columnas que la carga no trae (las nuevas quedan vacías)
+        if faltantes and existentes.any():
+            tomar = np.where(existentes, posiciones, posiciones[existentes][0])
+            for columna in faltantes:
+                previos = df_actual[columna].iloc[tomar].reset_index(drop=True)
+                df_nuevo[columna] = previos.where(existentes)
+        df_nuevo = normalizar(df_nuevo)
+        huellas_nuevas = huellas(df_nuevo, columnas)
+        cambiadas = existentes.copy()
+        cambiadas[existentes] = almacen['huellas'][posiciones[existentes]] != huellas_nuevas[existentes]
+        nuevas = ~existentes
+        escribir = cambiadas | nuevas
+
+        resumen = {
+            'nuevos': int(nuevas.sum()),
+            'cambiados': int(cambiadas.sum()),
+            'sin_cambios': int(existentes.sum() - cambiadas.sum()),
+            'sin_cedula': sin_cedula,
+            'duplicados': duplicados,
+            'posiciones_cambiadas': posiciones[cambiadas],
+            'posiciones_nuevas': np.arange(n_actual, n_actual + int(nuevas.sum()), dtype=np.intp),
+            'segmento': None,
+            'version': almacen['version'],
+        }
+        ruta.mkdir(parents=True, exist_ok=True)
+        manifiesto = almacen['manifiesto'] or {'columnas': columnas, 'segmentos': [], 'cargas': []}
+        nueva_instantanea = _guardar_instantanea(
+            ruta, manifiesto, df_nuevo, claves.tolist(), huellas_nuevas, origen,
+            parcial=bool(faltantes),
+        )
+        if not escribir.any():
+            if nueva_instantanea:
+                almacen['manifiesto'] = manifiesto
+                _escribir_manifiesto(ruta, manifiesto)
+            return resumen
+
+        # Delta en disco: solo filas nuevas o cambiadas
+        numero = max((int(Path(s).stem) for s in manifiesto['segmentos']), default=-1) + 1
+        nombre = f'{numero:05d}.parquet'
+        delta = df_nuevo[escribir]
+        _escribir_segmento(ruta, nombre, delta, claves[escribir].to_numpy(), huellas_nuevas[escribir])
+        version = _siguiente_version(almacen['version'], nombre, huellas_nuevas[escribir])
+
+        # Maestro en memoria: las cambiadas en su posición, las nuevas al final
+        if df_actual is None:
+            df = delta.reset_index(drop=True)
+            huellas_maestro = huellas_nuevas[escribir]
+        else:
+            combinado = pd.concat([df_actual.reindex(columns=columnas), delta], ignore_index=True)
+            filas_delta = n_actual + np.arange(len(delta))
+            tomar = np.arange(n_actual)
+            tomar[posiciones[cambiadas]] = filas_delta[cambiadas[escribir]]
+            tomar = np.concatenate([tomar, filas_delta[nuevas[escribir]]])
+            df = combinado.iloc[tomar].reset_index(drop=True)
+            huellas_maestro = almacen['huellas'].copy()
+            huellas_maestro[posiciones[cambiadas]] = huellas_nuevas[cambiadas]
+            huellas_maestro = np.concatenate([huellas_maestro, huellas_nuevas[nuevas]])
+
+        indice = almacen['indice']
+        for clave, posicion in zip(claves[nuevas].tolist(), resumen['posiciones_nuevas'].tolist()):
+            indice[clave] = posicion
+
+        manifiesto['columnas'] = columnas
+        manifiesto['segmentos'] = manifiesto['segmentos'] + [nombre]
+        manifiesto['version'] = version
+        manifiesto['cargas'] = (manifiesto['cargas'] + [{
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'origen': str(origen),
+            'segmento': nombre,
+            **{k: resumen[k] for k in ('nuevos', 'cambiados', 'sin_cambios', 'sin_cedula', 'duplicados')},
+        }])[-MAX_CARGAS:]
+
+        almacen.update(df=df, huellas=huellas_maestro, version=version, manifiesto=manifiesto)
+        if len(manifiesto['segmentos']) > MAX_SEGMENTOS:
+            _compactar(almacen)
+        _escribir_manifiesto(ruta, almacen['manifiesto'])
+
+        resumen.update(segmento=nombre, version=version)
+        return resumen
+
+
+def _compactar(almacen):
+    """Reescribe el maestro en un único segmento (mismo orden y versión)"""
+    ruta, manifiesto = almacen['ruta'], almacen['manifiesto']
+    claves = [None] * len(almacen['indice'])
+    for clave, posicion in almacen['indice'].items():
+        claves[posicion] = clave
+
+    numero = max(int(Path(s).stem) for s in manifiesto['segmentos']) + 1
+    nombre = f'{numero:05d}.parquet'
+    _escribir_segmento(ruta, nombre, almacen['df'], claves, almacen['huellas'])
+
+    anteriores = manifiesto['segmentos']
+    manifiesto['segmentos'] = [nombre]
+    _escribir_manifiesto(ruta, manifiesto)
+    for anterior in anteriores:
+        (ruta / anterior).unlink(missing_ok=True)
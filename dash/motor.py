@@ -0,0 +1,282 @@
+"""
+Motor de datos del dashboard de tamizaje, sin dependencia de Streamlit.
+
+Es la API que usan ambos dashboards y que pueden reutilizar trabajos por
+lotes, benchmarks o perfiles:
+
+    dataset = cargar_dataset('datos/tmz.xlsx')
+    mascara = aplicar_filtros(dataset, {'EPS': 'SANITAS'}, busqueda='perez')
+    resultado = calcular_resultado(dataset, mascara)   # filas, kpis, graficos
+    contenido = exportar(dataset, resultado['filas'], formato='csv')
+
+Un dataset es un diccionario con la proyección caliente ('df'), las
+columnas frías ('df_frio'), su versión y los índices de cédula y facetas.
+"""
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+import carga
+import exportar as _exportar
+import facetas
+import maestro
+import tendencias
+import validacion
+from carga import clave_cedula  # noqa: F401  (API pública del motor)
+from indicadores import (  # noqa: F401  (API pública del motor)
+    VALORES_NO,
+    VALORES_SI,
+    calcular_embudo,
+    calcular_kpis,
+    categoria_estado,
+    datos_graficos,
+    es_no,
+    es_si,
+)
+
+# Una fusión a la vez: cada una actualiza el dataset que dejó la anterior
+_lock_maestro = threading.Lock()
+
+MIME = _exportar.MIME
+ETIQUETAS = _exportar.ETIQUETAS
+FORMATOS = tuple(_exportar.FORMATOS)
+
+
+# ------------------------------------------
+# Carga
+# ------------------------------------------
+
+def preparar_dataset(df, version=None, texto=None):
+    """
+    Construye el dataset (proyección, almacén frío e índices) desde un
+    DataFrame. texto elige cómo se guardan las columnas de texto ('object'
+    o 'arrow'; por defecto, carga.MODO_TEXTO). La versión no depende de él.
+    """
+    if version is None:
+        version = carga.version_datos(df)
+    df_caliente, df_frio = carga.dividir_columnas(carga.almacenar_texto(df, texto))
+    return {
+        'df': df_caliente,
+        'df_frio': df_frio,
+        'version': version,
+        'indice_cedula': carga.construir_indice_cedula(df_caliente),
+        'indice_facetas': facetas.construir_indice(df_caliente, version=version),
+        'indice_tendencias': tendencias.construir_indice(df_caliente, version=version),
+    }
+
+
+def cargar_dataset(origen):
+    """Lee un Excel de pacientes (ruta o archivo) y prepara el dataset"""
+    return preparar_dataset(pd.read_excel(origen))
+
+
+def actualizar_dataset(dataset, df, posiciones, version):
+    """
+    Dataset nuevo tras modificar o agregar filas en 'posiciones' (las
+    agregadas, al final de df). Los índices de cédula, facetas y
+    tendencias se actualizan solo en esas filas; el dataset anterior no se
+    modifica.
+    """
+    if dataset is None:
+        return preparar_dataset(df, version=version)
+    df_caliente, df_frio = carga.dividir_columnas(carga.almacenar_texto(df))
+
+    indice_cedula = dict(dataset['indice_cedula'])
+    if 'CEDULA' in df_caliente.columns:
+        claves = carga.claves_cedula(df_caliente['CEDULA'].iloc[posiciones])
+        for clave, posicion in zip(claves.tolist(), np.asarray(posiciones).tolist()):
+            indice_cedula.setdefault(clave, posicion)
+
+    return {
+        'df': df_caliente,
+        'df_frio': df_frio,
+        'version': version,
+        'indice_cedula': indice_cedula,
+        'indice_facetas': facetas.actualizar_indice(
+            dataset['indice_facetas'], df_caliente, posiciones, version=version
+        ),
+        'indice_tendencias': tendencias.actualizar_indice(
+            dataset['indice_tendencias'], df_caliente, posiciones, version=version
+        ),
+    }
+
+
+# ------------------------------------------
+# Almacén maestro
+# ------------------------------------------
+
+def abrir_maestro(ruta=None):
+    """Abre el almacén maestro con su dataset preparado (None si está vacío)"""
+    almacen = maestro.abrir(ruta)
+    almacen['dataset'] = None
+    if almacen['df'] is not None:
+        almacen['dataset'] = preparar_dataset(almacen['df'], version=almacen['version'])
+    return almacen
+
+
+def fusionar_carga(almacen, origen, nombre=''):
+    """
+    Fusiona en el maestro por CEDULA un Excel (ruta o archivo) o un
+    DataFrame ya leído.
+
+    Solo se releen en los índices las filas nuevas o cambiadas. Retorna el
+    resumen de la fusión (nuevos, cambiados, sin_cambios, ...).
+    """
+    df_nuevo = origen if isinstance(origen, pd.DataFrame) else pd.read_excel(origen)
+    with _lock_maestro:
+        resumen = maestro.fusionar(almacen, df_nuevo, origen=nombre)
+        if resumen['segmento'] is not None:
+            posiciones = np.concatenate([resumen['posiciones_cambiadas'], resumen['posiciones_nuevas']])
+            almacen['dataset'] = actualizar_dataset(
+                almacen['dataset'], almacen['df'], posiciones, almacen['version']
+            )
+    return resumen
+
+
+# ------------------------------------------
+# Validación
+# ------------------------------------------
+
+def validar(df, version=None):
+    """Reporte de calidad de un DataFrame recién leído (ver validacion.py)"""
+    if version is None:
+        version = carga.version_datos(df)
+    return validacion.validar(df, version=version)
+
+
+def validar_dataset(dataset):
+    """Reporte de calidad del dataset, calculado una vez por versión"""
+    reporte = validacion.reporte_en_cache(dataset['version'])
+    if reporte is None:
+        reporte = validacion.validar(filas_completas(dataset), version=dataset['version'])
+    return reporte
+
+
+def reporte_validacion(df, reporte, formato='csv'):
+    """Reporte de filas con problemas, exportado en uno de los FORMATOS"""
+    return _exportar.contenido(validacion.filas_reporte(df, reporte), formato)
+
+
+# ------------------------------------------
+# Filtros
+# ------------------------------------------
+
+def mascara_busqueda(df, texto):
+    """Máscara de pacientes cuyo NOMBRE o CEDULA contienen el texto"""
+    cedulas = df['CEDULA']
+    if not isinstance(cedulas.dtype, pd.StringDtype):
+        cedulas = cedulas.astype(str)
+    return (
+        df['NOMBRE'].str.contains(texto, case=False, na=False, regex=False) |
+        cedulas.str.contains(texto, case=False, na=False, regex=False)
+    ).to_numpy(dtype=bool)
+
+
+def mascara_filas(dataset, filas):
+    """Máscara a partir de una lista de etiquetas del índice (p. ej. una cola SLA)"""
+    return dataset['df'].index.isin(filas)
+
+
+def mascara_base(dataset, busqueda="", filas=None):
+    """Combina búsqueda y restricción de filas; None si no hay ninguna"""
+    base = None
+    if busqueda:
+        base = mascara_busqueda(dataset['df'], busqueda)
+    if filas is not None:
+        restriccion = mascara_filas(dataset, filas)
+        base = restriccion if base is None else base & restriccion
+    return base
+
+
+def aplicar_filtros(dataset, filtros, busqueda="", filas=None):
+    """
+    Máscara booleana de los pacientes que cumplen la especificación:
+    filtros de faceta {columna: valor o lista}, texto de búsqueda y,
+    opcionalmente, una lista de etiquetas de fila a las que restringir.
+    """
+    base = mascara_base(dataset, busqueda, filas)
+    return facetas.mascara(dataset['indice_facetas'], filtros, base=base)
+
+
+def conteos_facetas(dataset, filtros, busqueda="", filas=None, clave_base=None):
+    """Conteo por opción de cada faceta dados los demás filtros activos"""
+    base = mascara_base(dataset, busqueda, filas)
+    return facetas.conteos(dataset['indice_facetas'], filtros, base=base, clave_base=clave_base)
+
+
+def sugerencias(dataset, columna, texto, limite=facetas.MAX_SUGERENCIAS):
+    """Valores de una faceta de muchos valores que coinciden con lo escrito"""
+    return facetas.sugerencias(dataset['indice_facetas'], columna, texto, limite)
+
+
+def seleccion(dataset, mascara_o_filas):
+    """Filas calientes seleccionadas por máscara booleana o posiciones"""
+    if mascara_o_filas is None:
+        return dataset['df']
+    if isinstance(mascara_o_filas, np.ndarray) and mascara_o_filas.dtype == bool:
+        return dataset['df'][mascara_o_filas]
+    return dataset['df'].iloc[np.asarray(mascara_o_filas, dtype=np.intp)]
+
+
+def huella_filas(filas):
+    """Huella corta de una selección de filas, para usarla como clave"""
+    return hashlib.sha1(np.asarray(filas, dtype=np.int64).tobytes()).hexdigest()[:16]
+
+
+# ------------------------------------------
+# Agregados
+# ------------------------------------------
+
+def calcular_resultado(dataset, mascara):
+    """Posiciones de filas, KPIs y agregados de gráficos de una selección"""
+    elegidos = seleccion(dataset, mascara)
+    return {
+        'filas': np.flatnonzero(mascara).tolist(),
+        'kpis': calcular_kpis(elegidos),
+        'graficos': datos_graficos(elegidos),
+    }
+
+
+def calcular_tendencias(dataset, frecuencia='semana', mascara_o_filas=None, por=None):
+    """Series por semana o mes de cada fase del proceso (ver tendencias.series)"""
+    return tendencias.series(
+        dataset['indice_tendencias'], frecuencia, mascara_o_filas,
+        por=por, indice_facetas=dataset['indice_facetas'],
+    )
+
+
+# ------------------------------------------
+# Pacientes
+# ------------------------------------------
+
+def obtener_paciente(dataset, cedula, fila=None):
+    """Registro completo de un paciente por CEDULA (y etiqueta de fila si se repite), o None"""
+    return carga.obtener_paciente(
+        dataset['df'], dataset['df_frio'], dataset['indice_cedula'], cedula, fila
+    )
+
+
+# ------------------------------------------
+# Exportación
+# ------------------------------------------
+
+def filas_completas(dataset, mascara_o_filas=None):
+    """Filas seleccionadas con todas sus columnas, en el orden original"""
+    return carga.hidratar(seleccion(dataset, mascara_o_filas), dataset['df_frio'])
+
+
+def exportar(dataset, mascara_o_filas=None, formato='csv'):
+    """Contenido (bytes) de la selección en uno de los FORMATOS"""
+    return _exportar.contenido(filas_completas(dataset, mascara_o_filas), formato)
+
+
+def exportar_a(dataset, destino, mascara_o_filas=None, formato='csv'):
+    """Escribe la selección directamente en una ruta o archivo binario"""
+    _exportar.escribir(filas_completas(dataset, mascara_o_filas), destino, formato)
+
+
+def exportar_temporal(dataset, mascara_o_filas=None, formato='csv'):
+    """Selección exportada a un archivo temporal (en disco si es grande)"""
+    return _exportar.temporal(filas_completas(dataset, mascara_o_filas), formato)
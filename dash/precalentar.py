@@ -0,0 +1,204 @@
+"""
+Precalentamiento: deja listo todo lo que hoy paga el primer usuario tras
+un despliegue o reinicio.
+
+Importa las dependencias pesadas; carga el dataset vigente (backend de
+dashboard_minimal.py y almacén maestro de dashboard.py) con su proyección
+tipada e índices; calcula los conteos de facetas, KPIs, gráficos y
+tendencias de la vista inicial, las colas SLA, los resultados de las
+cohortes guardadas y el reporte de calidad; y construye y serializa las
+primeras figuras de Plotly. Reporta cuánto tardó cada paso.
+
+Las cachés en memoria son del proceso del servidor, así que para que el
+primer usuario las encuentre calientes el servidor se arranca desde aquí:
+
+    python precalentar.py --servir dashboard_minimal.py [--cada 240] [-- --server.port 8501]
+
+precalienta y después arranca Streamlit en el mismo proceso; con --cada
+repite el precalentamiento en segundo plano (refrescando los datos del
+backend antes de que venzan). Sin --servir solo quedan calientes las
+cachés en disco (resultados de cohortes) y sirve para medir los pasos:
+
+    python precalentar.py [--cada SEGUNDOS]
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+
+# Dependencias que los dashboards importan en el primer render
+MODULOS = [
+    'pandas',
+    'pyarrow',
+    'openpyxl',
+    'plotly.express',
+    'plotly.graph_objects',
+    'plotly.io',
+]
+
+_log = logging.getLogger(__name__)
+
+
+class _Pasos:
+    """Mide los pasos del precalentamiento (nombre -> segundos)"""
+
+    def __init__(self):
+        self.tiempos = {}
+
+    def medir(self, nombre, funcion, *args):
+        t0 = time.perf_counter()
+        try:
+            return funcion(*args)
+        finally:
+            self.tiempos[nombre] = time.perf_counter() - t0
+
+
+def importar_modulos():
+    import importlib
+
+    for modulo in MODULOS:
+        importlib.import_module(modulo)
+
+
+def vista_inicial(dataset):
+    """
+    Lo que calcula cada dashboard sin filtros, búsqueda ni cola SLA, en las
+    mismas cachés que leen los dashboards (conteos de facetas del motor;
+    resultado y tendencias en servidor.py)
+    """
+    import motor
+    import servidor
+
+    version = dataset['version']
+    motor.conteos_facetas(dataset, {}, "", filas=None, clave_base=("", None))
+    resultado = servidor.resultado_sin_filtros(version, dataset)
+    for frecuencia in ('semana', 'mes'):
+        servidor.tendencias_sin_filtros(version, dataset, frecuencia)
+    return resultado
+
+
+def alertas_sla(dataset):
+    import alertas
+
+    alertas.programar_evaluacion(dataset['df'], dataset['version']).result()
+
+
+def cohortes_guardadas(dataset):
+    """Resultados en disco de las cohortes guardadas para esta versión"""
+    import cohortes
+    import motor
+
+    for spec in cohortes.listar().values():
+        cohortes.resultado_cohorte(
+            dataset['version'], spec,
+            lambda: motor.calcular_resultado(
+                dataset, motor.aplicar_filtros(dataset, spec['filtros'], spec['busqueda'])
+            ),
+        )
+
+
+def figuras(graficos):
+    """Primeras figuras (barras, torta, embudo) serializadas como las envía Streamlit"""
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    conteo = pd.Series(graficos['ciudad'] or {'': 0})
+    figuras = [
+        px.bar(x=conteo.values, y=conteo.index, orientation='h', color=conteo.values),
+        px.pie(values=conteo.values, names=conteo.index, hole=0.4),
+        go.Figure(go.Funnel(y=list(range(len(graficos['embudo']))), x=graficos['embudo'])),
+    ]
+    for figura in figuras:
+        pio.to_json(figura, validate=False)
+
+
+def precalentar(refrescar=False):
+    """
+    Ejecuta todos los pasos en este proceso y retorna {paso: segundos}.
+    refrescar=True vuelve a leer el backend aunque sus datos no hayan vencido.
+    """
+    t_inicio = time.perf_counter()
+    pasos = _Pasos()
+    pasos.medir('Importar módulos', importar_modulos)
+
+    # Después de medir la importación: servidor trae pandas con el motor
+    import servidor
+
+    datasets = {}
+    try:
+        backend = pasos.medir(
+            'Datos del backend', servidor.refrescar_backend if refrescar else servidor.datos_backend
+        )
+    except Exception:
+        # Sin backend se precalienta igual el maestro
+        _log.exception("No se pudieron cargar los datos del backend")
+        backend = None
+    if backend is not None:
+        datasets['backend'] = backend
+    almacen = pasos.medir('Almacén maestro', servidor.maestro)
+    if almacen['dataset'] is not None:
+        datasets['maestro'] = almacen['dataset']
+
+    resultado = None
+    for origen, dataset in datasets.items():
+        resultado = pasos.medir(f'Vista inicial ({origen})', vista_inicial, dataset)
+        pasos.medir(f'Alertas SLA ({origen})', alertas_sla, dataset)
+        pasos.medir(f'Cohortes guardadas ({origen})', cohortes_guardadas, dataset)
+        pasos.medir(f'Calidad de datos ({origen})', servidor.calidad_datos, dataset['version'], dataset)
+
+    if resultado is not None:
+        pasos.medir('Figuras de Plotly', figuras, resultado['graficos'])
+    pasos.tiempos['Total'] = time.perf_counter() - t_inicio
+    if not datasets:
+        _log.warning("No hay datos que precalentar: ni backend ni maestro con pacientes")
+    return pasos.tiempos
+
+
+def reportar(tiempos):
+    """Tabla de tiempos por paso"""
+    return '\n'.join(f"{paso:<40}{segundos * 1000:>10.0f} ms" for paso, segundos in tiempos.items())
+
+
+def _repetir(cada):
+    """Precalienta cada 'cada' segundos (hilo del servidor o primer plano)"""
+    while True:
+        time.sleep(cada)
+        try:
+            _log.info("Precalentamiento programado:\n%s", reportar(precalentar(refrescar=True)))
+        except Exception:
+            # Un fallo (p. ej. el backend caído) no detiene las siguientes rondas
+            _log.exception("Falló el precalentamiento programado")
+
+
+def servir(script, cada=None, opciones=()):
+    """Arranca Streamlit en este proceso, con las cachés ya calientes"""
+    from streamlit.web import cli
+
+    if cada:
+        threading.Thread(target=_repetir, args=(cada,), name='precalentar', daemon=True).start()
+    sys.argv = ['streamlit', 'run', str(script), *opciones]
+    sys.exit(cli.main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servir', metavar='SCRIPT',
+                        help='arrancar este dashboard en el mismo proceso tras precalentar')
+    parser.add_argument('--cada', type=float, default=None, metavar='SEGUNDOS',
+                        help='repetir el precalentamiento (por debajo de servidor.TTL_BACKEND)')
+    parser.add_argument('opciones', nargs='*', help='opciones para streamlit run (tras --)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    print(f"🔥 Precalentamiento\n{reportar(precalentar())}", flush=True)
+    if args.servir:
+        servir(args.servir, args.cada, args.opciones)
+    elif args.cada:
+        _repetir(args.cada)
+
+
+if __name__ == '__main__':
+    main()
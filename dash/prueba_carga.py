@@ -0,0 +1,357 @@
+"""
+Prueba de carga de los dashboards con sesiones concurrentes.
+
+Simula N coordinadores trabajando a la vez sobre el mismo proceso (como
+un servidor de Streamlit): cada sesión es un AppTest en su propio hilo que
+sube el Excel y luego repite ciclos de filtrar, buscar, abrir un paciente
+y exportar. Se mide cada rerun y se reporta, por escenario:
+  - latencia de rerun p50/p95/p99 (global y por paso);
+  - reruns por segundo del proceso;
+  - memoria residente del proceso (base, pico y MB por sesión).
+
+Los datos son sintéticos, con las columnas del Excel real y el tamaño que
+se pida. Cada escenario corre en un proceso nuevo con un directorio de
+datos vacío, así que el almacén maestro y las cachés no pasan de uno a
+otro.
+
+Uso:
+    python prueba_carga.py [--filas 5000] [--sesiones 1 5 10] [--ciclos 3]
+                           [--pausa 0] [--scripts dashboard.py dashboard_minimal.py]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+BASE = Path(__file__).resolve().parent
+RUTA_DATOS = BASE / 'datos' / 'tmz.xlsx'
+
+# Valores extra para que las facetas de los datos sintéticos tengan
+# variedad (el Excel de ejemplo trae una o dos opciones por columna)
+CIUDADES = ['BOGOTA', 'MEDELLIN', 'CALI', 'BARRANQUILLA', 'BUCARAMANGA', 'PEREIRA', 'CARTAGENA']
+EPS = ['SANITAS', 'FAMISANAR', 'SURA', 'NUEVA EPS', 'COMPENSAR', 'SALUD TOTAL']
+
+# Prefijo de la clave de los botones de paciente en cada dashboard
+BOTON_PACIENTE = {
+    'dashboard.py': 'patient_',
+    'dashboard_minimal.py': 'btn_',
+}
+
+# Clave en session_state con el Excel que "sube" cada sesión
+CLAVE_ARCHIVO = '_prueba_carga_archivo'
+
+PERCENTILES = (50, 95, 99)
+
+
+# ------------------------------------------
+# Datos sintéticos
+# ------------------------------------------
+
+def datos_sinteticos(filas, semilla=0):
+    """
+    DataFrame con las columnas del Excel real: cada columna se muestrea de
+    sus valores reales, con CEDULA única, nombres combinados, fechas
+    desplazadas y más ciudades y EPS.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(semilla)
+    plantilla = pd.read_excel(RUTA_DATOS)
+    columnas = {}
+    for i, columna in enumerate(plantilla.columns):
+        valores = plantilla.iloc[:, i].to_numpy()
+        columnas[columna] = valores[rng.integers(0, len(valores), filas)]
+    df = pd.DataFrame(columnas)
+
+    df['CEDULA'] = 10_000_000 + rng.permutation(filas * 10)[:filas]
+    palabras = ' '.join(plantilla['NOMBRE'].dropna().astype(str)).split()
+    df['NOMBRE'] = [' '.join(rng.choice(palabras, 4)) for _ in range(filas)]
+    if 'CIUDAD' in df.columns:
+        df['CIUDAD'] = rng.choice(CIUDADES, filas)
+    if 'EPS' in df.columns:
+        df['EPS'] = rng.choice(EPS, filas)
+    for columna in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[columna]):
+            df[columna] = df[columna] + pd.to_timedelta(rng.integers(-60, 60, filas), unit='D')
+    return df
+
+
+def escribir_sinteticos(filas, destino):
+    """Genera los datos y los guarda como Excel (en streaming)"""
+    import exportar
+
+    exportar.escribir_excel(datos_sinteticos(filas), destino)
+
+
+# ------------------------------------------
+# Sesiones (proceso hijo)
+# ------------------------------------------
+
+class _Archivo(io.BytesIO):
+    """Lo que devuelve st.file_uploader: bytes con nombre e id"""
+
+    def __init__(self, contenido, nombre):
+        super().__init__(contenido)
+        self.name = nombre
+        self.file_id = nombre
+
+
+def _instalar_uploader():
+    """
+    El AppTest no maneja st.file_uploader: se reemplaza por uno que
+    devuelve el archivo guardado en la sesión que está corriendo.
+    """
+    import streamlit as st
+
+    def file_uploader(*args, **kwargs):
+        archivo = st.session_state.get(CLAVE_ARCHIVO)
+        return None if archivo is None else _Archivo(*archivo)
+
+    st.file_uploader = file_uploader
+
+
+def _runtime_compartido():
+    """
+    Cada AppTest instala su Runtime al empezar un rerun y lo borra al
+    terminar; con sesiones en paralelo una borraría el de otra a mitad del
+    script. Como en un servidor real, el proceso tiene un solo Runtime, que
+    se usa cuando no hay otro instalado.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    compartido = MagicMock(spec=Runtime)
+    compartido.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    compartido.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or compartido)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+def _memoria():
+    """Memoria residente actual del proceso en MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def _pasos(app, script, rng, df):
+    """
+    Acciones de un ciclo: (nombre, función que prepara el rerun). Cada
+    función modifica los widgets del AppTest; luego se corre el script.
+    """
+    def filtrar():
+        for columna in rng.sample(['EPS', 'CIUDAD'], 2):
+            selectores = [s for s in app.selectbox if s.key == f'filtro_{columna}']
+            if selectores and len(selectores[0].options) > 1:
+                # Las opciones se muestran con su conteo: 'SANITAS (120)'
+                etiqueta = rng.choice(selectores[0].options[1:])
+                selectores[0].set_value(re.sub(r' \(\d+\)$', '', etiqueta))
+                return
+
+    def buscar():
+        palabra = rng.choice(df['NOMBRE'].iloc[rng.randrange(len(df))].split())
+        app.text_input(key='busqueda').set_value(palabra[:4])
+
+    def abrir_paciente():
+        app.text_input(key='busqueda').set_value('')
+        for s in app.selectbox:
+            if s.key and s.key.startswith('filtro_'):
+                s.set_value(s.options[0])
+        botones = [b for b in app.button if b.key and b.key.startswith(BOTON_PACIENTE[script])]
+        if botones:
+            rng.choice(botones).click()
+
+    def exportar():
+        botones = [b for b in app.button if b.label.startswith('📦 Preparar')]
+        if botones:
+            botones[0].click()
+
+    pasos = [('filtro', filtrar), ('búsqueda', buscar), ('paciente', abrir_paciente)]
+    if script == 'dashboard.py':
+        # El dashboard mínimo no tiene exportación
+        pasos.append(('exportación', exportar))
+    return pasos
+
+
+def _sesion(script, numero, contenido, df, ciclos, pausa, inicio, medidas):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(numero)
+    app = AppTest.from_file(str(BASE / script), default_timeout=600)
+    app.session_state[CLAVE_ARCHIVO] = (contenido, f'carga_{numero}.xlsx')
+
+    def correr(paso):
+        t0 = time.perf_counter()
+        app.run()
+        medidas.append({
+            'paso': paso,
+            'segundos': time.perf_counter() - t0,
+            'errores': [str(e.value) for e in app.exception],
+        })
+
+    inicio.wait()
+    try:
+        correr('carga')
+        for _ in range(ciclos):
+            for nombre, preparar in _pasos(app, script, rng, df):
+                if pausa:
+                    time.sleep(rng.uniform(0, 2 * pausa))
+                preparar()
+                correr(nombre)
+    except Exception as e:
+        # Un fallo del AppTest termina la sesión, pero no la prueba
+        medidas.append({'paso': 'fallo', 'segundos': 0.0, 'errores': [repr(e)]})
+
+
+def _medir(script, sesiones, ciclos, pausa, archivo):
+    import logging
+    import warnings
+
+    import pandas as pd
+
+    sys.path.insert(0, str(BASE))
+    os.chdir(BASE)
+    warnings.filterwarnings('ignore')
+    logging.disable(logging.WARNING)
+    _instalar_uploader()
+    _runtime_compartido()
+
+    contenido = Path(archivo).read_bytes()
+    df = pd.read_excel(io.BytesIO(contenido), usecols=['NOMBRE'])
+
+    memoria_base = _memoria()
+    pico = [memoria_base]
+    activo = threading.Event()
+    activo.set()
+
+    def muestrear():
+        while activo.is_set():
+            pico[0] = max(pico[0], _memoria())
+            time.sleep(0.05)
+
+    muestreo = threading.Thread(target=muestrear, daemon=True)
+    muestreo.start()
+
+    inicio = threading.Barrier(sesiones + 1)
+    medidas = []
+    hilos = [
+        threading.Thread(
+            target=_sesion, args=(script, i, contenido, df, ciclos, pausa, inicio, medidas)
+        )
+        for i in range(sesiones)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    inicio.wait()
+    t0 = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - t0
+    activo.clear()
+    muestreo.join()
+
+    return {
+        'duracion': duracion,
+        'medidas': medidas,
+        'memoria_base': memoria_base,
+        'memoria_pico': pico[0],
+    }
+
+
+def _hijo(args):
+    """Ejecuta un escenario en un proceso nuevo y retorna su salida JSON"""
+    with tempfile.TemporaryDirectory() as datos:
+        salida = subprocess.run(
+            [sys.executable, __file__, *args],
+            cwd=BASE, capture_output=True, text=True, check=True,
+            env={**os.environ, 'TMZ_DATOS': datos},
+        )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+# ------------------------------------------
+# Reporte
+# ------------------------------------------
+
+def percentiles(segundos):
+    """p50/p95/p99 en milisegundos"""
+    return {p: float(np.percentile(segundos, p)) * 1000 for p in PERCENTILES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=5000, help='filas de los datos sintéticos')
+    parser.add_argument('--sesiones', type=int, nargs='+', default=[1, 5, 10],
+                        help='sesiones concurrentes de cada escenario')
+    parser.add_argument('--ciclos', type=int, default=3,
+                        help='ciclos filtro/búsqueda/paciente/exportación por sesión')
+    parser.add_argument('--pausa', type=float, default=0,
+                        help='pausa media entre acciones, en segundos')
+    parser.add_argument('--scripts', nargs='+', default=list(BOTON_PACIENTE), choices=list(BOTON_PACIENTE))
+    parser.add_argument('--hijo', nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument('--archivo', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Modo proceso hijo
+    if args.hijo:
+        script, sesiones = args.hijo
+        print(json.dumps(_medir(script, int(sesiones), args.ciclos, args.pausa, args.archivo)))
+        return
+
+    sys.path.insert(0, str(BASE))
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = Path(directorio) / f'sinteticos_{args.filas}.xlsx'
+        t0 = time.perf_counter()
+        escribir_sinteticos(args.filas, archivo)
+        print(f"Datos sintéticos: {args.filas} filas ({time.perf_counter() - t0:.1f}s)\n")
+
+        print(
+            f"{'Escenario':<30}{'reruns':>7}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'reruns/s':>10}{'RSS base':>10}{'RSS pico':>10}{'MB/sesión':>11}"
+        )
+        for script in args.scripts:
+            for sesiones in args.sesiones:
+                resultado = _hijo([
+                    '--hijo', script, str(sesiones), '--ciclos', str(args.ciclos),
+                    '--pausa', str(args.pausa), '--archivo', str(archivo),
+                ])
+                medidas = resultado['medidas']
+                total = percentiles([m['segundos'] for m in medidas])
+                extra = resultado['memoria_pico'] - resultado['memoria_base']
+                print(
+                    f"{script + ' x' + str(sesiones):<30}{len(medidas):>7}"
+                    f"{total[50]:>7.0f}ms{total[95]:>7.0f}ms{total[99]:>7.0f}ms"
+                    f"{len(medidas) / resultado['duracion']:>10.1f}"
+                    f"{resultado['memoria_base']:>8.0f}MB{resultado['memoria_pico']:>8.0f}MB"
+                    f"{extra / sesiones:>9.1f}MB"
+                )
+                for paso in dict.fromkeys(m['paso'] for m in medidas):
+                    tiempos = percentiles([m['segundos'] for m in medidas if m['paso'] == paso])
+                    print(
+                        f"    {paso:<26}{'':>7}"
+                        f"{tiempos[50]:>7.0f}ms{tiempos[95]:>7.0f}ms{tiempos[99]:>7.0f}ms"
+                    )
+                errores = [e for m in medidas for e in m['errores']]
+                if errores:
+                    print(f"    ⚠️ {len(errores)} errores: {errores[0]}")
+
+
+if __name__ == '__main__':
+    main()
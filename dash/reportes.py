@@ -0,0 +1,418 @@
+"""
+Reportes por paciente en lote: la misma ficha de la vista de detalle
+(Ubicación, Personal, Aseguradora, clínica, síntomas, timeline,
+administrativa y observaciones) como documento HTML independiente, u
+opcionalmente PDF, para cada paciente de una cohorte filtrada.
+
+Los pacientes se reparten por bloques entre procesos; cada proceso compila
+la plantilla una sola vez al iniciar. Los documentos se agregan a un zip
+en disco a medida que llegan, agrupados por IPS para entregarlos a cada
+institución:
+
+    salidas/2024-05-06/reportes.zip
+        CLINICA_DEL_COUNTRY/79153295_JOSE_PEREZ.html
+        ...
+        indice.csv
+
+Uso:
+    python reportes.py datos/tmz.xlsx [--cohorte NOMBRE] [--filtro EPS=SANITAS ...]
+                       [--busqueda TEXTO] [--pdf] [--salida ruta.zip] [--procesos N]
+
+El PDF necesita weasyprint (pip install weasyprint).
+"""
+import argparse
+import csv
+import getpass
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+import auditoria
+import cohortes
+import motor
+from indicadores import SINTOMAS
+from lotes import nombre_archivo
+
+BASE = Path(__file__).resolve().parent
+
+COLUMNA_IPS = 'IPS/INSTITUTO QUE REMITE'
+
+# Pacientes por tarea enviada a un proceso
+PACIENTES_POR_BLOQUE = 200
+
+# Bloques en curso por proceso: acota los documentos renderizados que
+# esperan a escribirse en el zip
+BLOQUES_POR_PROCESO = 2
+
+VACIOS = ['', 'nan', 'NaT', 'None', 'N/A']
+
+PLANTILLA = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>{{ p.nombre }} — {{ p.cedula }}</title>
+<style>
+  body { font-family: sans-serif; color: #222; max-width: 960px; margin: 2em auto; }
+  h1 { margin-bottom: 0; }
+  h2 { border-bottom: 2px solid #1F4E79; color: #1F4E79; padding-bottom: .2em; }
+  .grilla { display: flex; gap: 2em; flex-wrap: wrap; }
+  .grilla > div { flex: 1; min-width: 200px; }
+  .estado, .sintoma, .fase { border-radius: 4px; padding: .4em .8em; margin: .3em 0; }
+  .completado, .no, .hecha { background: #e6f4ea; }
+  .proceso, .otro { background: #e8f0fe; }
+  .pendiente, .si { background: #fef7e0; }
+  .si { background: #fce8e6; }
+  .nota { white-space: pre-wrap; }
+  footer { color: #777; font-size: .8em; margin-top: 3em; }
+</style>
+</head>
+<body>
+<h1>👤 {{ p.nombre }}</h1>
+<p><strong>📋 Cédula:</strong> {{ p.cedula }}</p>
+<div class="estado {{ p.categoria }}">{{ p.icono_estado }} {{ p.estado }}</div>
+
+<div class="grilla">
+{% for titulo, campos in p.tarjetas %}
+  <div>
+    <h2>{{ titulo }}</h2>
+    {% for etiqueta, valor in campos %}<p><strong>{{ etiqueta }}:</strong> {{ valor }}</p>{% endfor %}
+  </div>
+{% endfor %}
+</div>
+
+<h2>🩺 Clínica</h2>
+<div class="grilla">
+  <div>
+    <p><strong>Diagnóstico primario:</strong> {{ p.diagnostico_primario }}</p>
+    <p><strong>Diagnóstico CIE:</strong> {{ p.diagnostico }}</p>
+    <p><strong>👨‍⚕️ Médico tratante:</strong> {{ p.medico }}</p>
+  </div>
+  <div>
+    <p><strong>IPS/Instituto:</strong> {{ p.ips }}</p>
+    <p><strong>Lugar de Toma:</strong> {{ p.lugar_toma }}</p>
+    <p><strong>🔬 Código Progenika:</strong> {{ p.codigo or 'Pendiente de asignación' }}</p>
+  </div>
+</div>
+
+<h2>🫁 Síntomas Respiratorios</h2>
+<div class="grilla">
+{% for emoji, nombre, clase, texto in p.sintomas %}
+  <div class="sintoma {{ clase }}">{{ emoji }} <strong>{{ nombre }}:</strong> {{ texto }}</div>
+{% endfor %}
+</div>
+
+<h2>📅 Timeline</h2>
+{% for icono, fase, fecha, extra in p.fases %}
+<div class="fase {{ 'hecha' if fecha else 'pendiente' }}">
+  {{ icono }} <strong>{{ fase }}</strong> — {{ fecha or '⏳ Pendiente' }}{% if fecha and extra %} (👤 {{ extra }}){% endif %}
+</div>
+{% endfor %}
+{% if p.mes_toma %}<p><strong>📆 Mes de Toma:</strong> {{ p.mes_toma }}</p>{% endif %}
+{% if p.orden_mes %}<p><strong>🔢 Orden del Mes:</strong> {{ p.orden_mes }}</p>{% endif %}
+
+<h2>👥 Administrativa</h2>
+<div class="grilla">
+  <div>
+    <p><strong>Representante:</strong> {{ p.representante }}</p>
+    <p><strong>Reportante:</strong> {{ p.reportante }}</p>
+    <p><strong>Quien tomó muestra:</strong> {{ p.quien_tomo }}</p>
+  </div>
+  <div>
+    <p><strong>Mes:</strong> {{ p.mes }}</p>
+    <p><strong>Orden x Mes:</strong> {{ p.orden_mes or 'N/A' }}</p>
+    {% if p.resultado_corte %}<p><strong>Resultado Corte:</strong> {{ p.resultado_corte }}</p>{% endif %}
+  </div>
+</div>
+
+<h2>📝 Observaciones</h2>
+{% if p.observaciones %}<p><strong>📌 Observaciones Generales:</strong></p><p class="nota">{{ p.observaciones }}</p>{% endif %}
+{% if p.observacion_toma %}<p><strong>💉 Observación de Toma:</strong></p><p class="nota">{{ p.observacion_toma }}</p>{% endif %}
+{% if not p.observaciones and not p.observacion_toma %}<p>✅ Sin observaciones registradas</p>{% endif %}
+
+<footer>Generado el {{ generado }} · versión de datos {{ version }}</footer>
+</body>
+</html>
+"""
+
+# Plantilla compilada de cada proceso trabajador (se compila al iniciar)
+_plantilla = None
+
+
+def plantilla():
+    """Plantilla Jinja2 compilada (con escape de HTML)"""
+    from jinja2 import Environment
+
+    entorno = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+    return entorno.from_string(PLANTILLA)
+
+
+def _texto(valor):
+    """Valor para mostrar, o '' si está vacío"""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return ''
+    if isinstance(valor, (pd.Timestamp, datetime)):
+        return valor.strftime('%d/%m/%Y')
+    texto = str(valor).strip()
+    return '' if texto in VACIOS else texto
+
+
+def ficha(paciente):
+    """Contenido de la vista de detalle de un paciente, listo para la plantilla"""
+    def campo(columna, defecto='N/A'):
+        return _texto(paciente.get(columna)) or defecto
+
+    estado = campo('ESTADO', 'Sin estado')
+    categoria = motor.categoria_estado(estado)
+    iconos = {'completado': '✅', 'proceso': '🔄'}
+
+    sintomas = []
+    for emoji, nombre, columna in SINTOMAS:
+        valor = paciente.get(columna)
+        if motor.es_si(valor):
+            sintomas.append((emoji, nombre, 'si', '✅ SI'))
+        elif motor.es_no(valor):
+            sintomas.append((emoji, nombre, 'no', '❌ NO'))
+        else:
+            sintomas.append((emoji, nombre, 'otro', f"⚪ {campo(columna)}"))
+
+    enviados = '✅ Completado' if motor.es_si(paciente.get('RESULTADOS ENVIADOS')) else ''
+    return {
+        'nombre': campo('NOMBRE'),
+        'cedula': campo('CEDULA'),
+        'estado': estado,
+        'categoria': categoria,
+        'icono_estado': iconos.get(categoria, '⏳'),
+        'tarjetas': [
+            ("📍 Ubicación", [
+                ('Ciudad', campo('CIUDAD')),
+                ('Departamento', campo('DEPARTAMENTO')),
+                ('Zona', campo('ZONA')),
+            ]),
+            ("👤 Personal", [
+                ('Edad', f"{campo('EDAD')} años"),
+                ('Género', campo('GÉNERO')),
+                ('Rango', campo('RANGO DE EDAD')),
+            ]),
+            ("🏥 Aseguradora", [
+                ('EPS', campo('EPS')),
+                ('Sede', campo('SEDES')),
+            ]),
+        ],
+        'diagnostico_primario': campo('DIAGNOSTICO PRIMARIO'),
+        'diagnostico': campo('DIAGNOSTICO'),
+        'medico': campo('NOMBRE MÉDICO'),
+        'ips': campo(COLUMNA_IPS),
+        'lugar_toma': campo('MD ORDENA/LUGAR DE TOMA'),
+        'codigo': campo('CODIGO PROGENIKA', ''),
+        'sintomas': sintomas,
+        'fases': [
+            ("📝", "Registro", campo('FECHA REGISTRO', ''), ''),
+            ("💉", "Toma de Muestra", campo('FECHA TOMA MUESTRA', ''), campo('QUIEN TOMO LA MUESTRA', '')),
+            ("✈️", "Enviada a España", campo('FECHA ENVIO MUESTRAS A ESPAÑA', ''), ''),
+            ("📥", "Resultados Recibidos", campo('FECHA DE RECIBIDO', ''), ''),
+            ("📧", "Resultados Enviados", enviados, ''),
+        ],
+        'mes_toma': campo('MES DE TOMA', ''),
+        'orden_mes': campo('ORDEN X MES', ''),
+        'representante': campo('REPRESENTANTE'),
+        'reportante': campo('REPORTANTE 1'),
+        'quien_tomo': campo('QUIEN TOMO LA MUESTRA'),
+        'mes': campo('MES'),
+        'resultado_corte': campo('RESULTADOS A CORTE 14 OCTUBRE JOHN', ''),
+        'observaciones': campo('OBSERVACIONES', ''),
+        'observacion_toma': campo('OBSERVACIÓN DE TOMA', ''),
+    }
+
+
+def renderizar(paciente, version='', generado=None, compilada=None):
+    """HTML independiente de un paciente"""
+    compilada = compilada or _plantilla or plantilla()
+    return compilada.render(
+        p=ficha(paciente),
+        version=version,
+        generado=generado or datetime.now().strftime('%d/%m/%Y %H:%M'),
+    )
+
+
+def a_pdf(html):
+    """Convierte el HTML en PDF (necesita weasyprint)"""
+    from weasyprint import HTML
+
+    return HTML(string=html).write_pdf()
+
+
+def _iniciar_trabajador():
+    global _plantilla
+    _plantilla = plantilla()
+
+
+def renderizar_bloque(pacientes, version, generado, pdf=False):
+    """
+    Documentos de un bloque de pacientes: lista de (nombre en el zip, bytes).
+
+    Corre dentro de un proceso trabajador, con la plantilla ya compilada.
+    """
+    documentos = []
+    for paciente in pacientes:
+        html = renderizar(paciente, version, generado)
+        base = f"{nombre_archivo(paciente.get(COLUMNA_IPS))}/{paciente['_archivo']}"
+        documentos.append((f"{base}.html", html.encode('utf-8')))
+        if pdf:
+            documentos.append((f"{base}.pdf", a_pdf(html)))
+    return documentos
+
+
+def _bloques(registros, tamano):
+    for inicio in range(0, len(registros), tamano):
+        yield registros[inicio:inicio + tamano]
+
+
+def generar_reportes(dataset, mascara_o_filas, destino, pdf=False, procesos=None):
+    """
+    Escribe en destino (zip) los reportes de los pacientes seleccionados
+    (máscara o posiciones) y un indice.csv. Retorna el número de pacientes.
+
+    El zip se escribe en un archivo temporal junto al destino y se renombra
+    al terminar, así que un lote interrumpido no deja un zip a medias (el
+    temporal se borra). Solo hay unos pocos bloques en curso a la vez, así
+    que en memoria quedan los documentos de esos bloques, no los del lote.
+    """
+    if pdf:
+        try:
+            import weasyprint  # noqa: F401
+        except ImportError:
+            raise ValueError("El PDF necesita weasyprint (pip install weasyprint)")
+
+    completas = motor.filas_completas(dataset, mascara_o_filas)
+    registros = completas.to_dict('records')
+    usados = set()
+    for registro in registros:
+        # Nombre único dentro de la carpeta de su IPS: la carpeta es el nombre
+        # de archivo de la IPS, así que 'CLÍNICA NORTE' y 'CLINICA NORTE '
+        # comparten carpeta
+        carpeta = nombre_archivo(registro.get(COLUMNA_IPS))
+        base = nombre = nombre_archivo(f"{_texto(registro.get('CEDULA'))}_{_texto(registro.get('NOMBRE'))}")
+        sufijo = 2
+        while (carpeta, nombre) in usados:
+            nombre = f"{base}_{sufijo}"
+            sufijo += 1
+        usados.add((carpeta, nombre))
+        registro['_archivo'] = nombre
+
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporal = destino.with_suffix(destino.suffix + f'.{os.getpid()}.tmp')
+    generado = datetime.now().strftime('%d/%m/%Y %H:%M')
+    indice = []
+
+    procesos = procesos or os.cpu_count()
+    try:
+        with zipfile.ZipFile(temporal, 'w', compression=zipfile.ZIP_DEFLATED) as archivo, \
+                ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_trabajador) as ejecutor:
+            pendientes = set()
+            bloques = _bloques(registros, PACIENTES_POR_BLOQUE)
+            while True:
+                for bloque in bloques:
+                    pendientes.add(ejecutor.submit(renderizar_bloque, bloque, dataset['version'], generado, pdf))
+                    if len(pendientes) >= procesos * BLOQUES_POR_PROCESO:
+                        break
+                if not pendientes:
+                    break
+                listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                while listos:
+                    # Cada bloque se suelta en cuanto queda escrito
+                    for nombre, contenido in listos.pop().result():
+                        # El PDF ya viene comprimido
+                        compresion = zipfile.ZIP_STORED if nombre.endswith('.pdf') else zipfile.ZIP_DEFLATED
+                        archivo.writestr(nombre, contenido, compress_type=compresion)
+
+            for registro in registros:
+                indice.append({
+                    'CEDULA': _texto(registro.get('CEDULA')),
+                    'NOMBRE': _texto(registro.get('NOMBRE')),
+                    'IPS': _texto(registro.get(COLUMNA_IPS)),
+                    'archivo': f"{nombre_archivo(registro.get(COLUMNA_IPS))}/{registro['_archivo']}.html",
+                })
+            texto = io.StringIO()
+            escritor = csv.DictWriter(texto, fieldnames=['CEDULA', 'NOMBRE', 'IPS', 'archivo'])
+            escritor.writeheader()
+            escritor.writerows(indice)
+            archivo.writestr('indice.csv', '﻿' + texto.getvalue())
+    except BaseException:
+        temporal.unlink(missing_ok=True)
+        raise
+
+    os.replace(temporal, destino)
+    return len(registros)
+
+
+def _filtros(pares):
+    """--filtro COLUMNA=VALOR repetible; varios valores de una columna se combinan"""
+    filtros = {}
+    for par in pares:
+        columna, separador, valor = par.partition('=')
+        if not separador:
+            raise ValueError(f"Filtro inválido (se espera COLUMNA=VALOR): {par}")
+        filtros.setdefault(columna.strip(), []).append(valor)
+    return {c: v[0] if len(v) == 1 else v for c, v in filtros.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('origen', nargs='?', default=str(BASE / 'datos' / 'tmz.xlsx'),
+                        help='Excel de pacientes')
+    parser.add_argument('--cohorte', help='cohorte guardada en el dashboard')
+    parser.add_argument('--filtro', action='append', default=[], metavar='COLUMNA=VALOR',
+                        help='filtro adicional (repetible)')
+    parser.add_argument('--busqueda', default='', help='texto de búsqueda')
+    parser.add_argument('--pdf', action='store_true', help='incluir también el PDF de cada paciente')
+    parser.add_argument('--salida', default=None,
+                        help='zip de salida (por defecto salidas/<fecha>/reportes.zip)')
+    parser.add_argument('--procesos', type=int, default=None,
+                        help='procesos en paralelo (por defecto, uno por núcleo)')
+    args = parser.parse_args()
+
+    try:
+        filtros, busqueda = {}, args.busqueda
+        if args.cohorte:
+            spec = cohortes.listar().get(args.cohorte)
+            if spec is None:
+                raise ValueError(f"No existe la cohorte: {args.cohorte}")
+            filtros, busqueda = dict(spec['filtros']), busqueda or spec['busqueda']
+        filtros.update(_filtros(args.filtro))
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+
+    t0 = time.perf_counter()
+    dataset = motor.cargar_dataset(args.origen)
+    mascara = motor.aplicar_filtros(dataset, filtros, busqueda)
+    if not mascara.any():
+        sys.exit("❌ La cohorte no tiene pacientes")
+    destino = Path(args.salida or BASE / 'salidas' / date.today().isoformat() / 'reportes.zip')
+
+    try:
+        pacientes = generar_reportes(dataset, mascara, destino, args.pdf, args.procesos)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    auditoria.registrar(
+        'exportar', usuario=getpass.getuser(), sesion='reportes', contenido='reportes',
+        formato='html+pdf' if args.pdf else 'html', filas=pacientes, filtros=filtros,
+        busqueda=busqueda, cohorte=args.cohorte, archivo=str(destino), version=dataset['version'],
+    )
+
+    total = time.perf_counter() - t0
+    print(
+        f"✅ {pacientes} reportes en {destino} "
+        f"({destino.stat().st_size / 1e6:.1f} MB, {total:.1f}s, {args.procesos or os.cpu_count()} procesos)"
+    )
+
+
+if __name__ == '__main__':
+    main()
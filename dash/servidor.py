@@ -0,0 +1,186 @@
+"""
+Datos compartidos por todas las sesiones del servidor.
+
+Viven a nivel de módulo (no dentro de los scripts de Streamlit) para que
+precalentar.py pueda llenarlos en el mismo proceso antes de que llegue el
+primer usuario, y refrescarlos periódicamente sin que una sesión espere:
+
+    dataset = servidor.datos_backend()      # dashboard_minimal.py
+    almacen = servidor.maestro()            # dashboard.py
+
+La vista sin filtros (KPIs, gráficos y tendencias) también se guarda aquí
+por versión de datos, así que la primera sesión de cada versión la
+calcula (o precalentar.py) y las demás la reutilizan.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+import motor
+
+BASE = Path(__file__).resolve().parent
+RUTA_BACKEND = Path(os.environ.get('TMZ_DATOS', BASE / 'datos')) / 'tmz.xlsx'
+
+# Segundos que se reutilizan los datos del backend antes de volver a leerlos
+TTL_BACKEND = 300
+
+# Reportes de calidad guardados (uno por versión de datos y día)
+MAX_CALIDAD = 4
+
+# Vistas sin filtros guardadas (resultado y series de tendencias, de
+# todas las versiones)
+MAX_VISTAS = 16
+
+_log = logging.getLogger(__name__)
+
+_backend = {'dataset': None, 'cargado': None}
+_lock_backend = threading.Lock()
+_almacen = None
+_lock_maestro = threading.Lock()
+_calidad = OrderedDict()
+_lock_calidad = threading.Lock()
+_vistas = OrderedDict()
+_lock_vistas = threading.Lock()
+
+
+# ==========================================
+# CONFIGURACIÓN BACKEND
+# ==========================================
+
+def cargar_datos_backend():
+    """
+    Conecta con el backend para obtener datos.
+    Reemplaza esta función con tu conexión real a base de datos.
+    Retorna un DataFrame, o None si no hay backend disponible.
+    """
+    # OPCIÓN 1: Conexión a base de datos
+    # import psycopg2  # o pymysql, sqlite3, etc.
+    # conn = psycopg2.connect(...)
+    # df = pd.read_sql("SELECT * FROM pacientes", conn)
+
+    # OPCIÓN 2: API REST
+    # import requests
+    # response = requests.get("https://tu-api.com/pacientes")
+    # df = pd.DataFrame(response.json())
+
+    # OPCIÓN 3: Archivo local en servidor (temporal), en TMZ_DATOS/tmz.xlsx
+    if not RUTA_BACKEND.exists():
+        return None
+    try:
+        return pd.read_excel(RUTA_BACKEND)
+    except Exception:
+        # Sin backend el dashboard ofrece la carga manual; no es un error fatal
+        _log.exception("No se pudieron leer los datos del backend (%s)", RUTA_BACKEND)
+        return None
+
+
+# ==========================================
+# DATOS COMPARTIDOS
+# ==========================================
+
+def _vencido():
+    cargado = _backend['cargado']
+    return cargado is None or time.monotonic() - cargado > TTL_BACKEND
+
+
+def _cargar_backend():
+    """Lee el backend y prepara el dataset del motor (con _lock_backend tomado)"""
+    df = cargar_datos_backend()
+    _backend['dataset'] = motor.preparar_dataset(df) if df is not None else None
+    _backend['cargado'] = time.monotonic()
+
+
+def datos_backend():
+    """
+    Dataset del backend (proyección para filtros y gráficos, columnas
+    frías e índices), o None si no hay backend. Se vuelve a leer cuando
+    tiene más de TTL_BACKEND segundos; una sola sesión lo lee y las demás
+    esperan ese resultado.
+    """
+    if not _vencido():
+        return _backend['dataset']
+    with _lock_backend:
+        if _vencido():
+            _cargar_backend()
+        return _backend['dataset']
+
+
+def refrescar_backend():
+    """
+    Vuelve a leer el backend aunque no haya vencido. Mientras tanto las
+    sesiones siguen recibiendo el dataset anterior.
+    """
+    with _lock_backend:
+        _cargar_backend()
+        return _backend['dataset']
+
+
+def maestro():
+    """
+    Almacén maestro compartido por todas las sesiones. Cada archivo se
+    fusiona una vez por CEDULA: solo se escriben y reindexan las filas
+    nuevas o cambiadas
+    """
+    global _almacen
+    if _almacen is None:
+        with _lock_maestro:
+            if _almacen is None:
+                _almacen = motor.abrir_maestro()
+    return _almacen
+
+
+def calidad_datos(version, dataset):
+    """Reporte de validación y su CSV descargable, una vez por versión y día"""
+    clave = (version, date.today())
+    with _lock_calidad:
+        if clave in _calidad:
+            _calidad.move_to_end(clave)
+            return _calidad[clave]
+
+    reporte = motor.validar_dataset(dataset)
+    resultado = (reporte, motor.reporte_validacion(motor.filas_completas(dataset), reporte))
+    with _lock_calidad:
+        _calidad[clave] = resultado
+        while len(_calidad) > MAX_CALIDAD:
+            _calidad.popitem(last=False)
+    return resultado
+
+
+def _vista(clave, calcular):
+    """Valor compartido de la vista sin filtros, calculado una vez por clave"""
+    with _lock_vistas:
+        if clave in _vistas:
+            _vistas.move_to_end(clave)
+            return _vistas[clave]
+
+    valor = calcular()
+    with _lock_vistas:
+        _vistas[clave] = valor
+        while len(_vistas) > MAX_VISTAS:
+            _vistas.popitem(last=False)
+    return valor
+
+
+def resultado_sin_filtros(version, dataset):
+    """
+    Filas, KPIs y agregados de gráficos sin filtros, búsqueda ni cola SLA
+    (lo que ve cada sesión al abrir). Compartido: no modificarlo.
+    """
+    return _vista(
+        ('resultado', version),
+        lambda: motor.calcular_resultado(dataset, motor.aplicar_filtros(dataset, {})),
+    )
+
+
+def tendencias_sin_filtros(version, dataset, frecuencia='semana', por=None):
+    """Series de tendencias de todas las filas, compartidas como el resultado"""
+    return _vista(
+        ('tendencias', version, frecuencia, por),
+        lambda: motor.calcular_tendencias(dataset, frecuencia, por=por),
+    )
@@ -0,0 +1,233 @@
+"""
+Presupuesto de memoria de los datos derivados de cada sesión.
+
+Lo que una sesión puede recalcular (CSV de descarga, exportaciones
+preparadas, reporte de calidad...) se guarda aquí en lugar de en
+st.session_state, junto con su tamaño estimado. Hay un presupuesto por
+sesión y otro para todas juntas; al superarlos se liberan primero los
+datos de las sesiones inactivas hace más tiempo y, dentro de una sesión,
+los usados hace más tiempo. Quien pide un dato liberado lo recalcula.
+
+Las sesiones que terminaron o llevan más de TMZ_SESION_INACTIVA_MIN
+minutos sin actividad se descartan completas. Los presupuestos se
+configuran con TMZ_MEMORIA_SESION_MB y TMZ_MEMORIA_TOTAL_MB. Sin
+dependencia de Streamlit: el identificador de sesión (y cómo saber si
+sigue abierta) lo pasa el dashboard.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+MB = 1024 * 1024
+
+MAX_BYTES_SESION = int(float(os.environ.get('TMZ_MEMORIA_SESION_MB', 64)) * MB)
+MAX_BYTES_TOTAL = int(float(os.environ.get('TMZ_MEMORIA_TOTAL_MB', 512)) * MB)
+
+# Segundos sin actividad tras los que se descarta una sesión
+MAX_INACTIVIDAD = float(os.environ.get('TMZ_SESION_INACTIVA_MIN', 30)) * 60
+
+# sesión -> {'datos': OrderedDict(clave -> (firma, valor, bytes)), 'bytes', 'actividad'}
+# en orden de actividad: la primera es la inactiva hace más tiempo
+_sesiones = OrderedDict()
+_liberados = {'datos': 0, 'bytes': 0}
+# id(valor) -> [valor, usos en curso, cerrar al terminar de usarlo]
+_en_uso = {}
+_lock = threading.Lock()
+
+
+def tamano(valor):
+    """Bytes aproximados que retiene un valor"""
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return len(valor)
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        uso = valor.memory_usage(deep=True)
+        return int(uso.sum() if isinstance(valor, pd.DataFrame) else uso)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(tamano(v) for v in valor)
+    if hasattr(valor, 'seek') and hasattr(valor, 'tell'):
+        # Archivo (p. ej. una exportación temporal): su tamaño total
+        posicion = valor.tell()
+        valor.seek(0, os.SEEK_END)
+        total = valor.tell()
+        valor.seek(posicion)
+        return total
+    return sys.getsizeof(valor)
+
+
+def _sesion(sesion):
+    """Registro de la sesión, marcada como la más reciente (con _lock tomado)"""
+    datos = _sesiones.get(sesion)
+    if datos is None:
+        datos = _sesiones[sesion] = {'datos': OrderedDict(), 'bytes': 0, 'actividad': 0.0}
+    datos['actividad'] = time.time()
+    _sesiones.move_to_end(sesion)
+    return datos
+
+
+def _cerrar(valor):
+    """
+    Cierra los archivos (exportaciones temporales) para borrarlos ya; si
+    alguien lo está leyendo (ver en_uso) se cierra cuando termine (con
+    _lock tomado)
+    """
+    if not (hasattr(valor, 'close') and hasattr(valor, 'seek')):
+        return
+    prestamo = _en_uso.get(id(valor))
+    if prestamo is not None:
+        prestamo[2] = True
+    else:
+        valor.close()
+
+
+def _prestar(valor):
+    """Marca un valor como en uso (con _lock tomado)"""
+    prestamo = _en_uso.setdefault(id(valor), [valor, 0, False])
+    prestamo[1] += 1
+
+
+def _liberar(registro, clave):
+    _, valor, bytes_dato = registro['datos'].pop(clave)
+    _cerrar(valor)
+    registro['bytes'] -= bytes_dato
+    _liberados['datos'] += 1
+    _liberados['bytes'] += bytes_dato
+
+
+def _ajustar(sesion, protegida):
+    """
+    Aplica los presupuestos (con _lock tomado). El dato recién guardado
+    (protegida) no se libera aunque él solo supere el presupuesto.
+    """
+    registro = _sesiones[sesion]
+    for clave in list(registro['datos']):
+        if registro['bytes'] <= MAX_BYTES_SESION:
+            break
+        if clave != protegida:
+            _liberar(registro, clave)
+
+    total = sum(r['bytes'] for r in _sesiones.values())
+    for otra in list(_sesiones):
+        if total <= MAX_BYTES_TOTAL:
+            return
+        if otra == sesion:
+            continue
+        total -= _sesiones[otra]['bytes']
+        _descartar(otra)
+
+    # Solo queda la sesión actual por encima del presupuesto global
+    for clave in list(registro['datos']):
+        if total <= MAX_BYTES_TOTAL:
+            break
+        if clave != protegida:
+            total -= registro['datos'][clave][2]
+            _liberar(registro, clave)
+
+
+def _descartar(sesion):
+    """Libera todos los datos de una sesión y la olvida (con _lock tomado)"""
+    registro = _sesiones.pop(sesion)
+    for clave in list(registro['datos']):
+        _liberar(registro, clave)
+
+
+def tocar(sesion, viva=None):
+    """
+    Marca la sesión como activa (al inicio de cada rerun) y descarta las
+    que llevan más de MAX_INACTIVIDAD segundos inactivas o, si se pasa
+    viva (sesión -> bool), las que ya terminaron.
+    """
+    with _lock:
+        _sesion(sesion)
+        limite = time.time() - MAX_INACTIVIDAD
+        for otra in list(_sesiones):
+            if otra == sesion:
+                continue
+            if _sesiones[otra]['actividad'] < limite or (viva is not None and not viva(otra)):
+                _descartar(otra)
+
+
+def guardar(sesion, clave, valor, firma=None, prestar=False):
+    """Guarda un dato derivado de la sesión y aplica los presupuestos"""
+    bytes_dato = tamano(valor)
+    with _lock:
+        if prestar:
+            _prestar(valor)
+        registro = _sesion(sesion)
+        if clave in registro['datos']:
+            _, anterior, bytes_anterior = registro['datos'].pop(clave)
+            registro['bytes'] -= bytes_anterior
+            if anterior is not valor:
+                _cerrar(anterior)
+        registro['datos'][clave] = (firma, valor, bytes_dato)
+        registro['bytes'] += bytes_dato
+        _ajustar(sesion, clave)
+
+
+def obtener(sesion, clave, firma=None, prestar=False):
+    """El dato guardado si sigue en memoria y su firma coincide, o None"""
+    with _lock:
+        registro = _sesion(sesion)
+        guardado = registro['datos'].get(clave)
+        if guardado is None or guardado[0] != firma:
+            return None
+        registro['datos'].move_to_end(clave)
+        if prestar:
+            _prestar(guardado[1])
+        return guardado[1]
+
+
+def derivado(sesion, clave, firma, calcular):
+    """Dato guardado con esa firma o, si no está (o se liberó), calculado y guardado"""
+    valor = obtener(sesion, clave, firma)
+    if valor is None:
+        valor = calcular()
+        guardar(sesion, clave, valor, firma)
+    return valor
+
+
+@contextmanager
+def en_uso(sesion, clave, firma, calcular):
+    """
+    Como derivado(), para archivos que se leen después de obtenerlos: si
+    otra sesión lo libera mientras tanto, no se cierra hasta salir del with
+    """
+    valor = obtener(sesion, clave, firma, prestar=True)
+    if valor is None:
+        valor = calcular()
+        guardar(sesion, clave, valor, firma, prestar=True)
+    try:
+        yield valor
+    finally:
+        with _lock:
+            prestamo = _en_uso[id(valor)]
+            prestamo[1] -= 1
+            if not prestamo[1]:
+                del _en_uso[id(valor)]
+                if prestamo[2]:
+                    valor.close()
+
+
+def uso(sesion=None):
+    """Bytes de la sesión y de todas, presupuestos y datos liberados"""
+    with _lock:
+        registro = _sesiones.get(sesion)
+        return {
+            'sesion': registro['bytes'] if registro is not None else 0,
+            'datos_sesion': len(registro['datos']) if registro is not None else 0,
+            'total': sum(r['bytes'] for r in _sesiones.values()),
+            'sesiones': len(_sesiones),
+            'max_sesion': MAX_BYTES_SESION,
+            'max_total': MAX_BYTES_TOTAL,
+            'liberados': _liberados['datos'],
+            'bytes_liberados': _liberados['bytes'],
+        }
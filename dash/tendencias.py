@@ -0,0 +1,201 @@
+"""
+Series de tiempo del proceso de tamizaje por semana y por mes.
+
+Cada columna de fecha del proceso (registro, toma, envío a España,
+recibido) se convierte una sola vez al cargar en el período de cada fila
+(ordinal de semana o de mes). Con eso, la serie de cualquier selección de
+filas es un bincount y el desglose por una faceta cruza esos ordinales con
+los códigos del índice de facetas. Las cantidades sin filtros se guardan ya
+agregadas.
+
+Cuando llegan filas nuevas o cambiadas (fusión en el maestro) solo se
+convierten esas filas y los totales se ajustan por diferencia, sin
+recorrer de nuevo la historia completa.
+"""
+import numpy as np
+import pandas as pd
+
+# (fase, columna de fecha) en el orden del embudo
+FASES = [
+    ('Registros', 'FECHA REGISTRO'),
+    ('Muestras tomadas', 'FECHA TOMA MUESTRA'),
+    ('Enviadas a España', 'FECHA ENVIO MUESTRAS A ESPAÑA'),
+    ('Resultados recibidos', 'FECHA DE RECIBIDO'),
+]
+
+# Frecuencia de pandas de cada agrupación (semanas de lunes a domingo)
+FRECUENCIAS = {'semana': 'W-SUN', 'mes': 'M'}
+
+# Períodos de la media móvil de cada agrupación
+VENTANAS = {'semana': 4, 'mes': 3}
+
+# Ordinal de las filas sin fecha (el de NaT en pandas)
+SIN_FECHA = np.iinfo(np.int64).min
+
+
+def _fechas(serie):
+    """Columna como datetime64, tolerando texto; las numéricas no tienen fechas"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return pd.DatetimeIndex(serie)
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.DatetimeIndex(np.full(len(serie), np.datetime64('NaT'), dtype='datetime64[ns]'))
+    return pd.DatetimeIndex(pd.to_datetime(serie, errors='coerce', dayfirst=True))
+
+
+def _ordinales(serie):
+    """Ordinal del período de cada fila por frecuencia ({'semana': array, 'mes': array})"""
+    fechas = _fechas(serie)
+    return {
+        frecuencia: fechas.to_period(codigo).asi8
+        for frecuencia, codigo in FRECUENCIAS.items()
+    }
+
+
+def _contar(ordinales):
+    """Cantidad de filas por ordinal, sin las vacías"""
+    ordinales = ordinales[ordinales != SIN_FECHA]
+    valores, cantidades = np.unique(ordinales, return_counts=True)
+    return dict(zip(valores.tolist(), cantidades.tolist()))
+
+
+def construir_indice(df, fases=FASES, version=None):
+    """
+    Convierte las columnas de fecha del proceso en ordinales de período.
+
+    Retorna un diccionario con el número de filas y, por columna, los
+    ordinales por fila y los totales sin filtros de cada frecuencia.
+    """
+    indice_columnas = {}
+    for _, columna in fases:
+        if columna not in df.columns:
+            continue
+        ordinales = _ordinales(df[columna])
+        indice_columnas[columna] = {
+            'ordinales': ordinales,
+            'totales': {frecuencia: _contar(o) for frecuencia, o in ordinales.items()},
+        }
+    return {'version': version, 'n': len(df), 'columnas': indice_columnas}
+
+
+def actualizar_indice(indice, df, posiciones, version=None):
+    """
+    Actualiza el índice tras modificar o agregar filas: solo se convierten
+    las filas en 'posiciones' (las agregadas van al final de df) y a los
+    totales se les resta lo que esas filas aportaban antes y se les suma lo
+    nuevo.
+    """
+    posiciones = np.asarray(posiciones, dtype=np.intp)
+    cambiadas = posiciones[posiciones < indice['n']]
+    indice_columnas = {}
+    for columna, datos in indice['columnas'].items():
+        if columna not in df.columns:
+            continue
+        nuevos = _ordinales(df[columna].iloc[posiciones])
+        ordinales_columna, totales_columna = {}, {}
+        for frecuencia, anteriores in datos['ordinales'].items():
+            ordinales = np.full(len(df), SIN_FECHA, dtype=np.int64)
+            ordinales[:len(anteriores)] = anteriores
+
+            totales = dict(datos['totales'][frecuencia])
+            for ordinal, cantidad in _contar(anteriores[cambiadas]).items():
+                totales[ordinal] -= cantidad
+                if not totales[ordinal]:
+                    del totales[ordinal]
+            ordinales[posiciones] = nuevos[frecuencia]
+            for ordinal, cantidad in _contar(nuevos[frecuencia]).items():
+                totales[ordinal] = totales.get(ordinal, 0) + cantidad
+
+            ordinales_columna[frecuencia] = ordinales
+            totales_columna[frecuencia] = totales
+        indice_columnas[columna] = {'ordinales': ordinales_columna, 'totales': totales_columna}
+
+    # Columnas de fecha que llegan por primera vez
+    faltantes = [(f, c) for f, c in FASES if c in df.columns and c not in indice_columnas]
+    if faltantes:
+        indice_columnas.update(construir_indice(df, faltantes)['columnas'])
+    return {'version': version, 'n': len(df), 'columnas': indice_columnas}
+
+
+def _seleccionar(arreglo, mascara_o_filas):
+    if mascara_o_filas is None:
+        return arreglo
+    if isinstance(mascara_o_filas, np.ndarray) and mascara_o_filas.dtype == bool:
+        return arreglo[mascara_o_filas]
+    return arreglo[np.asarray(mascara_o_filas, dtype=np.intp)]
+
+
+def series(indice, frecuencia='semana', mascara_o_filas=None, por=None, indice_facetas=None):
+    """
+    Cantidad por período de cada fase y su media móvil, para las filas
+    seleccionadas (máscara o posiciones; todas si es None).
+
+    Con por (columna de faceta, con su indice_facetas) se desglosa además
+    por los valores de esa columna. Retorna un DataFrame largo con las
+    columnas periodo (inicio del período), fase, [grupo], cantidad y
+    media_movil; los períodos sin filas entre el primero y el último
+    aparecen con cantidad 0.
+    """
+    codigo = FRECUENCIAS[frecuencia]
+    ventana = VENTANAS[frecuencia]
+    desglose = None
+    if por is not None:
+        desglose = indice_facetas['columnas'].get(por) if indice_facetas else None
+        if desglose is None:
+            raise ValueError(f"Columna de desglose no disponible: {por}")
+
+    partes = []
+    for fase, columna in FASES:
+        datos = indice['columnas'].get(columna)
+        if datos is None:
+            continue
+        if mascara_o_filas is None and desglose is None:
+            # Sin filtros: totales ya agregados
+            totales = datos['totales'][frecuencia]
+            if not totales:
+                continue
+            inicio, fin = min(totales), max(totales)
+            cantidades = np.zeros((fin - inicio + 1, 1), dtype=np.int64)
+            for ordinal, cantidad in totales.items():
+                cantidades[ordinal - inicio, 0] = cantidad
+            grupos = [None]
+        else:
+            ordinales = _seleccionar(datos['ordinales'][frecuencia], mascara_o_filas)
+            validos = ordinales != SIN_FECHA
+            if desglose is not None:
+                codigos = _seleccionar(desglose['codigos'], mascara_o_filas)
+                validos &= codigos >= 0
+            ordinales = ordinales[validos]
+            if not len(ordinales):
+                continue
+            inicio, fin = int(ordinales.min()), int(ordinales.max())
+            periodos = fin - inicio + 1
+            if desglose is None:
+                cantidades = np.bincount(ordinales - inicio, minlength=periodos)[:, None]
+                grupos = [None]
+            else:
+                k = len(desglose['valores'])
+                combinados = (ordinales - inicio) * k + codigos[validos]
+                cantidades = np.bincount(combinados, minlength=periodos * k).reshape(periodos, k)
+                # Solo los valores con alguna fila en la selección
+                con_filas = cantidades.sum(axis=0) > 0
+                cantidades = cantidades[:, con_filas]
+                grupos = [v for v, usado in zip(desglose['valores'], con_filas) if usado]
+
+        inicios = pd.PeriodIndex.from_ordinals(
+            np.arange(inicio, fin + 1), freq=codigo
+        ).start_time
+        for j, grupo in enumerate(grupos):
+            parte = pd.DataFrame({
+                'periodo': inicios,
+                'fase': fase,
+                'cantidad': cantidades[:, j],
+            })
+            parte['media_movil'] = parte['cantidad'].rolling(ventana, min_periods=1).mean()
+            if desglose is not None:
+                parte.insert(2, 'grupo', str(grupo))
+            partes.append(parte)
+
+    columnas = ['periodo', 'fase'] + (['grupo'] if desglose is not None else []) + ['cantidad', 'media_movil']
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    return pd.concat(partes, ignore_index=True)[columnas]
@@ -0,0 +1,29 @@
+import pandas as pd
+
+import cambios
+import maestro
+
+
+def test_eliminados_entre_cargas_completas(tmp_path):
+    almacen = maestro.abrir(tmp_path / 'maestro')
+    maestro.fusionar(almacen, pd.DataFrame({'CEDULA': ['1', '2'], 'CIUDAD': ['BOGOTA', 'CALI']}), 'a.xlsx')
+    maestro.fusionar(almacen, pd.DataFrame({'CEDULA': ['1'], 'CIUDAD': ['TUNJA']}), 'b.xlsx')
+
+    diferencias = cambios.ultimos_cambios(almacen)
+
+    assert list(diferencias['eliminados']['CEDULA']) == ['2']
+    assert diferencias['filas_cambiadas'] == 1
+
+
+def test_carga_parcial_no_informa_eliminados(tmp_path):
+    almacen = maestro.abrir(tmp_path / 'maestro')
+    maestro.fusionar(almacen, pd.DataFrame({
+        'CEDULA': ['1', '2', '3'], 'NOMBRE': ['ANA', 'LUIS', 'EVA'], 'CIUDAD': ['BOGOTA', 'CALI', 'PASTO'],
+    }), 'a.xlsx')
+    maestro.fusionar(almacen, pd.DataFrame({'CEDULA': ['1'], 'CIUDAD': ['TUNJA']}), 'parcial.xlsx')
+
+    diferencias = cambios.ultimos_cambios(almacen)
+
+    assert diferencias['actual']['parcial']
+    assert diferencias['eliminados'].empty
+    assert list(diferencias['cambios']['Columna']) == ['CIUDAD']
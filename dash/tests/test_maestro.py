@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+import maestro
+
+
+@pytest.fixture
+def almacen(tmp_path):
+    return maestro.abrir(tmp_path / 'maestro')
+
+
+def carga(*filas):
+    return pd.DataFrame(filas, columns=['CEDULA', 'NOMBRE', 'CIUDAD', 'EPS'])
+
+
+def por_cedula(almacen):
+    return almacen['df'].set_index('CEDULA').to_dict('index')
+
+
+def test_inserta_filas_nuevas(almacen):
+    resumen = maestro.fusionar(almacen, carga(
+        ('1', 'ANA', 'BOGOTA', 'SANITAS'),
+        ('2', 'LUIS', 'CALI', 'FAMISANAR'),
+        (None, 'SIN CEDULA', 'CALI', 'SANITAS'),
+    ))
+
+    assert resumen['nuevos'] == 2
+    assert resumen['sin_cedula'] == 1
+    assert list(almacen['df']['CEDULA']) == ['1', '2']
+    assert almacen['version'] is not None
+
+
+def test_actualiza_por_cedula(almacen):
+    maestro.fusionar(almacen, carga(('1', 'ANA', 'BOGOTA', 'SANITAS'), ('2', 'LUIS', 'CALI', 'FAMISANAR')))
+    resumen = maestro.fusionar(almacen, carga(
+        ('2', 'LUIS', 'MEDELLIN', 'FAMISANAR'),
+        ('1', 'ANA', 'BOGOTA', 'SANITAS'),
+        ('3', 'EVA', 'PASTO', 'SANITAS'),
+    ))
+
+    assert (resumen['nuevos'], resumen['cambiados'], resumen['sin_cambios']) == (1, 1, 1)
+    assert list(resumen['posiciones_cambiadas']) == [1]
+    # Las cambiadas conservan su posición y las nuevas van al final
+    assert list(almacen['df']['CEDULA']) == ['1', '2', '3']
+    assert por_cedula(almacen)['2']['CIUDAD'] == 'MEDELLIN'
+
+
+def test_carga_parcial_conserva_columnas_que_no_trae(almacen):
+    maestro.fusionar(almacen, carga(('1', 'ANA', 'BOGOTA', 'SANITAS'), ('2', 'LUIS', 'CALI', 'FAMISANAR')))
+    parcial = pd.DataFrame({'CEDULA': ['1', '4'], 'CIUDAD': ['TUNJA', 'NEIVA']})
+    resumen = maestro.fusionar(almacen, parcial)
+
+    assert (resumen['nuevos'], resumen['cambiados']) == (1, 1)
+    filas = por_cedula(almacen)
+    assert filas['1'] == {'NOMBRE': 'ANA', 'CIUDAD': 'TUNJA', 'EPS': 'SANITAS'}
+    assert filas['2'] == {'NOMBRE': 'LUIS', 'CIUDAD': 'CALI', 'EPS': 'FAMISANAR'}
+    assert filas['4']['CIUDAD'] == 'NEIVA'
+    assert pd.isna(filas['4']['NOMBRE'])
+
+
+def test_reabrir_desde_segmentos_da_el_mismo_maestro(almacen):
+    maestro.fusionar(almacen, carga(('1', 'ANA', 'BOGOTA', 'SANITAS'), ('2', 'LUIS', 'CALI', 'FAMISANAR')))
+    maestro.fusionar(almacen, carga(('2', 'LUIS', 'MEDELLIN', 'FAMISANAR'), ('3', 'EVA', 'PASTO', 'SANITAS')))
+    maestro.fusionar(almacen, pd.DataFrame({'CEDULA': ['1'], 'EPS': ['NUEVA EPS']}))
+
+    reabierto = maestro.abrir(almacen['ruta'])
+
+    assert len(reabierto['manifiesto']['segmentos']) == 3
+    assert reabierto['version'] == almacen['version']
+    assert reabierto['indice'] == almacen['indice']
+    assert (reabierto['huellas'] == almacen['huellas']).all()
+    pd.testing.assert_frame_equal(reabierto['df'], almacen['df'])
@@ -0,0 +1,323 @@
+"""
+Validación de calidad de datos al cargar un Excel de pacientes.
+
+Revisa el esquema (columnas esperadas de la pantalla de bienvenida) y un
+conjunto de reglas por fila. Cada regla se evalúa como operaciones
+vectorizadas sobre columnas completas; las columnas derivadas (fechas,
+cédulas normalizadas, clase SI/NO de cada valor) se calculan una sola vez
+aunque las usen varias reglas. El reporte se guarda por versión de datos.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from indicadores import VALORES_NO, VALORES_SI
+
+# Sin estas columnas el archivo no se puede cargar
+COLUMNAS_OBLIGATORIAS = ['NOMBRE', 'CEDULA']
+
+# Columnas esperadas (ver pantalla de bienvenida); si faltan, las vistas
+# que las usan quedan vacías
+COLUMNAS_ESPERADAS = [
+    'NOMBRE', 'CEDULA', 'GÉNERO', 'EDAD', 'RANGO DE EDAD',
+    'CIUDAD', 'DEPARTAMENTO', 'ZONA',
+    'EPS', 'IPS/INSTITUTO QUE REMITE', 'SEDES',
+    'DIAGNOSTICO PRIMARIO', 'DIAGNOSTICO', 'NOMBRE MÉDICO',
+    'ESTADO', 'MES',
+    'ANTECEDENTES TABAQUISMO', 'DIFICULTAD RESPIRATORIA CON EL EJERCICI0',
+    'EPISODIOS DIFICULTAD RESPIRATORIA EN REPOSO', 'TOS MAS DE 3 MESES AL AÑO',
+    'EXPECTORACIÓN', 'SIBILANCIAS',
+    'FECHA REGISTRO', 'FECHA TOMA MUESTRA', 'MUESTRA ENVIADA A ESPAÑA',
+    'FECHA ENVIO MUESTRAS A ESPAÑA', 'FECHA DE RECIBIDO', 'RESULTADOS ENVIADOS',
+    'REPRESENTANTE', 'REPORTANTE 1', 'CODIGO PROGENIKA',
+    'OBSERVACIONES', 'OBSERVACIÓN DE TOMA',
+]
+
+COLUMNAS_SI_NO = [
+    'DIFICULTAD RESPIRATORIA CON EL EJERCICI0',
+    'EPISODIOS DIFICULTAD RESPIRATORIA EN REPOSO',
+    'TOS MAS DE 3 MESES AL AÑO',
+    'EXPECTORACIÓN',
+    'SIBILANCIAS',
+    'MUESTRA ENVIADA A ESPAÑA',
+    'RESULTADOS ENVIADOS',
+]
+
+COLUMNAS_FECHA = [
+    'FECHA REGISTRO',
+    'FECHA TOMA MUESTRA',
+    'FECHA ENVIO MUESTRAS A ESPAÑA',
+    'FECHA DE RECIBIDO',
+]
+
+# Reglas por fila. 'tipo' define cómo se evalúa:
+#   cedula_vacia, cedula_formato, cedula_duplicada: sobre CEDULA
+#   fecha_invalida, fecha_futura: sobre cada columna de 'columnas'
+#   orden: 'despues' no puede ser anterior a 'antes' (si ambas tienen fecha)
+#   si_no_variante: acepta la variante pero no es 'SI'/'NO' exacto (los
+#     gráficos y KPIs que comparan con 'SI' no la cuentan)
+#   si_no_desconocido: valor que no es ninguna variante de SI/NO
+#   rango: valor numérico fuera de [minimo, maximo]
+REGLAS_VALIDACION = [
+    {'id': 'cedula_vacia', 'nombre': 'CEDULA vacía', 'tipo': 'cedula_vacia',
+     'severidad': 'error'},
+    {'id': 'cedula_formato', 'nombre': 'CEDULA con formato inválido (solo dígitos, 5 a 12)',
+     'tipo': 'cedula_formato', 'severidad': 'error'},
+    {'id': 'cedula_duplicada', 'nombre': 'CEDULA repetida en el archivo',
+     'tipo': 'cedula_duplicada', 'severidad': 'advertencia'},
+    {'id': 'fecha_invalida', 'nombre': 'Fecha que no se puede interpretar',
+     'tipo': 'fecha_invalida', 'columnas': COLUMNAS_FECHA, 'severidad': 'error'},
+    {'id': 'fecha_futura', 'nombre': 'Fecha posterior a hoy',
+     'tipo': 'fecha_futura', 'columnas': COLUMNAS_FECHA, 'severidad': 'advertencia'},
+    {'id': 'toma_antes_registro', 'nombre': 'Toma de muestra anterior al registro',
+     'tipo': 'orden', 'antes': 'FECHA REGISTRO', 'despues': 'FECHA TOMA MUESTRA',
+     'severidad': 'advertencia'},
+    {'id': 'envio_antes_toma', 'nombre': 'Envío a España anterior a la toma',
+     'tipo': 'orden', 'antes': 'FECHA TOMA MUESTRA', 'despues': 'FECHA ENVIO MUESTRAS A ESPAÑA',
+     'severidad': 'advertencia'},
+    {'id': 'recibido_antes_envio', 'nombre': 'Recibido antes del envío a España',
+     'tipo': 'orden', 'antes': 'FECHA ENVIO MUESTRAS A ESPAÑA', 'despues': 'FECHA DE RECIBIDO',
+     'severidad': 'advertencia'},
+    {'id': 'si_no_variante', 'nombre': "SI/NO escrito distinto de 'SI'/'NO'",
+     'tipo': 'si_no_variante', 'columnas': COLUMNAS_SI_NO, 'severidad': 'advertencia'},
+    {'id': 'si_no_desconocido', 'nombre': 'Valor que no es SI ni NO',
+     'tipo': 'si_no_desconocido', 'columnas': COLUMNAS_SI_NO, 'severidad': 'error'},
+    {'id': 'edad_fuera_rango', 'nombre': 'EDAD fuera de 0 a 120',
+     'tipo': 'rango', 'columna': 'EDAD', 'minimo': 0, 'maximo': 120,
+     'severidad': 'advertencia'},
+]
+
+PATRON_CEDULA = r'^\d{5,12}$'
+
+# Reportes guardados por (versión de datos, día): la regla de fechas
+# futuras depende de la fecha de hoy
+MAX_REPORTES = 8
+
+_reportes = OrderedDict()
+_lock = threading.Lock()
+
+
+def revisar_esquema(columnas):
+    """Problemas de columnas: faltantes y nombres con espacios de más"""
+    presentes = [str(c) for c in columnas]
+    sin_espacios = {c.strip(): c for c in presentes}
+    problemas = []
+    for esperada in COLUMNAS_ESPERADAS:
+        if esperada in presentes:
+            continue
+        severidad = 'error' if esperada in COLUMNAS_OBLIGATORIAS else 'advertencia'
+        if esperada in sin_espacios:
+            problemas.append({
+                'columna': esperada, 'severidad': severidad,
+                'problema': f"Nombre con espacios: '{sin_espacios[esperada]}'",
+            })
+        else:
+            problemas.append({'columna': esperada, 'severidad': severidad, 'problema': 'Falta la columna'})
+    return problemas
+
+
+# Clases de un valor en una columna SI/NO
+VACIO, CANONICO, VARIANTE, DESCONOCIDO = 0, 1, 2, 3
+
+
+def _derivada(cache, clave, calcular):
+    """Columnas derivadas (fechas, claves...) calculadas una sola vez por validación"""
+    if clave not in cache:
+        cache[clave] = calcular()
+    return cache[clave]
+
+
+def _fechas(df, columna, cache):
+    def calcular():
+        serie = df[columna]
+        if not pd.api.types.is_datetime64_any_dtype(serie):
+            if pd.api.types.is_numeric_dtype(serie) and serie.notna().any():
+                # Números sueltos (no fechas de Excel) no se interpretan como fecha
+                serie = pd.Series(pd.NaT, index=serie.index)
+            else:
+                serie = pd.to_datetime(serie, errors='coerce', dayfirst=True)
+        return serie.to_numpy(dtype='datetime64[ns]')
+    return _derivada(cache, ('fecha', columna), calcular)
+
+
+def _cedulas(df, cache):
+    """(vacía, formato válido, repetida) por fila, en una sola pasada"""
+    def calcular():
+        serie = df['CEDULA']
+        vacia = serie.isna().to_numpy()
+        if pd.api.types.is_numeric_dtype(serie):
+            # Cédulas numéricas: sin pasar a texto
+            numeros = serie.to_numpy(dtype='float64')
+            valida = (numeros == np.floor(numeros)) & (numeros >= 1e4) & (numeros < 1e12)
+            repetida = serie.duplicated(keep=False).to_numpy()
+        else:
+            # Los valores distintos se normalizan una vez y se propagan a las filas
+            codigos, valores = pd.factorize(serie)
+            claves = pd.Series(valores).astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+            valida = claves.str.match(PATRON_CEDULA).to_numpy()[codigos]
+            codigos_clave = np.where(vacia, -1, pd.factorize(claves)[0][codigos])
+            repetida = np.zeros(len(serie), dtype=bool)
+            repetida[~vacia] = pd.Series(codigos_clave[~vacia]).duplicated(keep=False).to_numpy()
+        return vacia, ~vacia & valida, ~vacia & repetida
+    return _derivada(cache, 'cedula', calcular)
+
+
+def _clases_si_no(df, columna, cache):
+    """Clase de cada fila (VACIO, CANONICO, VARIANTE, DESCONOCIDO) vía sus valores distintos"""
+    def calcular():
+        codigos, valores = pd.factorize(df[columna])
+        clases = np.array([
+            CANONICO if v in ('SI', 'NO') else VARIANTE if v in VALORES_SI + VALORES_NO else DESCONOCIDO
+            for v in valores
+        ] + [VACIO], dtype=np.int8)
+        # El código -1 (vacío) toma el último elemento
+        return clases[codigos]
+    return _derivada(cache, ('si_no', columna), calcular)
+
+
+def _evaluar_regla(df, regla, cache, hoy):
+    """Máscaras {columna: máscara booleana} de las filas que incumplen la regla"""
+    tipo = regla['tipo']
+
+    if tipo.startswith('cedula'):
+        if 'CEDULA' not in df.columns:
+            return {}
+        vacia, valida, repetida = _cedulas(df, cache)
+        if tipo == 'cedula_vacia':
+            return {'CEDULA': vacia}
+        if tipo == 'cedula_formato':
+            return {'CEDULA': ~vacia & ~valida}
+        return {'CEDULA': repetida}
+
+    if tipo in ('fecha_invalida', 'fecha_futura'):
+        mascaras = {}
+        for columna in regla['columnas']:
+            if columna not in df.columns:
+                continue
+            valores = _fechas(df, columna, cache)
+            if tipo == 'fecha_invalida':
+                mascaras[columna] = df[columna].notna().to_numpy() & np.isnat(valores)
+            else:
+                mascaras[columna] = ~np.isnat(valores) & (valores > hoy)
+        return mascaras
+
+    if tipo == 'orden':
+        if regla['antes'] not in df.columns or regla['despues'] not in df.columns:
+            return {}
+        antes, despues = _fechas(df, regla['antes'], cache), _fechas(df, regla['despues'], cache)
+        return {regla['despues']: ~np.isnat(antes) & ~np.isnat(despues) & (despues < antes)}
+
+    if tipo in ('si_no_variante', 'si_no_desconocido'):
+        mascaras = {}
+        for columna in regla['columnas']:
+            if columna not in df.columns:
+                continue
+            clase = VARIANTE if tipo == 'si_no_variante' else DESCONOCIDO
+            mascaras[columna] = _clases_si_no(df, columna, cache) == clase
+        return mascaras
+
+    if tipo == 'rango':
+        columna = regla['columna']
+        if columna not in df.columns:
+            return {}
+        numeros = pd.to_numeric(df[columna], errors='coerce')
+        fuera = df[columna].notna() & ~numeros.between(regla['minimo'], regla['maximo'])
+        return {columna: fuera.to_numpy()}
+
+    raise ValueError(f"Tipo de regla desconocido: {tipo}")
+
+
+def validar(df, version=None, reglas=REGLAS_VALIDACION, hoy=None):
+    """
+    Valida el DataFrame y retorna el reporte:
+
+        {'version', 'filas', 'esquema': [problemas de columnas],
+         'reglas': [{'id', 'nombre', 'severidad', 'total',
+                     'incumplimientos': {columna: posiciones}}],
+         'errores', 'advertencias', 'bloqueante'}
+
+    'bloqueante' es True si falta una columna obligatoria. Con versión, el
+    reporte se guarda y se reutiliza durante ese día.
+    """
+    hoy = pd.Timestamp(hoy if hoy is not None else pd.Timestamp.now()).normalize()
+    clave = (version, hoy.date())
+    if version is not None:
+        with _lock:
+            if clave in _reportes:
+                _reportes.move_to_end(clave)
+                return _reportes[clave]
+
+    hoy = np.datetime64(hoy.to_datetime64(), 'ns')
+
+    # Fechas, cédulas y clases SI/NO se derivan una sola vez para todas las reglas
+    cache = {}
+
+    esquema = revisar_esquema(df.columns)
+    resultados = []
+    for regla in reglas:
+        mascaras = _evaluar_regla(df, regla, cache, hoy)
+        incumplimientos = {
+            columna: np.flatnonzero(mascara) for columna, mascara in mascaras.items() if mascara.any()
+        }
+        resultados.append({
+            'id': regla['id'],
+            'nombre': regla['nombre'],
+            'severidad': regla['severidad'],
+            'total': int(sum(len(p) for p in incumplimientos.values())),
+            'incumplimientos': incumplimientos,
+        })
+
+    problemas = esquema + [r for r in resultados if r['total']]
+    reporte = {
+        'version': version,
+        'filas': len(df),
+        'esquema': esquema,
+        'reglas': resultados,
+        'errores': sum(1 for p in problemas if p['severidad'] == 'error'),
+        'advertencias': sum(1 for p in problemas if p['severidad'] == 'advertencia'),
+        'bloqueante': any(c not in df.columns for c in COLUMNAS_OBLIGATORIAS),
+    }
+
+    if version is not None:
+        with _lock:
+            _reportes[clave] = reporte
+            while len(_reportes) > MAX_REPORTES:
+                _reportes.popitem(last=False)
+    return reporte
+
+
+def reporte_en_cache(version):
+    """Reporte ya calculado hoy para esa versión de datos, o None"""
+    with _lock:
+        return _reportes.get((version, date.today()))
+
+
+def filas_reporte(df, reporte):
+    """
+    Tabla descargable: una fila por incumplimiento, con la fila del Excel
+    (encabezado en la fila 1), CEDULA, NOMBRE, columna y valor.
+    """
+    partes = [pd.DataFrame({
+        'Regla': '(esquema)', 'Severidad': p['severidad'], 'Fila Excel': None,
+        'CEDULA': None, 'NOMBRE': None, 'Columna': p['columna'], 'Valor': p['problema'],
+    }, index=[0]) for p in reporte['esquema']]
+
+    for regla in reporte['reglas']:
+        for columna, posiciones in regla['incumplimientos'].items():
+            filas = df.iloc[posiciones]
+            partes.append(pd.DataFrame({
+                'Regla': regla['nombre'],
+                'Severidad': regla['severidad'],
+                'Fila Excel': posiciones + 2,
+                'CEDULA': filas['CEDULA'].to_numpy() if 'CEDULA' in df.columns else None,
+                'NOMBRE': filas['NOMBRE'].to_numpy() if 'NOMBRE' in df.columns else None,
+                'Columna': columna,
+                'Valor': filas[columna].astype(str).to_numpy(),
+            }))
+
+    if not partes:
+        return pd.DataFrame(columns=['Regla', 'Severidad', 'Fila Excel', 'CEDULA', 'NOMBRE', 'Columna', 'Valor'])
+    return pd.concat(partes, ignore_index=True)